@@ -0,0 +1,189 @@
+import math
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator
+import numpy as np
+from user_recommendation import UserRecommendation
+from group_recommendation import GroupRecommendation
+from shared_dataset import SharedDataset
+import group_aggregation
+
+# Recommender of the worker processes, attached once by _init_worker
+_worker_user_recommendation: UserRecommendation = None
+
+
+def _init_worker(descriptor: dict, recommender_class: type, configuration: dict) -> None:
+    # Same kind and settings of the recommender of the owner process (see UserRecommendation.configuration)
+    global _worker_user_recommendation
+    _worker_user_recommendation = recommender_class.from_configuration(SharedDataset.attach(descriptor), configuration)
+
+
+def _user_states_in_worker(users: list[int], n: int, neighbor_size: int) -> dict[int, tuple]:
+    return BatchRecommendation.user_states(_worker_user_recommendation, users, n, neighbor_size)
+
+
+class BatchRecommendation:
+    """
+    Group recommendations for many groups at once, e.g. for a nightly batch job.
+
+    The neighbors and the top N recommendations of each distinct member are computed once, however many groups
+    they belong to (optionally in a pool of worker processes sharing the dataset), and kept in a bounded LRU cache.
+    Groups are consumed and their results yielded chunk by chunk, so memory doesn't grow with the number of groups.
+    The results are the ones of GroupRecommendation.get_recommendations_satisfactions_and_disagreements_for_group.
+    """
+
+    def __init__(self, group_recommendation: GroupRecommendation, n: int = 10, neighbor_size: int = 50,
+                 max_cached_users: int = 50_000) -> None:
+        """
+        Args:
+            group_recommendation (GroupRecommendation): Group recommender.
+            n (int, optional): Number of recommendations of each member and of each group. Defaults to 10.
+            neighbor_size (int, optional): Number of neighbors of the members. Defaults to 50.
+            max_cached_users (int, optional): Maximum number of members whose neighbors and recommendations are kept.
+        """
+        self.group_recommendation = group_recommendation
+        self.n = n
+        self.neighbor_size = neighbor_size
+        self.max_cached_users = max_cached_users
+
+        # user -> (neighbor IDs, similarities, top movie IDs, top ratings), least recently used first
+        self._user_states: OrderedDict[int, tuple] = OrderedDict()
+        self._version = group_recommendation.user_recommendation.dataset.version
+
+
+    @staticmethod
+    def user_states(user_recommendation: UserRecommendation, users: list[int], n: int = 10,
+                    neighbor_size: int = 50) -> dict[int, tuple]:
+        """
+        Computes the neighbors and the top N recommendations of several users.
+
+        Returns:
+            dict[int, tuple]: user -> (neighbor IDs, similarities, top movie IDs, top predicted ratings) arrays.
+        """
+        states = {}
+
+        for user in users:
+            neighbors = user_recommendation.top_n_similar_users(user, n=neighbor_size)
+
+            # Same as top_n_recommendations, reusing the neighbors
+            top = user_recommendation.recommendations_from_neighbors(user, neighbors, n)
+
+            states[user] = (np.array([other_user for other_user, _ in neighbors], dtype=np.int64),
+                            np.array([similarity for _, similarity in neighbors], dtype=float),
+                            np.array([movie for movie, _ in top], dtype=np.int64),
+                            np.array([rating for _, rating in top], dtype=float))
+
+        return states
+
+
+    def recommend(self, groups: Iterable[set[int]], aggreg_method: Callable = None, processes: int = 1,
+                  chunk_size: int = 256) -> Iterator[tuple[int, tuple]]:
+        """
+        Recommends movies to many groups.
+
+        Args:
+            groups (Iterable[set[int]]): Groups of user IDs, any iterable (e.g. a generator reading them from a file).
+            aggreg_method (function, optional): Aggregation method of the GroupRecommendation.
+                Defaults to weighted_average_aggregation_from_users_recommendations.
+            processes (int, optional): Number of worker processes computing the members, 1 runs in the current process.
+                The workers rebuild the recommender with the same settings and indexes (see UserRecommendation.configuration).
+            chunk_size (int, optional): Number of groups read and processed at a time. Defaults to 256.
+
+        Yields:
+            tuple[int, tuple]: Position of the group in `groups` and its (recommendations, satisfactions, disagreements).
+
+        Raises:
+            ValueError: If processes > 1 and the recommender can't be rebuilt in the worker processes.
+        """
+        if aggreg_method is None:
+            aggreg_method = self.group_recommendation.weighted_average_aggregation_from_users_recommendations
+
+        groups = iter(groups)
+        position = 0
+
+        user_recommendation = self.group_recommendation.user_recommendation
+        if processes > 1 and not hasattr(user_recommendation, 'from_configuration'):
+            raise ValueError(f'{type(user_recommendation).__name__} can not be rebuilt in worker processes, use processes=1')
+
+        executor = None
+        shared_dataset = None
+        if processes > 1:
+            shared_dataset = SharedDataset(user_recommendation.dataset)
+            executor = ProcessPoolExecutor(processes, initializer=_init_worker,
+                                           initargs=(shared_dataset.descriptor, type(user_recommendation),
+                                                     user_recommendation.configuration()))
+
+        try:
+            while True:
+                chunk = list(islice(groups, chunk_size))
+                if len(chunk) == 0:
+                    break
+
+                self._compute_users(chunk, executor, processes)
+
+                for group in chunk:
+                    yield position, self._recommend_group(group, aggreg_method)
+                    position += 1
+        finally:
+            if executor is not None:
+                executor.shutdown()
+                shared_dataset.close()
+
+
+    def _compute_users(self, groups: list[set[int]], executor: ProcessPoolExecutor, processes: int) -> None:
+        users = list(dict.fromkeys(user for group in groups for user in group))
+
+        # New ratings can change the neighbors of any user
+        version = self.group_recommendation.user_recommendation.dataset.version
+        if version != self._version:
+            self._user_states.clear()
+            self._version = version
+
+        missing = []
+        for user in users:
+            if user in self._user_states:
+                self._user_states.move_to_end(user)
+            else:
+                missing.append(user)
+
+        if executor is None:
+            states = BatchRecommendation.user_states(self.group_recommendation.user_recommendation, missing, self.n, self.neighbor_size)
+        else:
+            tasks_size = max(1, math.ceil(len(missing) / processes))
+            futures = [executor.submit(_user_states_in_worker, missing[start:start + tasks_size], self.n, self.neighbor_size)
+                       for start in range(0, len(missing), tasks_size)]
+
+            states = {}
+            for future in futures:
+                states.update(future.result())
+
+        self._user_states.update(states)
+
+        # Evict the least recently used members, but never the ones of the current chunk
+        while len(self._user_states) > max(self.max_cached_users, len(users)):
+            self._user_states.popitem(last=False)
+
+
+    def _recommend_group(self, group: set[int], aggreg_method: Callable) -> tuple:
+        states = {user: self._user_states[user] for user in group}
+
+        users_rec = {user: list(zip(top_movies.tolist(), top_ratings.tolist()))
+                     for user, (_, _, top_movies, top_ratings) in states.items()}
+        neighbors_by_user = {user: list(zip(neighbor_ids.tolist(), similarities.tolist()))
+                             for user, (neighbor_ids, similarities, _, _) in states.items()}
+
+        kernel = self.group_recommendation.get_aggregation_kernel(aggreg_method)
+        if kernel is not None:
+            return self.group_recommendation._aggregate_group(users_rec, kernel, self.n, self.neighbor_size, neighbors_by_user)
+
+        # Other aggregation methods go through the dict-of-lists API
+        movies = list({movie for top_rec in users_rec.values() for movie, _ in top_rec})
+        ratings, _ = self.group_recommendation.users_ratings(list(group), movies, self.neighbor_size, neighbors_by_user)
+        aggreg_rec = group_aggregation.to_users_recommendations(movies, ratings)
+
+        group_rec = aggreg_method(aggreg_rec)
+        satisfactions = self.group_recommendation.calculate_satisfactions(group, users_rec, group_rec, aggreg_rec)
+        disagreements = [(movie, self.group_recommendation.get_disagreement(aggreg_rec[movie])) for movie, _ in group_rec]
+
+        return group_rec, satisfactions, disagreements
@@ -0,0 +1,310 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable
+import numpy as np
+import pandas as pd
+from dataset import Dataset
+from user_recommendation import UserRecommendation
+from group_recommendation import GroupRecommendation
+from sequential_recommendation import SequentialRecommendation
+from synthetic_dataset import SyntheticDataset
+from lsh_index import LSHIndex
+
+
+class Benchmark:
+    """
+    Measures latency, throughput and peak memory of callables and collects the results in a JSON document,
+    so that runs of different commits can be compared (see compare).
+
+    Each case is run `warmup` times untimed, `repeat` times timed and once more under tracemalloc for the
+    peak memory, so that tracing doesn't slow down the timed runs.
+    """
+
+    def __init__(self, repeat: int = 5, warmup: int = 1, measure_memory: bool = True) -> None:
+        self.repeat = repeat
+        self.warmup = warmup
+        self.measure_memory = measure_memory
+        self.results: list[dict] = []
+
+
+    def measure(self, name: str, function: Callable[[], object], operations: int = 1, params: dict = None) -> dict:
+        """
+        Benchmarks a callable.
+
+        Args:
+            name (str): Name of the case.
+            function (function): Callable without arguments running the case.
+            operations (int, optional): Number of operations (e.g. users served) of a call, for the per operation
+                latency and the throughput. Defaults to 1.
+            params (dict, optional): Parameters of the case, part of its identity when comparing runs.
+
+        Returns:
+            dict: The result, also appended to `results`.
+        """
+        for _ in range(self.warmup):
+            function()
+
+        timings = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+
+        peak_memory = None
+        if self.measure_memory:
+            tracemalloc.start()
+            try:
+                function()
+                peak_memory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        timings = np.array(timings)
+        latencies = timings / operations
+
+        result = {
+            'name': name,
+            'params': params or {},
+            'operations': operations,
+            'repeat': self.repeat,
+            'latency_mean': float(latencies.mean()),
+            'latency_median': float(np.median(latencies)),
+            'latency_p95': float(np.percentile(latencies, 95)),
+            'latency_min': float(latencies.min()),
+            'throughput': float(operations / np.median(timings)),
+            'peak_memory_bytes': peak_memory,
+        }
+        self.results.append(result)
+
+        return result
+
+
+    @staticmethod
+    def environment() -> dict:
+        """
+        Versions and commit of the run, stored with the results.
+        """
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+        except OSError:
+            commit = None
+
+        return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+                'pandas': pd.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+
+
+    def to_dict(self, **metadata) -> dict:
+        return {'environment': Benchmark.environment(), 'metadata': metadata, 'results': self.results}
+
+
+    def save(self, path: str, **metadata) -> None:
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(**metadata), file, indent=2)
+
+
+    @staticmethod
+    def compare(baseline: dict, current: dict, tolerance: float = 0.1) -> list[dict]:
+        """
+        Compares two runs on the median latency of the cases they have in common.
+
+        Args:
+            baseline (dict): Results of the reference run (see to_dict), e.g. loaded from its JSON file.
+            current (dict): Results of the run to check.
+            tolerance (float, optional): Allowed relative slowdown. Defaults to 0.1 (10%).
+
+        Returns:
+            list[dict]: One entry per common case with name, params, baseline and current latency, ratio
+                and whether it is a regression.
+        """
+        def key(result):
+            return result['name'], json.dumps(result['params'], sort_keys=True)
+
+        baseline_results = {key(result): result for result in baseline['results']}
+
+        comparisons = []
+        for result in current['results']:
+            reference = baseline_results.get(key(result))
+            if reference is None:
+                continue
+
+            ratio = result['latency_median'] / reference['latency_median'] if reference['latency_median'] > 0 else float('inf')
+            comparisons.append({'name': result['name'], 'params': result['params'],
+                                'baseline': reference['latency_median'], 'current': result['latency_median'],
+                                'ratio': ratio, 'regression': ratio > 1 + tolerance})
+
+        return comparisons
+
+
+def run_suite(scale: str = 'small', seed: int = 0, backends: list[str] = ('dict', 'sparse'),
+              metrics: list[str] = None, group_sizes: list[int] = (3, 5, 10, 25, 50),
+              iterations: list[int] = (1, 3, 5), users: int = 20, repeat: int = 3,
+              measure_memory: bool = True, log: Callable[[str], None] = print,
+              ann_probes: list[int] = (0, 2, 4), neighbors: int = 50) -> Benchmark:
+    """
+    Runs the benchmarks of the recommendation pipelines on a synthetic dataset.
+
+    Cases:
+        - dataset: Dataset construction, for each backend.
+        - top_n_recommendations: UserRecommendation.top_n_recommendations for each similarity metric, per user.
+        - group_recommendation: get_recommendations_satisfactions_and_disagreements_for_group for each group size.
+        - sequential_recommendation: get_sequential_recommendations_for_group for each number of iterations.
+        - top_n_similar_users: exact scan and LSH retrieval (for each number of probes) of the neighbors of the sampled
+          users, for each metric supported by LSHIndex. The LSH results also report `recall_at_k`, the fraction of the
+          exact top K neighbors retrieved from the LSH candidates (None if no user was), and `fallback_fraction`, the
+          fraction of the users with too few or too many candidates, served by the exact scan instead.
+
+    Args:
+        scale (str, optional): Size of the synthetic dataset (see SyntheticDataset.SCALES). Defaults to 'small'.
+        seed (int, optional): Seed of the dataset and of the sampled users and groups. Defaults to 0.
+        backends (list[str], optional): Dataset backends to benchmark the construction of.
+        metrics (list[str], optional): Similarity metric names (e.g. 'pcc'). Defaults to all the vectorized ones.
+        group_sizes (list[int], optional): Group sizes.
+        iterations (list[int], optional): Numbers of iterations of the sequential recommendations (groups of 5 users).
+        users (int, optional): Number of sampled users of the top_n_recommendations cases. Defaults to 20.
+        repeat (int, optional): Timed runs per case. Defaults to 3.
+        measure_memory (bool, optional): Measure the peak memory of each case. Defaults to True.
+        log (function, optional): Progress messages. Defaults to print.
+        ann_probes (list[int], optional): Extra buckets per table probed by the LSH neighbor retrieval.
+        neighbors (int, optional): K of the top_n_similar_users cases. Defaults to 50.
+
+    Returns:
+        Benchmark: The benchmark with the results.
+    """
+    benchmark = Benchmark(repeat=repeat, measure_memory=measure_memory)
+    rng = np.random.default_rng(seed)
+
+    ratings_df, movies_df = SyntheticDataset.from_scale(scale, seed).generate()
+    log(f'{scale}: {len(ratings_df)} ratings, {ratings_df["userId"].nunique()} users, {len(movies_df)} movies')
+
+    for backend in backends:
+        result = benchmark.measure('dataset', lambda: Dataset(ratings_df, backend, movies_df=movies_df, lazy_datetime=True),
+                                   params={'backend': backend})
+        log(f'dataset[{backend}]: {result["latency_median"]:.3f}s')
+
+    dataset = Dataset(ratings_df, 'sparse', movies_df=movies_df, lazy_datetime=True)
+    user_ids = dataset.get_user_ids()
+    sampled_users = rng.choice(user_ids, size=min(users, len(user_ids)), replace=False).tolist()
+
+    metrics = metrics if metrics is not None else list(UserRecommendation.VECTORIZED_SIMILARITIES.values())
+
+    for metric in metrics:
+        def top_n_recommendations():
+            # A new recommender per run, so that no similarity is served from a previous run
+            user_rec = UserRecommendation(dataset)
+            for user in sampled_users:
+                user_rec.top_n_recommendations(user, user_rec.get_similarity_function(metric))
+
+        result = benchmark.measure('top_n_recommendations', top_n_recommendations, operations=len(sampled_users),
+                                   params={'metric': metric})
+        log(f'top_n_recommendations[{metric}]: {result["latency_median"] * 1000:.2f}ms/user')
+
+    for metric in [metric for metric in metrics if metric in LSHIndex.METRICS]:
+        user_rec = UserRecommendation(dataset)
+        similarity_function = user_rec.get_similarity_function(metric)
+
+        def exact_neighbors():
+            exact_rec = UserRecommendation(dataset)
+            for user in sampled_users:
+                exact_rec.top_n_similar_users(user, exact_rec.get_similarity_function(metric), neighbors)
+
+        result = benchmark.measure('top_n_similar_users', exact_neighbors, operations=len(sampled_users),
+                                   params={'metric': metric, 'mode': 'exact'})
+        log(f'top_n_similar_users[{metric}, exact]: {result["latency_median"] * 1000:.2f}ms/user')
+
+        exact = {user: {other_user for other_user, _ in user_rec.top_n_similar_users(user, similarity_function, neighbors)}
+                 for user in sampled_users}
+        approximate_index = user_rec.build_approximate_index(similarity_function)
+
+        # MinHash has no multi-probe
+        for probes in ann_probes if approximate_index.scheme != 'minhash' else [0]:
+            approximate_index.probes = probes
+            result = benchmark.measure('top_n_similar_users', lambda: [user_rec.top_n_similar_users(user, similarity_function, neighbors)
+                                                                       for user in sampled_users],
+                                       operations=len(sampled_users), params={'metric': metric, 'mode': 'lsh', 'probes': probes})
+
+            # The recall only counts the users served from the LSH candidates: the others (too few or too many
+            # candidates) fall back to the exact scan, whose neighbors are always the exact ones
+            approximate = {user: user_rec._approximate_top_n_similar_users(user, similarity_function, approximate_index, neighbors)
+                           for user in sampled_users}
+            recalls = [len(exact[user] & {other_user for other_user, _ in approximate[user]}) / max(len(exact[user]), 1)
+                       for user in sampled_users if approximate[user] is not None]
+
+            result['recall_at_k'] = float(np.mean(recalls)) if recalls else None
+            result['fallback_fraction'] = 1 - len(recalls) / len(sampled_users)
+            recall = f'{result["recall_at_k"]:.3f}' if recalls else 'n/a'
+            log(f'top_n_similar_users[{metric}, lsh, probes={probes}]: {result["latency_median"] * 1000:.2f}ms/user, '
+                f'recall@{neighbors} {recall}, {result["fallback_fraction"]:.0%} exact fallbacks')
+
+    for group_size in group_sizes:
+        group = set(rng.choice(user_ids, size=min(group_size, len(user_ids)), replace=False).tolist())
+
+        def group_recommendation():
+            GroupRecommendation(UserRecommendation(dataset)).get_recommendations_satisfactions_and_disagreements_for_group(group)
+
+        result = benchmark.measure('group_recommendation', group_recommendation, params={'group_size': group_size})
+        log(f'group_recommendation[{group_size}]: {result["latency_median"]:.3f}s')
+
+    group = set(rng.choice(user_ids, size=min(5, len(user_ids)), replace=False).tolist())
+
+    for iteration_count in iterations:
+        def sequential_recommendation():
+            seq_rec = SequentialRecommendation(GroupRecommendation(UserRecommendation(dataset)))
+            seq_rec.get_sequential_recommendations_for_group(group, iteration_count)
+
+        result = benchmark.measure('sequential_recommendation', sequential_recommendation, operations=iteration_count,
+                                   params={'iterations': iteration_count, 'group_size': len(group)})
+        log(f'sequential_recommendation[{iteration_count}]: {result["latency_median"]:.3f}s/iteration')
+
+    return benchmark
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks of the recommendation pipelines on synthetic datasets.')
+    parser.add_argument('--scale', default='small', choices=tuple(SyntheticDataset.SCALES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--users', type=int, default=20, help='sampled users of the top_n_recommendations cases')
+    parser.add_argument('--backends', nargs='+', default=['dict', 'sparse'], choices=Dataset.BACKENDS)
+    parser.add_argument('--metrics', nargs='+', default=None, help='similarity metrics (e.g. pcc), defaults to all the vectorized ones')
+    parser.add_argument('--group-sizes', nargs='+', type=int, default=[3, 5, 10, 25, 50])
+    parser.add_argument('--iterations', nargs='+', type=int, default=[1, 3, 5])
+    parser.add_argument('--ann-probes', nargs='+', type=int, default=[0, 2, 4], help='extra buckets per table of the LSH neighbor cases')
+    parser.add_argument('--neighbors', type=int, default=50, help='K of the top_n_similar_users cases')
+    parser.add_argument('--no-memory', action='store_true', help="don't measure the peak memory")
+    parser.add_argument('--output', help='JSON file of the results')
+    parser.add_argument('--compare', help='JSON file of a baseline run, exits with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative slowdown against the baseline')
+    args = parser.parse_args(argv)
+
+    benchmark = run_suite(args.scale, args.seed, args.backends, args.metrics, args.group_sizes, args.iterations,
+                          args.users, args.repeat, not args.no_memory, ann_probes=args.ann_probes, neighbors=args.neighbors)
+    metadata = {'scale': args.scale, 'seed': args.seed}
+
+    if args.output:
+        benchmark.save(args.output, **metadata)
+
+    if args.compare:
+        with open(args.compare) as file:
+            comparisons = Benchmark.compare(json.load(file), benchmark.to_dict(**metadata), args.tolerance)
+
+        for comparison in comparisons:
+            flag = 'REGRESSION' if comparison['regression'] else 'ok'
+            print(f'{flag:>10} {comparison["name"]} {comparison["params"]}: '
+                  f'{comparison["baseline"]:.6f}s -> {comparison["current"]:.6f}s ({comparison["ratio"]:.2f}x)')
+
+        if any(comparison['regression'] for comparison in comparisons):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import numpy as np
+import dataset
+
+
+class CandidateGenerator:
+    """
+    Candidate generation stage of the user recommendations: the movies worth scoring for a user.
+
+    The prediction of a movie that none of the neighbors rated is just the user's mean rating, so the candidates are
+    the movies rated by the neighbors, optionally extended with the most popular movies of the catalog and with
+    the most popular movies of the user's favorite genres. UserRecommendation scores only the candidates and
+    completes the top N with the mean fallbacks when needed, so the top N is the one of scoring the whole catalog.
+    """
+
+    def __init__(self, dataset: dataset.Dataset, popular: int = 0, genre_candidates: int = 0, top_genres: int = 3) -> None:
+        """
+        Args:
+            dataset (dataset.Dataset): Dataset of the recommendations.
+            popular (int, optional): Number of most rated movies added to the candidates. Defaults to 0.
+            genre_candidates (int, optional): Number of most rated movies of each favorite genre added to the candidates.
+                Defaults to 0.
+            top_genres (int, optional): Number of favorite genres of a user, the genres of most of its rated movies.
+                Defaults to 3.
+        """
+        self.dataset = dataset
+        self.popular = popular
+        self.genre_candidates = genre_candidates
+        self.top_genres = top_genres
+
+        # Movie IDs by descending number of ratings and their genres (multi-hot), rebuilt when the dataset changes
+        self._popularity: np.ndarray = None
+        self._popularity_genres: np.ndarray = None
+        self._popularity_version: int = None
+
+
+    def candidates(self, user: int, neighbors: list[tuple[int, float]], exclude_movies: set[int] = ()) -> np.ndarray:
+        """
+        Generates the candidate movies of a user.
+
+        Args:
+            user (int): ID of the user.
+            neighbors (list[tuple[int, float]]): Neighbors of the user and their similarity scores.
+            exclude_movies (set[int], optional): Movies that must not be recommended.
+
+        Returns:
+            np.ndarray: Sorted IDs of the candidate movies of the catalog, not rated by the user nor excluded.
+        """
+        matrix = self.dataset.rating_matrix
+
+        neighbor_indices = matrix.user_indices([other_user for other_user, _ in neighbors])
+        _, movie_indices, _ = matrix.gather_rows(neighbor_indices[neighbor_indices >= 0])
+        candidates = [matrix.movie_ids[np.unique(movie_indices)]]
+
+        if self.popular > 0:
+            candidates.append(self._popular_movies()[:self.popular])
+        if self.genre_candidates > 0 and self.top_genres > 0:
+            candidates.append(self._genre_movies(user))
+
+        candidates = np.unique(np.concatenate(candidates))
+
+        # Only unrated movies of the catalog
+        candidates = np.intersect1d(candidates, self.dataset.get_movie_ids(), assume_unique=True)
+        candidates = candidates[~np.isin(candidates, self.dataset.get_rated_movies(user))]
+        if len(exclude_movies) > 0:
+            candidates = candidates[~np.isin(candidates, list(exclude_movies))]
+
+        return candidates
+
+
+    def _popular_movies(self) -> np.ndarray:
+        if self._popularity is None or self._popularity_version != self.dataset.version:
+            matrix = self.dataset.rating_matrix
+            counts = np.bincount(matrix.indices, minlength=len(matrix.movie_ids))
+
+            # Equal counts in ascending movie ID order
+            self._popularity = matrix.movie_ids[np.argsort(-counts, kind='stable')]
+            self._popularity_genres = None
+            self._popularity_version = self.dataset.version
+
+        return self._popularity
+
+
+    def _genre_movies(self, user: int) -> np.ndarray:
+        metadata = self.dataset.movie_metadata
+
+        rated = self.dataset.get_rated_movies(user)
+        rated = rated[np.isin(rated, metadata.movie_ids)]
+        genre_counts = metadata.genre_matrix[metadata.rows(rated.tolist())].sum(axis=0)
+        favorite_genres = np.argsort(-genre_counts, kind='stable')[:self.top_genres]
+        favorite_genres = favorite_genres[genre_counts[favorite_genres] > 0]
+
+        # Most popular movies first, restricted to each favorite genre
+        popular = self._popular_movies()
+        popular = popular[np.isin(popular, metadata.movie_ids)]
+        if self._popularity_genres is None:
+            self._popularity_genres = metadata.genre_matrix[metadata.rows(popular.tolist())]
+        popular_genres = self._popularity_genres
+
+        return np.concatenate([popular[popular_genres[:, genre]][:self.genre_candidates] for genre in favorite_genres.tolist()]
+                              + [np.empty(0, dtype=popular.dtype)])
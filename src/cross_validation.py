@@ -0,0 +1,282 @@
+import math
+from typing import Iterator
+import numpy as np
+import pandas as pd
+from dataset import Dataset
+from evaluation import Evaluation
+from ranking import top_n_indices
+from user_recommendation import UserRecommendation
+
+
+class ErrorAccumulator:
+    """
+    Streaming accumulator of the MAE and RMSE of rating predictions.
+    """
+
+    def __init__(self) -> None:
+        self.abs_error = 0.0
+        self.squared_error = 0.0
+        self.count = 0
+
+
+    def update(self, predicted: np.ndarray, actual: np.ndarray) -> None:
+        errors = np.asarray(predicted, dtype=float) - np.asarray(actual, dtype=float)
+
+        self.abs_error += float(np.abs(errors).sum())
+        self.squared_error += float((errors ** 2).sum())
+        self.count += len(errors)
+
+
+    def merge(self, other: 'ErrorAccumulator') -> None:
+        self.abs_error += other.abs_error
+        self.squared_error += other.squared_error
+        self.count += other.count
+
+
+    @property
+    def mae(self) -> float:
+        return self.abs_error / self.count if self.count > 0 else 0.0
+
+
+    @property
+    def rmse(self) -> float:
+        return math.sqrt(self.squared_error / self.count) if self.count > 0 else 0.0
+
+
+class RankingAccumulator:
+    """
+    Streaming accumulator of precision@N, recall@N and NDCG@N, averaged over the users.
+
+    A test item is relevant if its rating is at least the relevance threshold, users without relevant
+    test items are not counted.
+    """
+
+    def __init__(self, n: int = 10, relevance_threshold: float = 4.0) -> None:
+        self.n = n
+        self.relevance_threshold = relevance_threshold
+
+        self.precision_sum = 0.0
+        self.recall_sum = 0.0
+        self.ndcg_sum = 0.0
+        self.users = 0
+
+        # Discount of each rank, the ideal DCG of r relevant items is the prefix sum up to min(r, n)
+        self._discounts = 1 / np.log2(np.arange(2, n + 2))
+        self._ideal_dcg = np.concatenate(([0.0], np.cumsum(self._discounts)))
+
+
+    def update(self, recommended: np.ndarray, test_items: np.ndarray, test_ratings: np.ndarray) -> None:
+        """
+        Args:
+            recommended (np.ndarray): Recommended item IDs, in rank order (only the first N are considered).
+            test_items (np.ndarray): Item IDs of the test ratings of the user.
+            test_ratings (np.ndarray): Test ratings of the user.
+        """
+        relevant = np.asarray(test_items)[np.asarray(test_ratings) >= self.relevance_threshold]
+        if len(relevant) == 0:
+            return
+
+        hits = np.isin(np.asarray(recommended)[:self.n], relevant)
+        num_hits = int(hits.sum())
+
+        self.precision_sum += num_hits / self.n
+        self.recall_sum += num_hits / len(relevant)
+        self.ndcg_sum += float(self._discounts[:len(hits)][hits].sum()) / self._ideal_dcg[min(len(relevant), self.n)]
+        self.users += 1
+
+
+    def merge(self, other: 'RankingAccumulator') -> None:
+        self.precision_sum += other.precision_sum
+        self.recall_sum += other.recall_sum
+        self.ndcg_sum += other.ndcg_sum
+        self.users += other.users
+
+
+    @property
+    def precision(self) -> float:
+        return self.precision_sum / self.users if self.users > 0 else 0.0
+
+
+    @property
+    def recall(self) -> float:
+        return self.recall_sum / self.users if self.users > 0 else 0.0
+
+
+    @property
+    def ndcg(self) -> float:
+        return self.ndcg_sum / self.users if self.users > 0 else 0.0
+
+
+class CrossValidation:
+    """
+    Cross-validation splits and evaluation of the user-based recommender.
+
+    Folds are (train positions, test positions) pairs of sorted arrays of row positions in the ratings
+    dataframe, so splitting never copies or shuffles the dataframe: each fold only gathers the columns
+    it needs to build its training dataset.
+    """
+
+    @staticmethod
+    def k_fold(ratings_df: pd.DataFrame, k: int = 5, seed: int = None) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """
+        Splits the ratings in k folds of (almost) equal size, assigned at random.
+
+        Args:
+            ratings_df (pd.DataFrame): Ratings dataframe.
+            k (int, optional): Number of folds. Defaults to 5.
+            seed (int, optional): Seed of the random assignment, the same seed gives the same folds.
+
+        Yields:
+            tuple[np.ndarray, np.ndarray]: Positions of the training and test ratings of each fold.
+        """
+        if k < 2:
+            raise ValueError(f'k-fold needs at least 2 folds, got {k}')
+
+        size = len(ratings_df)
+        permutation = np.random.default_rng(seed).permutation(size)
+
+        # Fold of each rating, a small integer per row instead of k index arrays
+        fold_of = np.empty(size, dtype=np.int16 if k <= np.iinfo(np.int16).max else np.int64)
+        fold_of[permutation] = np.arange(size) % k
+
+        for fold in range(k):
+            test = fold_of == fold
+            yield np.flatnonzero(~test), np.flatnonzero(test)
+
+
+    @staticmethod
+    def leave_last_out(ratings_df: pd.DataFrame, n: int = 1) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """
+        Holds out the last N ratings (by timestamp) of every user, users keep at least one training rating.
+
+        Args:
+            ratings_df (pd.DataFrame): Ratings dataframe with a `timestamp` column.
+            n (int, optional): Number of held out ratings per user. Defaults to 1.
+
+        Yields:
+            tuple[np.ndarray, np.ndarray]: Positions of the training and test ratings (a single fold).
+        """
+        users = ratings_df['userId'].to_numpy()
+        timestamps = ratings_df['timestamp'].to_numpy()
+
+        # Ratings of each user in time order, equal timestamps keep the row order
+        order = np.lexsort((timestamps, users))
+        sorted_users = users[order]
+
+        starts = np.flatnonzero(np.r_[True, sorted_users[1:] != sorted_users[:-1]])
+        counts = np.diff(np.r_[starts, len(order)])
+
+        # Position of each rating counted from the end of the ratings of its user
+        from_end = np.repeat(starts + counts, counts) - 1 - np.arange(len(order))
+        held_out = from_end < np.repeat(np.minimum(n, counts - 1), counts)
+
+        yield np.sort(order[~held_out]), np.sort(order[held_out])
+
+
+    @staticmethod
+    def temporal(ratings_df: pd.DataFrame, n_splits: int = 1, test_size: float = 0.2) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """
+        Time based splits: each fold trains on all the ratings before a point in time and tests on the following ones.
+
+        With more splits the test windows are consecutive and the last one ends with the most recent rating,
+        every fold trains on everything older than its test window (expanding window).
+
+        Args:
+            ratings_df (pd.DataFrame): Ratings dataframe with a `timestamp` column.
+            n_splits (int, optional): Number of folds. Defaults to 1.
+            test_size (float, optional): Fraction of the ratings in each test window. Defaults to 0.2.
+
+        Yields:
+            tuple[np.ndarray, np.ndarray]: Positions of the training and test ratings of each fold.
+        """
+        if n_splits < 1 or test_size <= 0 or n_splits * test_size >= 1:
+            raise ValueError(f'Invalid temporal split: {n_splits} windows of {test_size} of the ratings')
+
+        size = len(ratings_df)
+        order = np.argsort(ratings_df['timestamp'].to_numpy(), kind='stable')
+        window = int(size * test_size)
+
+        for fold in range(n_splits):
+            end = size - (n_splits - 1 - fold) * window
+            yield np.sort(order[:end - window]), np.sort(order[end - window:end])
+
+
+    @staticmethod
+    def _take(ratings_df: pd.DataFrame, positions: np.ndarray) -> pd.DataFrame:
+        # Only the columns the recommender needs, gathered in row order
+        columns = [column for column in ('userId', 'movieId', 'rating', 'timestamp') if column in ratings_df.columns]
+        return pd.DataFrame({column: ratings_df[column].to_numpy()[positions] for column in columns})
+
+
+    @staticmethod
+    def evaluate_fold(ratings_df: pd.DataFrame, train: np.ndarray, test: np.ndarray, similarity_function: str = 'pcc',
+                      neighbor_size: int = 50, n: int = 10, relevance_threshold: float = 4.0,
+                      movies_df: pd.DataFrame = None) -> dict[str, float]:
+        """
+        Trains the recommender on a fold and evaluates its predictions and top-N recommendations on the test ratings.
+
+        Args:
+            ratings_df (pd.DataFrame): Ratings dataframe.
+            train (np.ndarray): Positions of the training ratings.
+            test (np.ndarray): Positions of the test ratings.
+            similarity_function (str, optional): Name of the similarity function. Defaults to 'pcc'.
+            neighbor_size (int, optional): Number of neighbors. Defaults to 50.
+            n (int, optional): Length of the recommendation lists for the ranking metrics, None skips them. Defaults to 10.
+            relevance_threshold (float, optional): Minimum test rating of a relevant item. Defaults to 4.0.
+            movies_df (pd.DataFrame, optional): Movie catalog. Defaults to the MovieLens movies.
+
+        Returns:
+            dict[str, float]: mae, rmse, predictions, precision, recall, ndcg and users (evaluated for the ranking metrics).
+        """
+        movies_df = movies_df if movies_df is not None else Dataset.read_movies()
+        training_ds = Dataset(CrossValidation._take(ratings_df, train), 'sparse', movies_df=movies_df, lazy_datetime=True)
+        test_users = Evaluation._group_test_ratings(training_ds, CrossValidation._take(ratings_df, test))
+
+        user_rec = UserRecommendation(training_ds)
+        sim = user_rec.get_similarity_function(similarity_function)
+
+        errors = ErrorAccumulator()
+        ranking = RankingAccumulator(n, relevance_threshold) if n else None
+
+        for user, movies, real_ratings in test_users:
+            neighbors = user_rec.top_n_similar_users(user, sim, neighbor_size)
+
+            # Clip the prediction to the max possible rating value to avoid inflated errors
+            errors.update(np.minimum(user_rec.predictions_from_neighbors(user, movies, neighbors), 5.0), real_ratings)
+
+            if ranking is not None:
+                candidates = training_ds.get_unrated_movies(user)
+                predictions = user_rec.predictions_from_neighbors(user, candidates, neighbors)
+                ranking.update(candidates[top_n_indices(predictions, n)], movies, real_ratings)
+
+        result = {'mae': errors.mae, 'rmse': errors.rmse, 'predictions': errors.count}
+        if ranking is not None:
+            result.update(precision=ranking.precision, recall=ranking.recall, ndcg=ranking.ndcg, users=ranking.users)
+
+        return result
+
+
+    @staticmethod
+    def evaluate(ratings_df: pd.DataFrame, folds, similarity_function: str = 'pcc', neighbor_size: int = 50,
+                 n: int = 10, relevance_threshold: float = 4.0) -> list[dict[str, float]]:
+        """
+        Evaluates the recommender on every fold of a split, e.g. `CrossValidation.k_fold(ratings_df, 5, seed=0)`.
+
+        Returns:
+            list[dict[str, float]]: Metrics of each fold, see evaluate_fold.
+        """
+        movies_df = Dataset.read_movies()
+
+        return [CrossValidation.evaluate_fold(ratings_df, train, test, similarity_function, neighbor_size,
+                                              n, relevance_threshold, movies_df)
+                for train, test in folds]
+
+
+    @staticmethod
+    def summarize(results: list[dict[str, float]]) -> dict[str, tuple[float, float]]:
+        """
+        Mean and standard deviation of each metric over the folds.
+        """
+        return {metric: (float(np.mean([result[metric] for result in results])),
+                         float(np.std([result[metric] for result in results])))
+                for metric in results[0]}
@@ -1,20 +1,111 @@
 import pandas as pd
+import numpy as np
 import os
+from typing import Callable
+from rating_matrix import RatingMatrix
+from movie_metadata import MovieMetadata
+from instrumentation import traced
 
 class Dataset:
 
-    def __init__(self, ratings_df: pd.DataFrame):
+    # Available rating storages: nested dictionaries or a sparse user x movie matrix
+    BACKENDS = ('dict', 'sparse')
+
+    # Number of add_ratings batches whose changed users are remembered (see changed_users_since)
+    CHANGE_LOG_SIZE = 64
+
+    @traced('dataset.build')
+    def __init__(self, ratings_df: pd.DataFrame, backend: str = 'dict', movies_df: pd.DataFrame = None, 
+                 rating_matrix: RatingMatrix = None, lazy_datetime: bool = False):
+        """
+        Args:
+            ratings_df (pd.DataFrame): Ratings dataframe with userId, movieId, rating and timestamp columns.
+                It can be None with the 'sparse' backend and a prebuilt `rating_matrix`, then the dataset is served
+                from the matrix only (see shared_dataset).
+            backend (str, optional): Rating storage, 'dict' or 'sparse'. Defaults to 'dict'.
+            movies_df (pd.DataFrame, optional): Movies dataframe (see read_movies), copied. If None, movies.csv is read.
+            rating_matrix (RatingMatrix, optional): Prebuilt rating matrix of `ratings_df`, used by the 'sparse' backend.
+            lazy_datetime (bool, optional): Don't add the datetime column until add_datetime_column is called. Defaults to False.
+        """
+        if backend not in Dataset.BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {Dataset.BACKENDS}")
+        if ratings_df is None and (backend != 'sparse' or rating_matrix is None):
+            raise ValueError("A dataset without ratings_df needs the 'sparse' backend and a rating matrix")
+
+        self.backend = backend
+        # Incremented every time the ratings change, so that caches built on the dataset can be invalidated
+        self.version = 0
+
+        # Lazily built read-only views of the ratings, dropped when the version changes
+        self._views: dict[str, object] = {}
+        self._views_version = self.version
+        # (version, IDs of the users whose ratings changed) of the last add_ratings batches
+        self._change_log: list[tuple[int, np.ndarray]] = []
+        # Rating count and sum of each movie, built by the first add_ratings call
+        self._movie_totals: pd.DataFrame = None
+        self._rating_matrix: RatingMatrix = rating_matrix
+        self._lazy_datetime = lazy_datetime
         self.ratings_df = ratings_df
-        self.movies_df = pd.read_csv(Dataset.get_dataset_path() + "/movielens-edu/movies.csv", 
-                                     converters={"genres": lambda x: x.strip("[]").replace("'","").split("|")})
+        # Own copy, the average ratings are written into it (the same catalog is often shared, e.g. by the folds
+        # of CrossValidation)
+        self.movies_df = movies_df.copy() if movies_df is not None else Dataset.read_movies()
         self._prepare()
 
 
     def _prepare(self):
+        if self.backend == 'sparse' and self._rating_matrix is None:
+            self._rating_matrix = RatingMatrix.from_ratings_df(self.ratings_df, self.movies_df['movieId'])
+
         self._init_movies()
         self._init_ratings()
 
 
+    @property
+    def ratings_df(self) -> pd.DataFrame:
+        """
+        Ratings dataframe. The rows of the ratings added with add_ratings are appended on first access.
+        """
+        if len(self._pending_ratings) > 0:
+            pending = pd.concat(self._pending_ratings, ignore_index=True)
+            ratings_df = pd.concat([self._ratings_df, pending], ignore_index=True)
+
+            # A replaced rating keeps only the last row of its (user, movie) pair
+            pairs = pd.MultiIndex.from_frame(ratings_df[['userId', 'movieId']])
+            added = pd.MultiIndex.from_frame(pending[['userId', 'movieId']])
+            replaced = pairs.isin(added) & ratings_df.duplicated(['userId', 'movieId'], keep='last').to_numpy()
+
+            self._ratings_df = ratings_df[~replaced].reset_index(drop=True)
+            self._pending_ratings = []
+
+        return self._ratings_df
+
+
+    @ratings_df.setter
+    def ratings_df(self, ratings_df: pd.DataFrame) -> None:
+        self._ratings_df = ratings_df
+        self._pending_ratings: list[pd.DataFrame] = []
+
+
+    @staticmethod
+    def read_movies(path: str = None) -> pd.DataFrame:
+        """
+        Reads the movies file, splitting the genres of each movie into a list.
+
+        Args:
+            path (str, optional): Path of the movies file. Defaults to the MovieLens movies.csv.
+
+        Returns:
+            pd.DataFrame: Movies dataframe with movieId, title and genres columns.
+        """
+        if path is None:
+            path = Dataset.get_dataset_path() + "/movielens-edu/movies.csv"
+
+        movies_df = pd.read_csv(path, dtype={'movieId': 'int32', 'title': str, 'genres': str})
+        movies_df['genres'] = movies_df['genres'].str.strip("[]").str.replace("'", "").str.split("|")
+
+        return movies_df
+
+
     @staticmethod
     def get_dataset_path():
         # Define project and dataset paths
@@ -30,31 +121,233 @@ class Dataset:
 
         self.df_grouped_by_movieId = self.movies_df.groupby('movieId')
 
-        ratings_grouped_by_movie_df = self.ratings_df.groupby('movieId')
+        if self._rating_matrix is not None:
+            movie_means = pd.Series(self._rating_matrix.movie_means(), index=self._rating_matrix.movie_ids)
+        else:
+            movie_means = self.ratings_df.groupby('movieId').rating.mean()
 
-        self.movies_df['avg_rating'] =  ratings_grouped_by_movie_df.rating.mean(numeric_only=True)
+        # Align the averages on the movie ID, not on the row label of movies_df
+        self.movies_df['avg_rating'] =  self.movies_df['movieId'].map(movie_means)
 
 
     
     def _init_ratings(self):
-        self.ratings_df['datetime'] = pd.to_datetime(self.ratings_df['timestamp'], unit='s').dt.strftime('%d-%m-%Y')
+        if not self._lazy_datetime and self.ratings_df is not None:
+            self.add_datetime_column()
 
         # Dictionary to store user ratings
-        self._user_to_movie_ratings: dict[int, dict[int, float]] = {}
+        self._user_to_movie_ratings: dict[int, dict[int, float]] = None
+
+        if self.backend == 'sparse':
+            # Mean rating for each user, computed from the matrix
+            self._user_ratings_mean = pd.Series(self._rating_matrix.user_means, 
+                                                index=pd.Index(self._rating_matrix.user_ids, name='userId'), name='rating')
+        else:
+            self._user_to_movie_ratings = {}
+
+            # Group ratings dataframe by user
+            ratings_grouped_by_user_df = self.ratings_df.groupby('userId')
+
+            # Calculate mean rating for each user
+            self._user_ratings_mean = ratings_grouped_by_user_df.rating.mean()
+
+            # Initialize user ratings dictionary
+            for user_id, rating_df in ratings_grouped_by_user_df:
+                self._user_to_movie_ratings[user_id] = dict(zip(rating_df['movieId'], rating_df['rating']))
 
-        # Group ratings dataframe by user
-        ratings_grouped_by_user_df = self.ratings_df.groupby('userId')
+        if self.ratings_df is not None:
+            self.rating_count_df = pd.DataFrame(self.ratings_df.groupby(['rating']).size(), columns=['count'])
+        else:
+            ratings, counts = np.unique(self._rating_matrix.data, return_counts=True)
+            self.rating_count_df = pd.DataFrame({'count': counts}, index=pd.Index(ratings, name='rating'))
 
-        # Calculate mean rating for each user
-        self._user_ratings_mean = ratings_grouped_by_user_df.rating.mean()
 
-        # Initialize user ratings dictionary
-        for user_id, rating_df in ratings_grouped_by_user_df:
-            self._user_to_movie_ratings[user_id] = dict(zip(rating_df['movieId'], rating_df['rating']))
+    def add_datetime_column(self) -> pd.Series:
+        """
+        Adds to ratings_df the date of each rating as a 'dd-mm-YYYY' string, if it is not there yet.
+
+        Returns:
+            pd.Series: The datetime column.
+        """
+        if 'datetime' not in self.ratings_df.columns:
+            self.ratings_df['datetime'] = pd.to_datetime(self.ratings_df['timestamp'], unit='s').dt.strftime('%d-%m-%Y')
+
+        return self.ratings_df['datetime']
 
-        self.rating_count_df = pd.DataFrame(self.ratings_df.groupby(['rating']).size(), columns=['count'])
 
+    @property
+    def rating_matrix(self) -> RatingMatrix:
+        """
+        Sparse user x movie rating matrix. With the 'dict' backend it is built on first access.
 
+        Returns:
+            RatingMatrix: The rating matrix of the dataset.
+        """
+        if self._rating_matrix is None:
+            self._rating_matrix = RatingMatrix.from_ratings_df(self.ratings_df, self.movies_df['movieId'])
+            # Share the same user means of the dictionary storage
+            self._rating_matrix.user_means = self._user_ratings_mean.reindex(self._rating_matrix.user_ids).to_numpy(dtype=float)
+
+        return self._rating_matrix
+
+
+    @traced('dataset.add_ratings')
+    def add_ratings(self, ratings) -> np.ndarray:
+        """
+        Adds a batch of ratings, replacing the existing ratings of the same user and movie, without rebuilding the dataset:
+        the rating storage, the means of the changed users, the averages of the changed movies and the rating counts are
+        updated incrementally. The version is bumped, so that the caches built on the dataset can drop the entries
+        of the changed users only (see changed_users_since).
+
+        Args:
+            ratings: Dataframe with userId, movieId, rating and timestamp columns, or (userId, movieId, rating, timestamp)
+                tuples. If a user rated the same movie more than once in the batch, the last rating is kept.
+
+        Returns:
+            np.ndarray: Sorted IDs of the users whose ratings changed, new users included.
+        """
+        if not isinstance(ratings, pd.DataFrame):
+            ratings = pd.DataFrame(list(ratings), columns=['userId', 'movieId', 'rating', 'timestamp'])
+        ratings = ratings.drop_duplicates(['userId', 'movieId'], keep='last')
+
+        users = ratings['userId'].to_numpy(dtype=np.int64)
+        movies = ratings['movieId'].to_numpy(dtype=np.int64)
+        values = ratings['rating'].to_numpy(dtype=float)
+
+        if self._movie_totals is None:
+            self._movie_totals = self._compute_movie_totals()
+
+        # Previous rating of each pair, NaN for new ratings
+        if self.backend == 'dict':
+            previous = np.array([self._user_to_movie_ratings.get(user, {}).get(movie, np.nan)
+                                 for user, movie in zip(users.tolist(), movies.tolist())], dtype=float)
+        if self._rating_matrix is not None:
+            matrix_previous = self._rating_matrix.update(users, movies, values)
+            if self.backend == 'sparse':
+                previous = matrix_previous
+
+        changed = np.isnan(previous) | (previous != values)
+        if not changed.any():
+            return np.empty(0, dtype=np.int64)
+
+        users, movies, values, previous = users[changed], movies[changed], values[changed], previous[changed]
+        changed_users = np.unique(users)
+
+        self._update_user_means(users, movies, values, changed_users)
+        self._update_movie_averages(movies, values, previous)
+        self._update_rating_counts(values, previous)
+
+        if self._ratings_df is not None:
+            rows = ratings[changed]
+            columns = [column for column in self._ratings_df.columns if column != 'datetime']
+            rows = rows[columns].astype(self._ratings_df.dtypes[columns].to_dict())
+            if 'datetime' in self._ratings_df.columns:
+                rows['datetime'] = pd.to_datetime(rows['timestamp'], unit='s').dt.strftime('%d-%m-%Y')
+            self._pending_ratings.append(rows)
+
+        self.version += 1
+        self._change_log.append((self.version, changed_users))
+        del self._change_log[:-Dataset.CHANGE_LOG_SIZE]
+
+        return changed_users
+
+
+    def _update_user_means(self, users: np.ndarray, movies: np.ndarray, values: np.ndarray, changed_users: np.ndarray) -> None:
+        if self.backend == 'sparse':
+            # The matrix already recomputed the means of the changed users
+            user_ids = self._rating_matrix.user_ids
+            index = self._user_ratings_mean.index
+            if len(index) != len(user_ids):
+                index = pd.Index(user_ids, name='userId')
+            self._user_ratings_mean = pd.Series(self._rating_matrix.user_means, index=index, name='rating')
+            return
+
+        for user, movie, value in zip(users.tolist(), movies.tolist(), values.tolist()):
+            self._user_to_movie_ratings.setdefault(user, {})[movie] = value
+
+        means = [np.mean(list(self._user_to_movie_ratings[user].values())) for user in changed_users.tolist()]
+
+        if np.isin(changed_users, self._user_ratings_mean.index.to_numpy()).all():
+            self._user_ratings_mean.loc[changed_users] = means
+        else:
+            means = pd.Series(means, index=pd.Index(changed_users, name='userId'), name='rating')
+            self._user_ratings_mean = pd.concat([self._user_ratings_mean.drop(changed_users, errors='ignore'), means]).sort_index()
+
+        if self._rating_matrix is not None:
+            # Share the same user means of the dictionary storage
+            self._rating_matrix.user_means = self._user_ratings_mean.reindex(self._rating_matrix.user_ids).to_numpy(dtype=float)
+
+
+    def _compute_movie_totals(self) -> pd.DataFrame:
+        if self._rating_matrix is not None:
+            counts = np.bincount(self._rating_matrix.indices, minlength=len(self._rating_matrix.movie_ids))
+            sums = np.bincount(self._rating_matrix.indices, weights=self._rating_matrix.data, minlength=len(counts))
+            return pd.DataFrame({'count': counts, 'sum': sums}, index=pd.Index(self._rating_matrix.movie_ids, name='movieId'))
+
+        totals = self.ratings_df.groupby('movieId').rating.agg(['size', 'sum'])
+        return totals.rename(columns={'size': 'count'})
+
+
+    def _update_movie_averages(self, movies: np.ndarray, values: np.ndarray, previous: np.ndarray) -> None:
+        added = np.isnan(previous)
+        delta = pd.DataFrame({'count': added.astype(np.int64), 'sum': values - np.where(added, 0.0, previous)},
+                             index=pd.Index(movies, name='movieId')).groupby(level=0).sum()
+
+        self._movie_totals = self._movie_totals.add(delta, fill_value=0)
+
+        rows = self.movies_df['movieId'].isin(delta.index).to_numpy()
+        averages = self._movie_totals.loc[delta.index, 'sum'] / self._movie_totals.loc[delta.index, 'count']
+        self.movies_df.loc[rows, 'avg_rating'] = self.movies_df.loc[rows, 'movieId'].map(averages)
+
+
+    def _update_rating_counts(self, values: np.ndarray, previous: np.ndarray) -> None:
+        replaced = previous[~np.isnan(previous)]
+        delta = pd.concat([pd.Series(1, index=values), pd.Series(-1, index=replaced)]).groupby(level=0).sum()
+
+        counts = self.rating_count_df['count'].add(delta, fill_value=0).astype(np.int64)
+        counts = counts[counts > 0].sort_index()
+        self.rating_count_df = pd.DataFrame({'count': counts}, index=pd.Index(counts.index, name='rating'))
+
+
+    def changed_users_since(self, version: int) -> np.ndarray:
+        """
+        Retrieves the users whose ratings changed since a version of the dataset, e.g. to invalidate only their cache entries.
+
+        Args:
+            version (int): A previous version of the dataset.
+
+        Returns:
+            np.ndarray: Sorted IDs of the changed users, or None if the changes since that version are not known
+                (the change log only keeps the last CHANGE_LOG_SIZE batches).
+        """
+        if version == self.version:
+            return np.empty(0, dtype=np.int64)
+
+        changes = [users for changed_version, users in self._change_log if changed_version > version]
+        if version > self.version or len(changes) != self.version - version:
+            return None
+
+        return np.unique(np.concatenate(changes))
+
+
+    def _view(self, name: str, build: Callable[[], object]):
+        if self._views_version != self.version:
+            self._views = {}
+            self._views_version = self.version
+
+        if name not in self._views:
+            self._views[name] = build()
+
+        return self._views[name]
+
+
+    @staticmethod
+    def _read_only(array: np.ndarray) -> np.ndarray:
+        array.flags.writeable = False
+        return array
+
+
+    @traced('dataset.has_user_rated_movie')
     def has_user_rated_movie(self, user_id: int, movie_id: int) -> bool:
         """
         Checks if a user has rated a specific movie.
@@ -66,10 +359,16 @@ class Dataset:
         Returns:
             bool: True if the user has rated the movie, False otherwise.
         """
+        if self.backend == 'sparse':
+            return self._rating_matrix.has_rating(user_id, movie_id)
+
         return self._user_to_movie_ratings[user_id].get(movie_id) != None
     
     
     def has_user(self, user_id: int) -> bool:
+        if self.backend == 'sparse':
+            return self._rating_matrix.has_user(user_id)
+
         return self._user_to_movie_ratings.get(user_id) != None
 
 
@@ -86,6 +385,7 @@ class Dataset:
         return self._user_ratings_mean[user_id]
     
 
+    @traced('dataset.get_rating')
     def get_rating(self, user_id: int, movie_id: int) -> float:
         """
         Retrieves the rating given by a user for a movie.
@@ -97,6 +397,9 @@ class Dataset:
         Returns:
             float: Rating given by the user for the movie.
         """
+        if self.backend == 'sparse':
+            return self._rating_matrix.get_rating(user_id, movie_id)
+
         return self._user_to_movie_ratings[user_id][movie_id]
     
 
@@ -114,6 +417,7 @@ class Dataset:
         return self.get_rating(user_id, movie_id) - self.get_user_mean_rating(user_id)
     
 
+    @traced('dataset.get_movies_rated_by_user')
     def get_movies_rated_by_user(self, user_id: int) -> set[int]:
         """
         Retrieves the movies rated by a user.
@@ -122,11 +426,46 @@ class Dataset:
             user_id (int): ID of the user.
 
         Returns:
-            set: Set of movie IDs rated by the user.
+            set: Set of movie IDs rated by the user (a new set, that the caller can modify).
         """
+        if self.backend == 'sparse':
+            return set(self.get_rated_movies(user_id).tolist())
+
         return set(self._user_to_movie_ratings[user_id].keys())
     
 
+    @traced('dataset.get_rated_movies')
+    def get_rated_movies(self, user_id: int) -> np.ndarray:
+        """
+        Retrieves the movies rated by a user without building a set.
+
+        Args:
+            user_id (int): ID of the user.
+
+        Returns:
+            np.ndarray: Read-only sorted array of the IDs of the movies rated by the user.
+        """
+        return self.rating_matrix.get_rated_movie_ids(user_id)
+    
+
+    def count_rated_movies(self, user_id: int) -> int:
+        """
+        Retrieves the number of movies rated by a user.
+
+        Args:
+            user_id (int): ID of the user.
+
+        Returns:
+            int: Number of movies rated by the user.
+        """
+        if self.backend == 'sparse':
+            user_index = self._rating_matrix.user_index(user_id)
+            return int(self._rating_matrix.indptr[user_index + 1] - self._rating_matrix.indptr[user_index])
+
+        return len(self._user_to_movie_ratings[user_id])
+    
+
+    @traced('dataset.get_movies_unrated_by_user')
     def get_movies_unrated_by_user(self, user_id: int) -> set[int]:
         """
         Retrieves the movies not rated by a user.
@@ -138,9 +477,27 @@ class Dataset:
             set: Set of movie IDs not rated by the user.
         """
         # Calculate the difference between all movies and rated movies
-        return self.get_movies() - self.get_movies_rated_by_user(user_id)
+        if self.backend == 'sparse':
+            return self.get_movies().difference(self.get_rated_movies(user_id).tolist())
+
+        return self.get_movies().difference(self._user_to_movie_ratings[user_id].keys())
     
 
+    @traced('dataset.get_unrated_movies')
+    def get_unrated_movies(self, user_id: int) -> np.ndarray:
+        """
+        Retrieves the movies not rated by a user without building a set.
+
+        Args:
+            user_id (int): ID of the user.
+
+        Returns:
+            np.ndarray: Sorted array of the IDs of the movies not rated by the user.
+        """
+        return np.setdiff1d(self.get_movie_ids(), self.get_rated_movies(user_id), assume_unique=True)
+    
+
+    @traced('dataset.get_common_movies')
     def get_common_movies(self, user1_id: int, user2_id: int) -> set[int]:
         """
         Retrieves the movies rated by both users.
@@ -152,7 +509,33 @@ class Dataset:
         Returns:
             set: Set of movie IDs rated by both users.
         """
-        return self.get_movies_rated_by_user(user1_id) & self.get_movies_rated_by_user(user2_id)
+        if self.backend == 'sparse':
+            return set(self._intersect_rated_movies(user1_id, user2_id).tolist())
+
+        # Intersect the key views, without copying the rated movies of the two users
+        return self._user_to_movie_ratings[user1_id].keys() & self._user_to_movie_ratings[user2_id].keys()
+    
+
+    def count_common_movies(self, user1_id: int, user2_id: int) -> int:
+        """
+        Retrieves the number of movies rated by both users.
+
+        Args:
+            user1_id (int): ID of the first user.
+            user2_id (int): ID of the second user.
+
+        Returns:
+            int: Number of movies rated by both users.
+        """
+        if self.backend == 'sparse':
+            return len(self._intersect_rated_movies(user1_id, user2_id))
+
+        return len(self._user_to_movie_ratings[user1_id].keys() & self._user_to_movie_ratings[user2_id].keys())
+    
+
+    def _intersect_rated_movies(self, user1_id: int, user2_id: int) -> np.ndarray:
+        # The rated movies are sorted and unique, so the intersection is a merge of the two arrays
+        return np.intersect1d(self.get_rated_movies(user1_id), self.get_rated_movies(user2_id), assume_unique=True)
     
 
     def get_users(self) -> set[int]:
@@ -160,9 +543,22 @@ class Dataset:
         Retrieves the set of user IDs.
 
         Returns:
-            set: Set of user IDs.
+            frozenset: Set of user IDs, built once and shared between the calls.
         """
-        return set(self.ratings_df['userId'])
+        return self._view('users', lambda: frozenset(self.get_user_ids().tolist()))
+    
+
+    def get_user_ids(self) -> np.ndarray:
+        """
+        Retrieves the user IDs as an array.
+
+        Returns:
+            np.ndarray: Read-only sorted array of user IDs.
+        """
+        if self.backend == 'sparse':
+            return self._rating_matrix.user_ids
+
+        return self._view('user_ids', lambda: Dataset._read_only(np.sort(self.ratings_df['userId'].unique())))
     
 
     def get_movies(self) -> set[int]:
@@ -170,9 +566,30 @@ class Dataset:
         Retrieves the set of movie IDs.
 
         Returns:
-            set: Set of movie IDs.
+            frozenset: Set of movie IDs, built once and shared between the calls.
+        """
+        return self._view('movies', lambda: frozenset(self.movies_df['movieId'].tolist()))
+    
+
+    def get_movie_ids(self) -> np.ndarray:
+        """
+        Retrieves the movie IDs as an array.
+
+        Returns:
+            np.ndarray: Read-only sorted array of movie IDs.
         """
-        return set(self.movies_df['movieId'])
+        return self._view('movie_ids', lambda: Dataset._read_only(np.sort(self.movies_df['movieId'].unique())))
+    
+
+    def get_fingerprint(self) -> str:
+        """
+        Retrieves a hash of the ratings (see RatingMatrix.fingerprint). Unlike the version, which starts over in
+        every Dataset object, it tells whether data saved from another dataset (e.g. a NeighborIndex) is current.
+
+        Returns:
+            str: Hexadecimal digest, computed once per version.
+        """
+        return self._view('fingerprint', lambda: self.rating_matrix.fingerprint())
     
 
     def get_movie_name(self, movie_id: int) -> str:
@@ -185,8 +602,55 @@ class Dataset:
         Returns:
             str: Name of the movie.
         """
-        return self.df_grouped_by_movieId.get_group(movie_id).title[0]
+        return self.movie_metadata.get_title(movie_id)
+    
+
+    def get_movie_genres(self, movie_id: int) -> list[str]:
+        """
+        Retrieves the genres of a movie by its ID.
+
+        Args:
+            movie_id (int): ID of the movie.
+
+        Returns:
+            list[str]: Genres of the movie.
+        """
+        return self.movie_metadata.get_genres(movie_id)
+    
+
+    def get_movie_names(self, movie_ids) -> list[str]:
+        """
+        Retrieves the names of several movies by their IDs.
+
+        Args:
+            movie_ids: IDs of the movies.
+
+        Returns:
+            list[str]: Names of the movies, in the same order of `movie_ids`.
+        """
+        return self.movie_metadata.get_titles(movie_ids)
     
 
-    def get_movie_genres(self, movie_id: int):
-        return self.df_grouped_by_movieId.get_group(movie_id).genres.values[0]
\ No newline at end of file
+    def get_movies_genres(self, movie_ids) -> list[list[str]]:
+        """
+        Retrieves the genres of several movies by their IDs.
+
+        Args:
+            movie_ids: IDs of the movies.
+
+        Returns:
+            list[list[str]]: Genres of each movie, in the same order of `movie_ids`.
+        """
+        return self.movie_metadata.get_genres_list(movie_ids)
+    
+
+    @property
+    def movie_metadata(self) -> MovieMetadata:
+        """
+        Array based index of titles, genres and average ratings of the movies, built on first access.
+
+        Returns:
+            MovieMetadata: The movie metadata index.
+        """
+        avg_ratings = lambda: self.movies_df.set_index('movieId')['avg_rating']
+        return self._view('movie_metadata', lambda: MovieMetadata(self.movies_df, self.genres, avg_ratings()))
\ No newline at end of file
@@ -0,0 +1,157 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+from dataset import Dataset
+from rating_matrix import RatingMatrix
+
+
+class DatasetLoader:
+    """
+    Loads a Dataset reading the CSV files with compact column types, and caches the parsed columns and the
+    rating matrix in a binary (.npz) file keyed on the hash of the source files.
+
+    The first load parses the CSV files and builds the indexes, the following ones (also from other processes
+    or evaluation folds) read the arrays back from the cache.
+    """
+
+    # Bump when the layout of the cache file changes
+    CACHE_FORMAT = 1
+
+    RATINGS_DTYPES = {'userId': 'int32', 'movieId': 'int32', 'rating': 'float32', 'timestamp': 'int64'}
+
+    def __init__(self, cache_dir: str = None, backend: str = 'sparse') -> None:
+        """
+        Args:
+            cache_dir (str, optional): Folder of the cache files. Defaults to the .cache folder of the dataset path.
+            backend (str, optional): Rating storage of the loaded datasets. Defaults to 'sparse'.
+        """
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(Dataset.get_dataset_path(), '.cache')
+        self.backend = backend
+
+
+    @staticmethod
+    def read_ratings(path: str = None) -> pd.DataFrame:
+        """
+        Reads the ratings file with int32 IDs, float32 ratings and int64 timestamps.
+
+        Args:
+            path (str, optional): Path of the ratings file. Defaults to the MovieLens ratings.csv.
+
+        Returns:
+            pd.DataFrame: Ratings dataframe.
+        """
+        if path is None:
+            path = Dataset.get_dataset_path() + '/movielens-edu/ratings.csv'
+
+        return pd.read_csv(path, dtype=DatasetLoader.RATINGS_DTYPES)
+
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        """
+        Computes the SHA-1 of the content of a file.
+        """
+        digest = hashlib.sha1()
+
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+
+    def cache_path(self, ratings_path: str, movies_path: str) -> str:
+        """
+        Path of the cache file of a pair of ratings and movies files.
+        """
+        key = hashlib.sha1(f'{DatasetLoader.CACHE_FORMAT}:{DatasetLoader.file_hash(ratings_path)}:'
+                           f'{DatasetLoader.file_hash(movies_path)}'.encode()).hexdigest()
+
+        return os.path.join(self.cache_dir, f'dataset-{key}.npz')
+
+
+    def load(self, ratings_path: str = None, movies_path: str = None, use_cache: bool = True) -> Dataset:
+        """
+        Loads a dataset, from the cache if the source files didn't change since it was written.
+
+        Args:
+            ratings_path (str, optional): Path of the ratings file. Defaults to the MovieLens ratings.csv.
+            movies_path (str, optional): Path of the movies file. Defaults to the MovieLens movies.csv.
+            use_cache (bool, optional): Read and write the binary cache. Defaults to True.
+
+        Returns:
+            Dataset: The dataset, its datetime column is added only on add_datetime_column.
+        """
+        if ratings_path is None:
+            ratings_path = Dataset.get_dataset_path() + '/movielens-edu/ratings.csv'
+        if movies_path is None:
+            movies_path = Dataset.get_dataset_path() + '/movielens-edu/movies.csv'
+
+        if not use_cache:
+            return self._parse(ratings_path, movies_path)[0]
+
+        cache_path = self.cache_path(ratings_path, movies_path)
+
+        if os.path.exists(cache_path):
+            return self._read_cache(cache_path)
+
+        dataset, rating_matrix = self._parse(ratings_path, movies_path)
+        self._write_cache(cache_path, dataset, rating_matrix)
+
+        return dataset
+
+
+    def _parse(self, ratings_path: str, movies_path: str) -> tuple[Dataset, RatingMatrix]:
+        ratings_df = DatasetLoader.read_ratings(ratings_path)
+        movies_df = Dataset.read_movies(movies_path)
+        rating_matrix = RatingMatrix.from_ratings_df(ratings_df, movies_df['movieId'])
+
+        dataset = Dataset(ratings_df, self.backend, movies_df=movies_df,
+                          rating_matrix=rating_matrix if self.backend == 'sparse' else None, lazy_datetime=True)
+
+        return dataset, rating_matrix
+
+
+    def _write_cache(self, cache_path: str, dataset: Dataset, rating_matrix: RatingMatrix) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        ratings_df = dataset.ratings_df
+        movies_df = dataset.movies_df
+
+        # Genres are stored integer coded, as (movie -> codes) CSR arrays plus the genre names
+        genre_names = np.array(sorted({genre for genres in movies_df['genres'] for genre in genres}))
+        genre_lengths = movies_df['genres'].str.len().to_numpy()
+        genre_codes = np.searchsorted(genre_names, np.concatenate(movies_df['genres'].to_numpy()))
+
+        # Write to a temporary file first, so that concurrent loaders never read a partial cache
+        temporary_path = cache_path + f'.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as file:
+            np.savez(file,
+                     user_id=ratings_df['userId'].to_numpy(), movie_id=ratings_df['movieId'].to_numpy(),
+                     rating=ratings_df['rating'].to_numpy(), timestamp=ratings_df['timestamp'].to_numpy(),
+                     movies_movie_id=movies_df['movieId'].to_numpy(), movies_title=movies_df['title'].to_numpy(dtype=str),
+                     genre_names=genre_names, genre_lengths=genre_lengths, genre_codes=genre_codes.astype(np.int16),
+                     matrix_user_ids=rating_matrix.user_ids, matrix_movie_ids=rating_matrix.movie_ids,
+                     matrix_indptr=rating_matrix.indptr, matrix_indices=rating_matrix.indices,
+                     matrix_data=rating_matrix.data, matrix_user_means=rating_matrix.user_means)
+        os.replace(temporary_path, cache_path)
+
+
+    def _read_cache(self, cache_path: str) -> Dataset:
+        with np.load(cache_path) as cache:
+            ratings_df = pd.DataFrame({'userId': cache['user_id'], 'movieId': cache['movie_id'],
+                                       'rating': cache['rating'], 'timestamp': cache['timestamp']})
+
+            genre_names = cache['genre_names'].tolist()
+            genre_offsets = np.cumsum(cache['genre_lengths'])[:-1]
+            genres = [[genre_names[code] for code in codes] for codes in np.split(cache['genre_codes'], genre_offsets)]
+            movies_df = pd.DataFrame({'movieId': cache['movies_movie_id'], 'title': cache['movies_title'].astype(object),
+                                      'genres': genres})
+
+            rating_matrix = None
+            if self.backend == 'sparse':
+                rating_matrix = RatingMatrix(cache['matrix_user_ids'], cache['matrix_movie_ids'], cache['matrix_indptr'],
+                                             cache['matrix_indices'], cache['matrix_data'], cache['matrix_user_means'])
+
+        return Dataset(ratings_df, self.backend, movies_df=movies_df, rating_matrix=rating_matrix, lazy_datetime=True)
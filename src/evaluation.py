@@ -1,16 +1,33 @@
 import pandas as pd
 import numpy as np
 import math
+import os
+from typing import Callable
 from dataset import Dataset
 from user_recommendation import UserRecommendation
-from collections import defaultdict 
-from concurrent.futures import ThreadPoolExecutor
+from shared_dataset import SharedDataset
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Training dataset of the worker processes, attached once by _init_worker
+_worker_dataset: Dataset = None
+
+
+def _init_worker(descriptor: dict) -> None:
+    global _worker_dataset
+    _worker_dataset = SharedDataset.attach(descriptor)
+
+
+def _evaluate_chunk_in_worker(similarity_function: str, k_range: list[int],
+                              test_users: list[tuple[int, np.ndarray, np.ndarray]]) -> tuple[str, np.ndarray, np.ndarray, int]:
+    return (similarity_function,) + Evaluation.evaluate_chunk(_worker_dataset, similarity_function, k_range, test_users)
+
 
 class Evaluation:
 
     def split_dataset(df: pd.DataFrame, percentage: float, shuffle: bool = True):
         percentage = max(0, min(1, percentage))
-        
+
         if shuffle:
             df = df.sample(frac=1)
 
@@ -18,32 +35,179 @@ class Evaluation:
         training_size = int(df_size * percentage)
 
         return (df.iloc[:training_size], df.iloc[training_size:])
-    
 
-    def evaluate_similarities(similarities, training_set, test_set, k_range) -> tuple[dict[str, list[float]], dict[str, list[float]]]:
-        mae_points = defaultdict(list)
-        rmse_points = defaultdict(list)
 
-        with ThreadPoolExecutor() as executor:
-            futures = []
+    def evaluate_similarities(similarities, training_set, test_set, k_range, processes: int = None,
+                              chunk_size: int = None, progress: Callable[[int, int], None] = None) -> tuple[dict[str, list[float]], dict[str, list[float]]]:
+        """
+        Computes MAE and RMSE of the predictions on the test set for every similarity function and neighbor size.
+
+        The training dataset is built once and shared with a pool of worker processes through shared memory.
+        Each task evaluates one similarity function over a chunk of test users, for all the neighbor sizes.
+
+        Args:
+            similarities (list[str]): Names of the similarity functions (e.g. 'pcc', 'jaccard').
+            training_set (pd.DataFrame): Training ratings.
+            test_set (pd.DataFrame): Test ratings.
+            k_range (list[int]): Neighbor sizes.
+            processes (int, optional): Number of worker processes, 1 runs in the current process. Defaults to the number of CPUs.
+            chunk_size (int, optional): Number of test users per task. Defaults to a size giving about 4 tasks per process.
+            progress (function, optional): Called with (completed tasks, total tasks) every time a task completes.
+
+        Returns:
+            tuple[dict[str, list[float]], dict[str, list[float]]]: MAE and RMSE of each similarity function, one value per neighbor size.
+        """
+        k_range = [int(k) for k in k_range]
+        processes = processes if processes is not None else os.cpu_count()
+
+        training_ds = Dataset(training_set, 'sparse', movies_df=Dataset.read_movies(), lazy_datetime=True)
+        test_users = Evaluation._group_test_ratings(training_ds, test_set)
+
+        if chunk_size is None:
+            chunk_size = max(1, math.ceil(len(test_users) / (processes * 4)))
+        chunks = [test_users[start:start + chunk_size] for start in range(0, len(test_users), chunk_size)]
 
+        # similarity -> accumulated absolute errors, squared errors (one per neighbor size) and number of errors
+        abs_errors = defaultdict(lambda: np.zeros(len(k_range)))
+        squared_errors = defaultdict(lambda: np.zeros(len(k_range)))
+        num_errors = defaultdict(int)
+
+        total_tasks = len(similarities) * len(chunks)
+        completed_tasks = 0
+
+        def accumulate(result):
+            nonlocal completed_tasks
+            sim, chunk_abs_errors, chunk_squared_errors, chunk_num_errors = result
+
+            abs_errors[sim] += chunk_abs_errors
+            squared_errors[sim] += chunk_squared_errors
+            num_errors[sim] += chunk_num_errors
+
+            completed_tasks += 1
+            if progress is not None:
+                progress(completed_tasks, total_tasks)
+
+        if processes <= 1:
             for sim in similarities:
-                for k in k_range:
-                    futures.append(executor.submit(Evaluation.evaluate, training_set, test_set, sim, k))
+                for chunk in chunks:
+                    accumulate((sim,) + Evaluation.evaluate_chunk(training_ds, sim, k_range, chunk))
+        else:
+            with SharedDataset(training_ds) as shared_training_ds:
+                with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(shared_training_ds.descriptor,)) as executor:
+                    futures = [executor.submit(_evaluate_chunk_in_worker, sim, k_range, chunk)
+                               for sim in similarities for chunk in chunks]
 
-            for future in futures:
-                sim, mae, rmse = future.result()
-                mae_points[sim].append(mae)
-                rmse_points[sim].append(rmse)
+                    for future in as_completed(futures):
+                        accumulate(future.result())
+
+        mae_points = defaultdict(list)
+        rmse_points = defaultdict(list)
+
+        for sim in similarities:
+            if num_errors[sim] == 0:
+                mae_points[sim] = [0] * len(k_range)
+                rmse_points[sim] = [0] * len(k_range)
+                continue
+
+            mae_points[sim] = (abs_errors[sim] / num_errors[sim]).tolist()
+            rmse_points[sim] = np.sqrt(squared_errors[sim] / num_errors[sim]).tolist()
 
         return mae_points, rmse_points
 
 
-    def evaluate(training_df: pd.DataFrame, test_df: pd.DataFrame, similarity_function, neighbor_size) -> tuple[str, int, float, float]:
+    def _group_test_ratings(training_ds: Dataset, test_df: pd.DataFrame) -> list[tuple[int, np.ndarray, np.ndarray]]:
+        # (user, movies, ratings) of every test user that is also in the training set
+        users = test_df['userId'].to_numpy()
+        order = np.argsort(users, kind='stable')
+        users = users[order]
+        movies = test_df['movieId'].to_numpy()[order]
+        ratings = test_df['rating'].to_numpy(dtype=float)[order]
+
+        unique_users, starts = np.unique(users, return_index=True)
+        ends = np.append(starts[1:], len(users))
+
+        return [(int(user), movies[start:end], ratings[start:end])
+                for user, start, end in zip(unique_users, starts, ends) if training_ds.has_user(int(user))]
+
+
+    def evaluate_chunk(training_ds: Dataset, similarity_function: str, k_range: list[int],
+                       test_users: list[tuple[int, np.ndarray, np.ndarray]]) -> tuple[np.ndarray, np.ndarray, int]:
+        """
+        Accumulates the prediction errors of a chunk of test users for every neighbor size.
+
+        The neighbors of each test user are ranked once for the largest size, the predictions of all the
+        sizes come from prefix sums over that ranking.
+
+        Args:
+            training_ds (Dataset): Training dataset.
+            similarity_function (str): Name of the similarity function.
+            k_range (list[int]): Neighbor sizes.
+            test_users (list[tuple[int, np.ndarray, np.ndarray]]): Test users with the movies they rated and the real ratings.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, int]: Sum of the absolute errors and of the squared errors for each neighbor size,
+                and the number of predictions made for each neighbor size.
+        """
+        training_user_rec = UserRecommendation(training_ds)
+        sim = training_user_rec.get_similarity_function(similarity_function)
+
+        abs_errors = np.zeros(len(k_range))
+        squared_errors = np.zeros(len(k_range))
+        num_errors = 0
+
+        if len(k_range) == 0:
+            return abs_errors, squared_errors, num_errors
+
+        # The ranking doesn't depend on the neighbor size, the neighbors of size k are a prefix of the largest ones
+        max_neighbor_size = max(k_range)
+
+        for test_user, movies, real_ratings in test_users:
+            neighbors = training_user_rec.top_n_similar_users(test_user, sim, max_neighbor_size)
+            pred_ratings = training_user_rec.predictions_for_neighbor_sizes(test_user, movies, neighbors, k_range)
+
+            # Clip the prediction to the max possible rating value to avoid inflated errors
+            pred_ratings = np.minimum(pred_ratings, 5.0)
+
+            abs_errors += np.abs(pred_ratings - real_ratings).sum(axis=1)
+            squared_errors += ((pred_ratings - real_ratings) ** 2).sum(axis=1)
+
+            num_errors += len(movies)
+
+        return abs_errors, squared_errors, num_errors
+
+
+    def evaluate_sweep(training_df: pd.DataFrame, test_df: pd.DataFrame, similarity_function: str,
+                       k_range: list[int]) -> tuple[str, list[float], list[float]]:
+        """
+        Sweep version of evaluate: MAE and RMSE of one similarity function for every neighbor size, in a single pass.
+
+        Args:
+            training_df (pd.DataFrame): Training ratings.
+            test_df (pd.DataFrame): Test ratings.
+            similarity_function (str): Name of the similarity function.
+            k_range (list[int]): Neighbor sizes.
+
+        Returns:
+            tuple[str, list[float], list[float]]: Name of the similarity function, MAE and RMSE for each neighbor size.
+        """
+        k_range = [int(k) for k in k_range]
+        training_ds = Dataset(training_df, 'sparse', lazy_datetime=True)
+        test_users = Evaluation._group_test_ratings(training_ds, test_df)
+
+        abs_errors, squared_errors, num_errors = Evaluation.evaluate_chunk(training_ds, similarity_function, k_range, test_users)
+
+        if num_errors == 0:
+            return similarity_function, [0] * len(k_range), [0] * len(k_range)
+
+        return similarity_function, (abs_errors / num_errors).tolist(), np.sqrt(squared_errors / num_errors).tolist()
+
+
+    def evaluate(training_df: pd.DataFrame, test_df: pd.DataFrame, similarity_function, neighbor_size) -> tuple[str, float, float]:
         training_ds = Dataset(training_df)
         test_ds = Dataset(test_df)
 
         training_user_rec = UserRecommendation(training_ds)
+        sim = training_user_rec.get_similarity_function(similarity_function)
 
         num_errors = 0
         mae_prediction_errors = 0
@@ -52,31 +216,12 @@ class Evaluation:
         for test_user, movie_to_ratings in test_ds._user_to_movie_ratings.items():
             if not training_ds.has_user(test_user):
                 continue
-            
-            if similarity_function == 'jaccard':
-                sim = training_user_rec.sim_jaccard
-            elif similarity_function == 'cosine':
-                sim = training_user_rec.sim_cosine
-            elif similarity_function == 'acosine':
-                sim = training_user_rec.sim_acosine
-            elif similarity_function == 'manhattan':
-                sim = training_user_rec.sim_manhattan
-            elif similarity_function == 'chebyshev':
-                sim = training_user_rec.sim_chebyshev
-            elif similarity_function == 'euclidean':
-                sim = training_user_rec.sim_euclidean
-            elif similarity_function == 'pcc_jaccard':
-                sim = training_user_rec.sim_wpcc_jaccard
-            elif similarity_function == 'acosine_jaccard':
-                sim = training_user_rec.sim_acosine_jaccard
-            else:
-                sim = training_user_rec.sim_pcc
 
             neighbors = training_user_rec.top_n_similar_users(test_user, sim, neighbor_size)
-            
+
             for movie, real_rating in movie_to_ratings.items():
                 pred_rating = training_user_rec.prediction_from_neighbors(test_user, movie, neighbors)
-                
+
                 # Clip the prediction to the max possible rating value to avoid inflated errors
                 pred_rating = min(pred_rating, 5.0)
 
@@ -84,12 +229,10 @@ class Evaluation:
                 rmse_prediction_error += (pred_rating - real_rating) ** 2
                 num_errors += 1
 
-        if num_errors == 0: 
-            return similarity_function, neighbor_size, 0, 0
+        if num_errors == 0:
+            return similarity_function, 0, 0
 
         mae = mae_prediction_errors / num_errors
         rmse = math.sqrt(rmse_prediction_error / num_errors)
 
         return similarity_function, mae, rmse
-
-                
\ No newline at end of file
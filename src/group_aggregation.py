@@ -0,0 +1,90 @@
+import numpy as np
+from ranking import top_n_indices
+
+# Aggregation kernels over a dense (members x candidate movies) rating matrix, each returning one score per movie.
+# GroupRecommendation and SequentialRecommendation keep their dict-of-lists API on top of them (see to_matrix).
+
+
+def average(ratings: np.ndarray) -> np.ndarray:
+    """
+    Average rating of each movie.
+    """
+    return ratings.sum(axis=0) / ratings.shape[0]
+
+
+def least_misery(ratings: np.ndarray) -> np.ndarray:
+    """
+    Minimum rating of each movie.
+    """
+    return ratings.min(axis=0)
+
+
+def disagreement(ratings: np.ndarray) -> np.ndarray:
+    """
+    Disagreement of the members on each movie, the standard deviation of the ratings.
+    """
+    return ratings.std(axis=0)
+
+
+def weighted_average(ratings: np.ndarray) -> np.ndarray:
+    """
+    Average rating of each movie weighted by the inverse of the disagreement of the members on it.
+    """
+    return average(ratings) * (1 / (disagreement(ratings) + 0.0001))
+
+
+def satisfaction_weighted(ratings: np.ndarray, satisfactions: np.ndarray) -> np.ndarray:
+    """
+    Sum of the ratings of each movie, each member weighted by its dissatisfaction (1 - satisfaction).
+    """
+    return (1 - np.asarray(satisfactions, dtype=float)) @ ratings
+
+
+def satisfactions(ratings: np.ndarray, selected: np.ndarray, users_top_ratings: np.ndarray) -> np.ndarray:
+    """
+    Satisfaction of each member with a group recommendation: the sum of its ratings of the recommended movies
+    over the sum of the ratings of its own top recommendations.
+
+    Args:
+        ratings (np.ndarray): (members x candidates) rating matrix.
+        selected (np.ndarray): Columns of the movies recommended to the group.
+        users_top_ratings (np.ndarray): Sum of the ratings of the top recommendations of each member.
+
+    Returns:
+        np.ndarray: Satisfaction of each member.
+    """
+    return ratings[:, selected].sum(axis=1) / users_top_ratings
+
+
+def rank(movies, scores: np.ndarray, n: int = 10) -> list[tuple[int, float]]:
+    """
+    Selects the N movies with the highest score, equal scores keep the order of `movies`.
+
+    Returns:
+        list[tuple[int, float]]: (movie, score) tuples in descending order of score.
+    """
+    top = top_n_indices(scores, n)
+    return [(movies[position], score) for position, score in zip(top.tolist(), scores[top].tolist())]
+
+
+def to_matrix(aggreg_rec: dict[int, list[float]]) -> tuple[list[int], np.ndarray]:
+    """
+    Converts the movie -> list of member ratings dictionary of aggregate_users_recommendations to a rating matrix.
+
+    Returns:
+        tuple[list[int], np.ndarray]: The movies, in the order of the dictionary, and the (members x movies) ratings.
+    """
+    movies = list(aggreg_rec.keys())
+    if len(movies) == 0:
+        return movies, np.empty((0, 0))
+
+    ratings = np.array(list(aggreg_rec.values()), dtype=float).T
+
+    return movies, ratings
+
+
+def to_users_recommendations(movies: list[int], ratings: np.ndarray) -> dict[int, list[float]]:
+    """
+    Converts a (members x movies) rating matrix to the movie -> list of member ratings dictionary.
+    """
+    return {movie: ratings[:, column].tolist() for column, movie in enumerate(movies)}
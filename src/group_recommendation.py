@@ -3,23 +3,37 @@ from typing import Callable
 import numpy as np
 from user_recommendation import UserRecommendation
 from collections import defaultdict 
+from instrumentation import traced
+import group_aggregation
 
 class GroupRecommendation:
+
+    # Aggregation methods computed by a group_aggregation kernel over the (members x movies) rating matrix
+    AGGREGATION_KERNELS = {
+        'average_aggregation_from_users_recommendations': group_aggregation.average,
+        'least_misery_aggregation_from_users_recommendations': group_aggregation.least_misery,
+        'weighted_average_aggregation_from_users_recommendations': group_aggregation.weighted_average,
+    }
     
     def __init__(self, user_recommendation: UserRecommendation) -> None:
         self.user_recommendation = user_recommendation
 
 
-    def users_top_recommendations(self, users: set[int], n: int = 10, neighbor_size: int = 50, exclude_movies: set[int] = set()):
+    @traced('group.user_recommendations')
+    def users_top_recommendations(self, users: set[int], n: int = 10, neighbor_size: int = None, exclude_movies: set[int] = set()):
         # userId -> list[(movieId, rating)]
         users_recommendations: dict[int, list[tuple[int, float]]] = defaultdict(list[tuple[int, float]])
 
+        # Without a neighbor size the recommender's own default is used (e.g. the neighbor_size of an ItemRecommendation)
+        options = {} if neighbor_size is None else {'neighbor_size': neighbor_size}
+
         for user in users:
-            users_recommendations[user] = self.user_recommendation.top_n_recommendations(user, n=n, neighbor_size=neighbor_size, exclude_movies=exclude_movies)
+            users_recommendations[user] = self.user_recommendation.top_n_recommendations(user, n=n, exclude_movies=exclude_movies, **options)
 
         return users_recommendations
     
 
+    @traced('group.aggregate_predictions')
     def aggregate_users_recommendations(self, users_top_rec: dict[int, list[tuple[int, float]]], n: int = 10, 
                                         neighbor_size: int = 50) -> dict[int, list[float]]:
         movies: set[int] = set()
@@ -32,6 +46,10 @@ class GroupRecommendation:
             for (movie, _) in top_rec:
                 movies.add(movie)
 
+        # predict the ratings of all the users at once
+        if self.user_recommendation.vectorized:
+            return self._aggregate_users_predictions(list(users_top_rec.keys()), list(movies), neighbor_size)
+
         # aggregate predictions for each movie
         for user in users_top_rec.keys():
             neighbors = self.user_recommendation.top_n_similar_users(user, n=neighbor_size)
@@ -45,6 +63,52 @@ class GroupRecommendation:
 
         return aggregate_recommendations
 
+
+    def _aggregate_users_predictions(self, users: list[int], movies: list[int], neighbor_size: int) -> dict[int, list[float]]:
+        # Same as the loop of aggregate_users_recommendations, with the predictions of all the users computed at once
+        ratings, _ = self.users_ratings(users, movies, neighbor_size)
+
+        # movie -> list[user ratings]
+        return group_aggregation.to_users_recommendations(movies, ratings)
+
+
+    def users_ratings(self, users: list[int], movies: list[int], neighbor_size: int = 50,
+                      neighbors_by_user: dict[int, list[tuple[int, float]]] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Computes the rating of several users for several movies: the actual rating if the user rated the movie,
+        the prediction from the user's neighbors otherwise.
+
+        Args:
+            users (list[int]): IDs of the users.
+            movies (list[int]): IDs of the movies.
+            neighbor_size (int, optional): Number of neighbors of the predictions. Defaults to 50.
+            neighbors_by_user (dict[int, list[tuple[int, float]]], optional): Precomputed neighbors of the users.
+                If None, the top `neighbor_size` similar users of each user are used.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: (users x movies) matrices of the ratings and of the flags of the actual ratings.
+        """
+        matrix = self.user_recommendation.dataset.rating_matrix
+        if neighbors_by_user is None:
+            neighbors_by_user = {user: self.user_recommendation.top_n_similar_users(user, n=neighbor_size) for user in users}
+
+        ratings = self.user_recommendation.predictions_for_users(users, movies, neighbors_by_user)
+
+        # Take the rating from the user if the user has rated the movie
+        movie_indices = matrix.movie_indices(movies)
+        columns = np.full(matrix.shape[1], -1, dtype=np.int64)
+        columns[movie_indices[movie_indices >= 0]] = np.flatnonzero(movie_indices >= 0)
+
+        rows, rated_movies, actual_ratings = matrix.gather_rows([matrix.user_index(user) for user in users])
+        rated_columns = columns[rated_movies]
+        rated = rated_columns >= 0
+        ratings[rows[rated], rated_columns[rated]] = actual_ratings[rated]
+
+        rated_mask = np.zeros(ratings.shape, dtype=bool)
+        rated_mask[rows[rated], rated_columns[rated]] = True
+
+        return ratings, rated_mask
+
     
     def average_aggregation(self, users: set[int], n: int = 10) -> list[tuple[int, float]]:
         """
@@ -63,16 +127,9 @@ class GroupRecommendation:
         return self.average_aggregation_from_users_recommendations(aggreg_rec, n)
     
     
+    @traced('group.average_aggregation')
     def average_aggregation_from_users_recommendations(self, aggreg_rec: dict[int, list[float]], n: int = 10) -> list[tuple[int, float]]:
-        avg_rec: list[tuple[int, float]] = []
-
-        for movie, predicted_ratings in aggreg_rec.items():
-            average = sum(predicted_ratings) / len(predicted_ratings)
-            avg_rec.append((movie, average))
-        
-        avg_rec.sort(key=lambda x: x[1], reverse=True)
-        
-        return avg_rec[:n]
+        return self._aggregate(group_aggregation.average, aggreg_rec, n)
 
     
     def least_misery_aggregation(self, users: set[int], n: int = 10) -> list[tuple[int, float]]:
@@ -92,15 +149,9 @@ class GroupRecommendation:
         return self.least_misery_aggregation_from_users_recommendations(aggreg_rec, n)
     
     
+    @traced('group.least_misery_aggregation')
     def least_misery_aggregation_from_users_recommendations(self, aggreg_rec: dict[int, list[float]], n: int = 10) -> list[tuple[int, float]]:
-        least_misery_rec: list[tuple[int, float]] = []
-
-        for movie, predicted_ratings in aggreg_rec.items():
-            least_misery_rec.append((movie, min(predicted_ratings)))
-        
-        least_misery_rec.sort(key=lambda x: x[1], reverse=True)
-        
-        return least_misery_rec[:n]
+        return self._aggregate(group_aggregation.least_misery, aggreg_rec, n)
     
 
     def get_disagreement(self, ratings: list[float]) -> float:
@@ -155,21 +206,37 @@ class GroupRecommendation:
         return self.weighted_average_aggregation_from_users_recommendations(aggreg_rec, n)
 
 
+    @traced('group.weighted_average_aggregation')
     def weighted_average_aggregation_from_users_recommendations(self, aggreg_rec: dict[int, list[float]], n: int = 10) -> list[tuple[int, float]]:
-        w_avg_rec: list[tuple[int, float]] = []
-
-        for movie, predicted_ratings in aggreg_rec.items():
-            disagreement_weight = self.get_disagreement_weight(predicted_ratings)
- 
-            average = sum(predicted_ratings) / len(predicted_ratings)
-            w_average = average * disagreement_weight
-            w_avg_rec.append((movie, w_average))
-        
-        w_avg_rec.sort(key=lambda x: x[1], reverse=True)
-        
-        return w_avg_rec[:n]
+        return self._aggregate(group_aggregation.weighted_average, aggreg_rec, n)
+
+
+    def _aggregate(self, kernel: Callable[[np.ndarray], np.ndarray], aggreg_rec: dict[int, list[float]], n: int) -> list[tuple[int, float]]:
+        # Adapter of the dict-of-lists API on the group_aggregation kernels
+        if len(aggreg_rec) == 0:
+            return []
+
+        movies, ratings = group_aggregation.to_matrix(aggreg_rec)
+        return group_aggregation.rank(movies, kernel(ratings), n)
+
+
+    def get_aggregation_kernel(self, aggreg_method: Callable) -> Callable[[np.ndarray], np.ndarray]:
+        """
+        Retrieves the group_aggregation kernel equivalent to an aggregation method.
+
+        Args:
+            aggreg_method (function): One of the *_aggregation_from_users_recommendations methods of this object.
+
+        Returns:
+            function: The kernel, or None if the method has no kernel.
+        """
+        if getattr(aggreg_method, '__self__', None) is not self:
+            return None
+
+        return GroupRecommendation.AGGREGATION_KERNELS.get(aggreg_method.__name__)
     
     
+    @traced('group.request')
     def get_recommendations_satisfactions_and_disagreements_for_group(self, user_group: set[int], aggreg_method: Callable = None) -> dict[int, list[tuple[int, float]]]:
         satisfactions: list[tuple[int, float]] = []
 
@@ -177,6 +244,11 @@ class GroupRecommendation:
             aggreg_method = self.weighted_average_aggregation_from_users_recommendations
 
         users_rec = self.users_top_recommendations(user_group)
+
+        kernel = self.get_aggregation_kernel(aggreg_method)
+        if self.user_recommendation.vectorized and kernel is not None:
+            return self._aggregate_group(users_rec, kernel)
+
         aggreg_rec = self.aggregate_users_recommendations(users_rec)
         
         group_rec = aggreg_method(aggreg_rec)
@@ -190,17 +262,48 @@ class GroupRecommendation:
         return group_rec, satisfactions, disagreements
     
 
+    @traced('group.satisfactions')
     def calculate_satisfactions(self, group: set[int], users_rec: dict[int, list[tuple[int, float]]], group_rec: list[tuple[int, float]], 
                                 aggreg_rec: dict[int, list[float]]):
-        satisfactions: list[tuple[int, float]] = []
-        
-        group_movies = set(map(operator.itemgetter(0), group_rec))
-        
-        for index, user in enumerate(group):
-            group_val = sum(aggreg_rec[movie][index] for movie in group_movies)
-            user_val = sum(rating for _, rating in users_rec[user])
-            user_sat = group_val / user_val
+        users_top_ratings = np.array([sum(rating for _, rating in users_rec[user]) for user in group], dtype=float)
 
-            satisfactions.append((user, user_sat))
+        movies, ratings = group_aggregation.to_matrix(aggreg_rec)
+        position = {movie: column for column, movie in enumerate(movies)}
+        selected = np.array([position[movie] for movie in set(map(operator.itemgetter(0), group_rec))], dtype=np.int64)
 
-        return satisfactions
+        if len(movies) == 0:
+            ratings = np.zeros((len(users_top_ratings), 0))
+
+        user_sats = group_aggregation.satisfactions(ratings, selected, users_top_ratings)
+
+        return list(zip(group, user_sats.tolist()))
+
+
+    def _aggregate_group(self, users_rec: dict[int, list[tuple[int, float]]], kernel: Callable[[np.ndarray], np.ndarray],
+                         n: int = 10, neighbor_size: int = 50, neighbors_by_user: dict[int, list[tuple[int, float]]] = None
+                         ) -> tuple[list[tuple[int, float]], list[tuple[int, float]], list[tuple[int, float]]]:
+        # Same as get_recommendations_satisfactions_and_disagreements_for_group, with the ratings of the members
+        # for the candidate movies in a matrix that every step reduces
+        users = list(users_rec.keys())
+
+        movies: set[int] = set()
+        for top_rec in users_rec.values():
+            for movie, _ in top_rec:
+                movies.add(movie)
+        movies = list(movies)
+
+        if len(movies) == 0:
+            return [], [(user, 0.0) for user in users], []
+
+        ratings, _ = self.users_ratings(users, movies, neighbor_size, neighbors_by_user)
+
+        group_rec = group_aggregation.rank(movies, kernel(ratings), n)
+
+        position = {movie: column for column, movie in enumerate(movies)}
+        group_columns = np.array([position[movie] for movie, _ in group_rec], dtype=np.int64)
+        users_top_ratings = np.array([sum(rating for _, rating in users_rec[user]) for user in users])
+
+        satisfactions = list(zip(users, group_aggregation.satisfactions(ratings, group_columns, users_top_ratings).tolist()))
+        disagreements = list(zip((movie for movie, _ in group_rec), group_aggregation.disagreement(ratings[:, group_columns]).tolist()))
+
+        return group_rec, satisfactions, disagreements
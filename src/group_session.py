@@ -0,0 +1,254 @@
+import json
+import numpy as np
+from sequential_recommendation import SequentialRecommendation
+
+
+class GroupSession:
+    """
+    Long lived sequential recommendation session of a group (e.g. a watch party).
+
+    The session keeps the neighbors of each member and their ratings for the whole catalog (actual where they
+    rated the movie, predicted otherwise), together with each member's unrated movies ranked by rating. Serving
+    the next batch only skips the movies recommended so far and aggregates the members' top N, as
+    SequentialRecommendation does round by round. Members can join or leave between batches: only their row
+    of the state is computed or dropped.
+
+    A session can be saved and resumed in another process on the same dataset (see save and load).
+    """
+
+    def __init__(self, sequential_recommendation: SequentialRecommendation, members: list[int] = (),
+                 n: int = 10, neighbor_size: int = 50) -> None:
+        """
+        Args:
+            sequential_recommendation (SequentialRecommendation): Recommender serving the session.
+            members (list[int], optional): IDs of the initial members.
+            n (int, optional): Number of recommendations of each batch. Defaults to 10.
+            neighbor_size (int, optional): Number of neighbors of the members' predictions. Defaults to 50.
+        """
+        self.sequential_recommendation = sequential_recommendation
+        self.n = n
+        self.neighbor_size = neighbor_size
+
+        self.members: list[int] = []
+        # member -> list[(userId, similarity)]
+        self.neighbors: dict[int, list[tuple[int, float]]] = {}
+
+        # Recommended batches and the satisfaction of the members after each of them
+        self.history: list[list[tuple[int, float]]] = []
+        self.satisfactions: list[list[tuple[int, float]]] = []
+
+        self.movie_ids = self.dataset.get_movie_ids()
+        self._version = self.dataset.version
+
+        # (members x catalog) ratings and flags of the actual ratings
+        self._ratings = np.empty((0, len(self.movie_ids)))
+        self._rated = np.empty((0, len(self.movie_ids)), dtype=bool)
+        # Columns of the movies not rated by each member, by descending rating
+        self._orders: list[np.ndarray] = []
+
+        # Columns of the recommended movies, in order, and the mask of the movies still available
+        self._consumed: list[int] = []
+        self._available = np.ones(len(self.movie_ids), dtype=bool)
+
+        self.add_members(members)
+
+
+    @property
+    def group_recommendation(self):
+        return self.sequential_recommendation.group_recommendation
+
+
+    @property
+    def dataset(self):
+        return self.sequential_recommendation.group_recommendation.user_recommendation.dataset
+
+
+    def add_member(self, user: int) -> None:
+        self.add_members([user])
+
+
+    def add_members(self, users: list[int]) -> None:
+        """
+        Adds members to the group, computing only their neighbors and ratings. Members already in the group are skipped.
+
+        Raises:
+            ValueError: If a user is not in the dataset.
+        """
+        users = [user for user in dict.fromkeys(users) if user not in self.neighbors]
+        if len(users) == 0:
+            return
+
+        for user in users:
+            if not self.dataset.has_user(user):
+                raise ValueError(f'User {user} is not in the dataset')
+
+        user_rec = self.group_recommendation.user_recommendation
+        neighbors_by_user = {user: user_rec.top_n_similar_users(user, n=self.neighbor_size) for user in users}
+        ratings, rated = self.group_recommendation.users_ratings(users, self.movie_ids, neighbors_by_user=neighbors_by_user)
+
+        self.members.extend(users)
+        self.neighbors.update(neighbors_by_user)
+        self._ratings = np.vstack((self._ratings, ratings))
+        self._rated = np.vstack((self._rated, rated))
+        self._orders.extend(GroupSession._rank(ratings[row], rated[row]) for row in range(len(users)))
+
+
+    def remove_member(self, user: int) -> None:
+        """
+        Removes a member from the group, dropping its state.
+
+        Raises:
+            ValueError: If the user is not a member of the group.
+        """
+        if user not in self.neighbors:
+            raise ValueError(f'User {user} is not a member of the session')
+
+        row = self.members.index(user)
+
+        del self.members[row]
+        del self.neighbors[user]
+        del self._orders[row]
+        self._ratings = np.delete(self._ratings, row, axis=0)
+        self._rated = np.delete(self._rated, row, axis=0)
+
+
+    @staticmethod
+    def _rank(ratings: np.ndarray, rated: np.ndarray) -> np.ndarray:
+        # Equal ratings keep the ascending movie ID order, as top_n_indices
+        unrated = np.flatnonzero(~rated)
+        return unrated[np.argsort(-ratings[unrated], kind='stable')]
+
+
+    def refresh(self) -> None:
+        """
+        Recomputes the state of every member, e.g. after the ratings of the dataset changed.
+        The history and the recommended movies are kept.
+        """
+        members = self.members
+
+        self.members, self.neighbors, self._orders = [], {}, []
+        self._ratings = np.empty((0, len(self.movie_ids)))
+        self._rated = np.empty((0, len(self.movie_ids)), dtype=bool)
+        self._version = self.dataset.version
+
+        self.add_members(members)
+
+
+    def _top_n(self, row: int) -> np.ndarray:
+        # At most len(consumed) movies of the ranking are unavailable, so the top N is in this prefix
+        head = self._orders[row][:self.n + len(self._consumed)]
+        return head[self._available[head]][:self.n]
+
+
+    def next_recommendations(self) -> list[tuple[int, float]]:
+        """
+        Recommends the next batch of movies to the group, excluding the movies of the previous batches.
+
+        The first batch uses the weighted average aggregation, the following ones weight each member
+        by its dissatisfaction with the previous batch (members who joined since then count as unsatisfied).
+
+        Returns:
+            list[tuple[int, float]]: Movie IDs and their aggregated ratings.
+        """
+        if len(self.members) == 0:
+            raise ValueError('The session has no members')
+
+        if self._version != self.dataset.version:
+            self.refresh()
+
+        users_top = [self._top_n(row) for row in range(len(self.members))]
+
+        satisfactions = None
+        if len(self.history) > 0:
+            last_satisfactions = dict(self.satisfactions[-1])
+            satisfactions = [(user, last_satisfactions.get(user, 0.0)) for user in self.members]
+
+        group_rec, satisfactions = self.sequential_recommendation.aggregate_round(self.members, self.movie_ids, self._ratings,
+                                                                                  users_top, satisfactions, self.n)
+
+        self.satisfactions.append(satisfactions)
+        self.history.append(group_rec)
+
+        recommended = np.searchsorted(self.movie_ids, [movie for movie, _ in group_rec])
+        self._consumed.extend(recommended.tolist())
+        self._available[recommended] = False
+
+        return group_rec
+
+
+    def to_state(self) -> dict[str, np.ndarray]:
+        """
+        Exports the session as a dictionary of arrays (see save).
+        """
+        neighbor_lists = [self.neighbors[user] for user in self.members]
+        neighbor_indptr = np.zeros(len(self.members) + 1, dtype=np.int64)
+        np.cumsum([len(neighbors) for neighbors in neighbor_lists], out=neighbor_indptr[1:])
+
+        metadata = {'n': self.n, 'neighbor_size': self.neighbor_size, 'history': self.history, 'satisfactions': self.satisfactions}
+
+        return {
+            'metadata': np.array(json.dumps(metadata)),
+            'movie_ids': np.asarray(self.movie_ids),
+            'members': np.array(self.members, dtype=np.int64),
+            'ratings': self._ratings,
+            'rated': self._rated,
+            'consumed': np.array(self._consumed, dtype=np.int64),
+            'neighbor_indptr': neighbor_indptr,
+            'neighbor_ids': np.array([user for neighbors in neighbor_lists for user, _ in neighbors], dtype=np.int64),
+            'neighbor_similarities': np.array([similarity for neighbors in neighbor_lists for _, similarity in neighbors], dtype=float),
+        }
+
+
+    @classmethod
+    def from_state(cls, state: dict[str, np.ndarray], sequential_recommendation: SequentialRecommendation) -> 'GroupSession':
+        """
+        Resumes a session exported by to_state.
+
+        Args:
+            state (dict[str, np.ndarray]): The exported session.
+            sequential_recommendation (SequentialRecommendation): Recommender on the same dataset of the exported session.
+
+        Raises:
+            ValueError: If the movie catalog of the dataset is not the one of the session.
+        """
+        metadata = json.loads(str(state['metadata']))
+        session = cls(sequential_recommendation, n=metadata['n'], neighbor_size=metadata['neighbor_size'])
+
+        if not np.array_equal(session.movie_ids, state['movie_ids']):
+            raise ValueError('The session was created on a dataset with another movie catalog')
+
+        session.members = state['members'].tolist()
+        indptr = state['neighbor_indptr']
+        for row, user in enumerate(session.members):
+            start, end = indptr[row], indptr[row + 1]
+            session.neighbors[user] = list(zip(state['neighbor_ids'][start:end].tolist(),
+                                               state['neighbor_similarities'][start:end].tolist()))
+
+        session._ratings = np.array(state['ratings'], dtype=float)
+        session._rated = np.array(state['rated'], dtype=bool)
+        session._orders = [GroupSession._rank(session._ratings[row], session._rated[row]) for row in range(len(session.members))]
+
+        session._consumed = state['consumed'].tolist()
+        session._available[session._consumed] = False
+
+        session.history = [[tuple(item) for item in batch] for batch in metadata['history']]
+        session.satisfactions = [[tuple(item) for item in batch] for batch in metadata['satisfactions']]
+
+        return session
+
+
+    def save(self, path: str) -> None:
+        """
+        Saves the session in a .npz file.
+        """
+        with open(path, 'wb') as file:
+            np.savez(file, **self.to_state())
+
+
+    @classmethod
+    def load(cls, path: str, sequential_recommendation: SequentialRecommendation) -> 'GroupSession':
+        """
+        Loads a session saved with save, see from_state.
+        """
+        with np.load(path) as state:
+            return cls.from_state(dict(state), sequential_recommendation)
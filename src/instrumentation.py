@@ -0,0 +1,307 @@
+import cProfile
+import functools
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Callable
+
+
+class Instrumentation:
+    """
+    Per-stage timers and event counters of the recommender stack.
+
+    Methods marked with the `traced` decorator are timed as stages (calls, total and max seconds) and code
+    can count events (e.g. similarity cache hits) with `count`. Instrumentation is disabled by default:
+    marked methods are then the plain functions, since the timing wrappers are installed on the classes only
+    by `enable` and removed by `disable`, and `count`/`stage` return right away.
+
+    The collected values can be exported as structured log records (`log`) or as a Prometheus text dump
+    (`to_prometheus`), and `capture` scopes the collection (optionally with cProfile and tracemalloc) to one request.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._lock = threading.Lock()
+
+        # (class, attribute, function, stage) of every traced method
+        self._traced: list[tuple[type, str, Callable, str]] = []
+
+        self.reset()
+
+
+    def reset(self) -> None:
+        """
+        Drops the collected timers and counters.
+        """
+        # stage -> [calls, total seconds, max seconds]
+        self.timers: dict[str, list] = {}
+        self.counters: dict[str, int] = {}
+
+
+    def enable(self) -> None:
+        """
+        Starts collecting, installing the timing wrappers on the traced methods.
+        """
+        if self.enabled:
+            return
+
+        for owner, name, function, stage in self._traced:
+            setattr(owner, name, self._wrap(function, stage))
+        self.enabled = True
+
+
+    def disable(self) -> None:
+        """
+        Stops collecting, restoring the plain traced methods. The collected values are kept.
+        """
+        if not self.enabled:
+            return
+
+        for owner, name, function, _ in self._traced:
+            setattr(owner, name, function)
+        self.enabled = False
+
+
+    def _register(self, owner: type, name: str, function: Callable, stage: str) -> None:
+        self._traced.append((owner, name, function, stage))
+        setattr(owner, name, self._wrap(function, stage) if self.enabled else function)
+
+
+    def _wrap(self, function: Callable, stage: str) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+
+        return wrapper
+
+
+    def record(self, stage: str, seconds: float) -> None:
+        """
+        Adds a timed call to a stage.
+        """
+        with self._lock:
+            timer = self.timers.get(stage)
+            if timer is None:
+                self.timers[stage] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+
+    def count(self, name: str, value: int = 1) -> None:
+        """
+        Increments an event counter, a no-op when disabled.
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+    def stage(self, name: str):
+        """
+        Context manager timing a block of code as a stage, a no-op when disabled.
+        """
+        if not self.enabled:
+            return nullcontext()
+
+        return self._timed_block(name)
+
+
+    @contextmanager
+    def _timed_block(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+
+    def snapshot(self) -> dict[str, dict]:
+        """
+        Retrieves the collected values.
+
+        Returns:
+            dict[str, dict]: 'timers' (stage -> calls, total_seconds, max_seconds) and 'counters' (name -> value).
+        """
+        with self._lock:
+            timers = {stage: {'calls': calls, 'total_seconds': total, 'max_seconds': maximum}
+                      for stage, (calls, total, maximum) in self.timers.items()}
+            return {'timers': timers, 'counters': dict(self.counters)}
+
+
+    def log(self, logger: logging.Logger = None, level: int = logging.INFO) -> None:
+        """
+        Emits one structured (JSON) log record per stage and per counter.
+
+        Args:
+            logger (logging.Logger, optional): Destination logger. Defaults to the 'recommender.instrumentation' logger.
+            level (int, optional): Level of the records. Defaults to INFO.
+        """
+        logger = logger if logger is not None else logging.getLogger('recommender.instrumentation')
+        snapshot = self.snapshot()
+
+        for stage, timer in snapshot['timers'].items():
+            logger.log(level, json.dumps({'type': 'stage', 'stage': stage, **timer}))
+        for name, value in snapshot['counters'].items():
+            logger.log(level, json.dumps({'type': 'counter', 'counter': name, 'value': value}))
+
+
+    def to_prometheus(self, prefix: str = 'recommender') -> str:
+        """
+        Dumps the collected values in the Prometheus text exposition format.
+
+        Args:
+            prefix (str, optional): Prefix of the metric names. Defaults to 'recommender'.
+
+        Returns:
+            str: The text dump, stages and counters are labels of a few metric families.
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        families = [('stage_calls_total', 'counter', 'Calls of each stage.', 'calls'),
+                    ('stage_seconds_total', 'counter', 'Time spent in each stage.', 'total_seconds'),
+                    ('stage_seconds_max', 'gauge', 'Slowest call of each stage.', 'max_seconds')]
+
+        for name, kind, description, field in families:
+            lines.append(f'# HELP {prefix}_{name} {description}')
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            for stage, timer in sorted(snapshot['timers'].items()):
+                lines.append(f'{prefix}_{name}{{stage="{stage}"}} {timer[field]}')
+
+        lines.append(f'# HELP {prefix}_events_total Event counters.')
+        lines.append(f'# TYPE {prefix}_events_total counter')
+        for counter, value in sorted(snapshot['counters'].items()):
+            lines.append(f'{prefix}_events_total{{event="{counter}"}} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+    @contextmanager
+    def capture(self, profile: bool = False, memory: bool = False):
+        """
+        Scopes the collection to a block of code, typically one request, e.g.:
+
+            with metrics.capture(profile=True) as capture:
+                group_rec.get_recommendations_satisfactions_and_disagreements_for_group(group)
+            print(capture.metrics, capture.profile_text())
+
+        The values collected inside the block are stored in the Capture and also added to the global ones.
+        Captures are meant for one request at a time, concurrent requests would be collected together.
+
+        Args:
+            profile (bool, optional): Run the block under cProfile. Defaults to False.
+            memory (bool, optional): Trace the peak memory of the block with tracemalloc. Defaults to False.
+
+        Yields:
+            Capture: Filled with the metrics, profile and peak memory when the block exits.
+        """
+        capture = Capture()
+        was_enabled = self.enabled
+
+        with self._lock:
+            outer_timers, outer_counters = self.timers, self.counters
+            self.timers, self.counters = {}, {}
+
+        profiler = cProfile.Profile() if profile else None
+        started_tracing = memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if memory:
+            tracemalloc.reset_peak()
+
+        self.enable()
+        if profiler is not None:
+            profiler.enable()
+
+        try:
+            yield capture
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                capture.profile = pstats.Stats(profiler)
+            if memory:
+                capture.peak_memory = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            if not was_enabled:
+                self.disable()
+
+            capture.metrics = self.snapshot()
+
+            # Add the values of the block to the global ones
+            with self._lock:
+                inner_timers, inner_counters = self.timers, self.counters
+                self.timers, self.counters = outer_timers, outer_counters
+
+            for stage, (calls, total, maximum) in inner_timers.items():
+                timer = self.timers.setdefault(stage, [0, 0.0, 0.0])
+                timer[0] += calls
+                timer[1] += total
+                timer[2] = max(timer[2], maximum)
+            for name, value in inner_counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+
+class Capture:
+    """
+    Result of Instrumentation.capture.
+    """
+
+    def __init__(self) -> None:
+        # Timers and counters of the captured block, see Instrumentation.snapshot
+        self.metrics: dict[str, dict] = None
+        self.profile: pstats.Stats = None
+        self.peak_memory: int = None
+
+
+    def profile_text(self, limit: int = 20, sort: str = 'cumulative') -> str:
+        """
+        Formats the top entries of the profile, empty if the block was not profiled.
+        """
+        if self.profile is None:
+            return ''
+
+        stream = io.StringIO()
+        self.profile.stream = stream
+        self.profile.sort_stats(sort).print_stats(limit)
+
+        return stream.getvalue()
+
+
+class traced:
+    """
+    Marks a method as a stage of the instrumentation: `@traced('user.prediction')`.
+
+    The method stays the plain function until the instrumentation is enabled. It must be the outermost decorator
+    of a method defined in a class body.
+    """
+
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+        self.function = None
+
+
+    def __call__(self, function: Callable) -> 'traced':
+        self.function = function
+        return self
+
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        metrics._register(owner, name, self.function, self.stage)
+
+
+# Instrumentation of the recommender stack
+metrics = Instrumentation()
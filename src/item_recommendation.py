@@ -0,0 +1,459 @@
+import json
+import os
+import numpy as np
+import dataset
+from rating_matrix import RatingMatrix
+from ranking import top_n_indices
+from instrumentation import traced
+
+
+class ItemNeighborIndex:
+    """
+    Precomputed top-K most similar movies of every movie of a dataset, for item-based collaborative filtering.
+
+    The table is stored as two (movies x K) arrays, with the neighbors of each movie sorted by similarity in
+    descending order (ties in ascending movie ID order). Only positively similar movies are kept, so the rows of
+    the movies with fewer than K of them are padded with -1 neighbors and 0 similarities.
+
+    Similarities are computed over the users who rated both movies:
+        - 'acosine': adjusted cosine, the ratings centered on the mean rating of each user.
+        - 'pcc': Pearson correlation, the ratings centered on the mean rating of each movie over the common users.
+
+    The index can be saved to a folder of .npy files and loaded back memory-mapped. Neighbors are stored by
+    position in the index's own `movie_ids`, so it stays valid when ratings (or movies) are added to the dataset.
+    """
+
+    METRICS = ('acosine', 'pcc')
+
+    def __init__(self, metric: str, movie_ids: np.ndarray, neighbors: np.ndarray, similarities: np.ndarray,
+                 movie_means: np.ndarray) -> None:
+        self.metric = metric
+        self.movie_ids = np.asarray(movie_ids)
+
+        # neighbors[m] are the positions in movie_ids of the top-K neighbors of the movie at position m
+        self.neighbors = neighbors
+        self.similarities = similarities
+
+        # Mean rating of every movie when the index was built (NaN for movies without ratings)
+        self.movie_means = np.asarray(movie_means)
+
+        # Reverse lists (the movies having each movie among their neighbors), built on first access
+        self._reverse: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray] = None
+
+
+    @property
+    def k(self) -> int:
+        return self.neighbors.shape[1]
+
+
+    @classmethod
+    def build(cls, matrix: RatingMatrix, metric: str = 'acosine', k: int = 50, shrinkage: float = 100.0,
+              min_common_users: int = 2, block_size: int = 256) -> 'ItemNeighborIndex':
+        """
+        Builds the neighbor table computing the similarities of blocks of movies against all movies.
+
+        Args:
+            matrix (RatingMatrix): Rating matrix of the dataset.
+            metric (str, optional): Similarity metric, one of METRICS. Defaults to 'acosine'.
+            k (int, optional): Number of neighbors to keep for each movie. Defaults to 50.
+            shrinkage (float, optional): Shrinks the similarity of the movies with few common users,
+                multiplying it by common / (common + shrinkage). Without it, pairs rated by a single common user
+                are similar ±1 and crowd out the others. Defaults to 100, 0 disables it.
+            min_common_users (int, optional): Minimum number of users who rated both movies for them to be
+                neighbors. Defaults to 2.
+            block_size (int, optional): Number of movies whose similarities are computed together. Defaults to 256.
+
+        Returns:
+            ItemNeighborIndex: The neighbor index.
+        """
+        if metric not in ItemNeighborIndex.METRICS:
+            raise ValueError(f"Unknown item similarity metric '{metric}', expected one of {ItemNeighborIndex.METRICS}")
+
+        num_movies = len(matrix.movie_ids)
+        k = max(0, min(k, num_movies - 1))
+
+        neighbors = np.full((num_movies, k), -1, dtype=np.int32)
+        similarities = np.zeros((num_movies, k), dtype=np.float64)
+
+        for start in range(0, num_movies, block_size):
+            block = np.arange(start, min(start + block_size, num_movies))
+            block_similarities = ItemNeighborIndex._block_similarities(matrix, block, metric, shrinkage,
+                                                                       min_common_users)
+
+            # A movie is never a neighbor of itself, and only positive similarities are kept
+            block_similarities[np.arange(len(block)), block] = -np.inf
+            block_similarities[block_similarities <= 0] = -np.inf
+
+            for row, movie_index in enumerate(block):
+                order = top_n_indices(block_similarities[row], k)
+                order = order[np.isfinite(block_similarities[row, order])]
+                neighbors[movie_index, :len(order)] = order
+                similarities[movie_index, :len(order)] = block_similarities[row, order]
+
+        return cls(metric, matrix.movie_ids.copy(), neighbors, similarities, matrix.movie_means())
+
+
+    @staticmethod
+    def _block_similarities(matrix: RatingMatrix, block: np.ndarray, metric: str, shrinkage: float,
+                            min_common_users: int) -> np.ndarray:
+        # Similarities of the movies of a block with all the movies: for every user who rated a movie of the block,
+        # its ratings of all the movies are paired with the rating of the block movie, and reduced per movie pair
+        num_movies = len(matrix.movie_ids)
+        shape = (len(block), num_movies)
+
+        owners, users, block_ratings = matrix.gather_columns(block)
+        rows, other_movies, other_ratings = matrix.gather_rows(users)
+
+        keys = owners[rows] * num_movies + other_movies
+        query_ratings = block_ratings[rows].astype(np.float64)
+        other_ratings = other_ratings.astype(np.float64)
+
+        def reduce(values: np.ndarray) -> np.ndarray:
+            return np.bincount(keys, weights=values, minlength=shape[0] * shape[1]).reshape(shape)
+
+        counts = reduce(None)
+
+        if metric == 'acosine':
+            user_means = matrix.user_means[users[rows]]
+            query_ratings -= user_means
+            other_ratings -= user_means
+        else:
+            # Means of both movies over their common users
+            safe_counts = np.maximum(counts, 1)
+            query_ratings -= (reduce(query_ratings) / safe_counts).ravel()[keys]
+            other_ratings -= (reduce(other_ratings) / safe_counts).ravel()[keys]
+
+        numerator = reduce(query_ratings * other_ratings)
+        denominator = np.sqrt(reduce(query_ratings ** 2)) * np.sqrt(reduce(other_ratings ** 2))
+        similarity = np.divide(numerator, denominator, out=np.zeros(shape), where=denominator != 0)
+
+        if shrinkage > 0:
+            similarity *= counts / (counts + shrinkage)
+        similarity[counts < min_common_users] = 0
+
+        return similarity
+
+
+    def save(self, path: str) -> None:
+        """
+        Saves the index into a folder, one .npy file per array plus a metadata file.
+
+        Args:
+            path (str): Path of the folder, created if it doesn't exist.
+        """
+        os.makedirs(path, exist_ok=True)
+
+        np.save(os.path.join(path, 'movie_ids.npy'), self.movie_ids)
+        np.save(os.path.join(path, 'neighbors.npy'), self.neighbors)
+        np.save(os.path.join(path, 'similarities.npy'), self.similarities)
+        np.save(os.path.join(path, 'movie_means.npy'), self.movie_means)
+
+        with open(os.path.join(path, 'metadata.json'), 'w') as file:
+            json.dump({'metric': self.metric, 'k': self.k, 'movies': len(self.movie_ids)}, file)
+
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'ItemNeighborIndex':
+        """
+        Loads an index saved with `save`.
+
+        Args:
+            path (str): Path of the folder.
+            mmap (bool, optional): Memory-map the neighbor table instead of reading it. Defaults to True.
+
+        Returns:
+            ItemNeighborIndex: The neighbor index.
+        """
+        mmap_mode = 'r' if mmap else None
+
+        with open(os.path.join(path, 'metadata.json')) as file:
+            metadata = json.load(file)
+
+        movie_ids = np.load(os.path.join(path, 'movie_ids.npy'))
+        neighbors = np.load(os.path.join(path, 'neighbors.npy'), mmap_mode=mmap_mode)
+        similarities = np.load(os.path.join(path, 'similarities.npy'), mmap_mode=mmap_mode)
+        movie_means = np.load(os.path.join(path, 'movie_means.npy'))
+
+        return cls(metadata['metric'], movie_ids, neighbors, similarities, movie_means)
+
+
+    def movie_positions(self, movie_ids) -> np.ndarray:
+        """
+        Maps movie IDs to their positions in the index, -1 for the movies unknown to the index.
+        """
+        return RatingMatrix._search_all(self.movie_ids, movie_ids)
+
+
+    def top_n(self, movie: int, n: int = 10) -> list[tuple[int, float]]:
+        """
+        Retrieves the top N most similar movies of a movie, N must not be greater than K.
+
+        Args:
+            movie (int): ID of the movie.
+            n (int, optional): Number of neighbors. Defaults to 10.
+
+        Returns:
+            list[tuple[int, float]]: List of tuples containing the neighbor IDs and their similarity scores.
+        """
+        position = self.movie_positions([movie])[0]
+        if position < 0:
+            raise KeyError(movie)
+
+        neighbors = np.asarray(self.neighbors[position, :n])
+        found = neighbors >= 0
+
+        return list(zip(self.movie_ids[neighbors[found]].tolist(), np.asarray(self.similarities[position, :n])[found].tolist()))
+
+
+    @property
+    def reverse(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Reverse view of the neighbor table, built on first access.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: (indptr, movie positions, ranks, similarities),
+                where the movies having the movie at position m among their neighbors (and its rank and similarity
+                in their rows) are at positions indptr[m]:indptr[m + 1].
+        """
+        if self._reverse is None:
+            neighbors = np.asarray(self.neighbors).ravel()
+            found = np.flatnonzero(neighbors >= 0)
+
+            order = found[np.argsort(neighbors[found], kind='stable')]
+            counts = np.bincount(neighbors[found], minlength=len(self.movie_ids))
+
+            indptr = np.zeros(len(self.movie_ids) + 1, dtype=np.int64)
+            np.cumsum(counts, out=indptr[1:])
+
+            self._reverse = (indptr, (order // self.k).astype(np.int32), (order % self.k).astype(np.int32),
+                             np.asarray(self.similarities).ravel()[order])
+
+        return self._reverse
+
+
+class ItemRecommendation:
+    """
+    Item-based collaborative filtering over a precomputed ItemNeighborIndex.
+
+    The predicted rating of a movie is a weighted average of the user's ratings of its most similar movies
+    (at most `neighbor_size` of them, among the K neighbors of the index) centered on the user's mean rating
+    for the adjusted cosine and on each movie's mean rating for PCC, the weights summing to at least 1 so that
+    weakly similar neighbors move the prediction less. Movies none of whose neighbors were rated by the user
+    are predicted as the baseline: the user's mean rating, or the movie's mean rating for PCC.
+    Predicting all the movies only walks the reverse neighbor lists of the user's rated movies, so the cost
+    depends on the size of the user's profile and not on the number of users.
+
+    It has the prediction API of UserRecommendation used by GroupRecommendation and BatchRecommendation (its worker
+    processes included, see configuration), so it can replace it as the prediction source of the group recommendations:
+
+        group_recommendation = GroupRecommendation(ItemRecommendation(dataset))
+
+    There are no user neighbors in an item-based model: top_n_similar_users returns no neighbors and the
+    *_from_neighbors methods ignore them, and the similarity_function arguments are ignored as well.
+    """
+
+    def __init__(self, dataset: dataset.Dataset, item_index: ItemNeighborIndex = None, metric: str = 'acosine',
+                 k: int = 50, neighbor_size: int = 50, shrinkage: float = 100.0, min_common_users: int = 2) -> None:
+        """
+        Args:
+            dataset (dataset.Dataset): Dataset of the recommendations.
+            item_index (ItemNeighborIndex, optional): Precomputed index, e.g. loaded with ItemNeighborIndex.load.
+                If None, it is built over the dataset with `metric` and `k`.
+            metric (str, optional): Similarity metric of the index built if none is given. Defaults to 'acosine'.
+            k (int, optional): Number of neighbors of the index built if none is given. Defaults to 50.
+            neighbor_size (int, optional): Number of rated movies of each prediction, unless a method is given another
+                one. GroupRecommendation always uses this one, for the members' top N and the group ratings. Defaults to 50.
+            shrinkage (float, optional): Similarity shrinkage of the index built if none is given, see
+                ItemNeighborIndex.build. Defaults to 100.
+            min_common_users (int, optional): Minimum number of common users of the neighbors of the index built if
+                none is given, see ItemNeighborIndex.build. Defaults to 2.
+        """
+        self.dataset = dataset
+        self.vectorized = True
+        self.neighbor_size = neighbor_size
+        self.shrinkage = shrinkage
+        self.min_common_users = min_common_users
+
+        if item_index is None:
+            item_index = ItemNeighborIndex.build(dataset.rating_matrix, metric, k, shrinkage, min_common_users)
+        self.item_index = item_index
+
+
+    def configuration(self) -> dict:
+        """
+        Settings of this recommender besides its dataset, see UserRecommendation.configuration.
+        """
+        return {'item_index': self.item_index, 'neighbor_size': self.neighbor_size, 'shrinkage': self.shrinkage,
+                'min_common_users': self.min_common_users}
+
+
+    @classmethod
+    def from_configuration(cls, dataset: dataset.Dataset, configuration: dict) -> 'ItemRecommendation':
+        """
+        Builds a recommender with the settings of another one (see configuration), given a copy of its dataset.
+        """
+        return cls(dataset, configuration['item_index'], neighbor_size=configuration['neighbor_size'],
+                   shrinkage=configuration['shrinkage'], min_common_users=configuration['min_common_users'])
+
+
+    def top_n_similar_items(self, movie: int, n: int = 10) -> list[tuple[int, float]]:
+        """
+        Retrieves the top N most similar movies of a movie, N must not be greater than the K of the index.
+        """
+        return self.item_index.top_n(movie, n)
+
+
+    def top_n_similar_users(self, user: int, similarity_function=None, n: int = 10) -> list[tuple[int, float]]:
+        """
+        Item-based models have no user neighbors, the predictions only use the user's own ratings.
+        """
+        return []
+
+
+    @traced('item.predictions')
+    def _all_predictions(self, user: int, neighbor_size: int) -> np.ndarray:
+        # Predicted rating of the user for every movie of the index
+        index = self.item_index
+        matrix = self.dataset.rating_matrix
+        mean = self.dataset.get_user_mean_rating(user)
+
+        rated_movies, ratings = matrix.get_row(matrix.user_index(user))
+        positions = index.movie_positions(matrix.movie_ids[rated_movies])
+        known = positions >= 0
+        positions, ratings = positions[known], ratings[known].astype(np.float64)
+
+        if index.metric == 'pcc':
+            baseline = np.where(np.isnan(index.movie_means), mean, index.movie_means)
+            deviations = ratings - baseline[positions]
+        else:
+            baseline = np.full(len(index.movie_ids), mean)
+            deviations = ratings - mean
+
+        # Rated movies paired with every movie they are a neighbor of
+        indptr, targets, ranks, similarities = index.reverse
+        owners, entries = RatingMatrix._gather(indptr, positions)
+        targets, ranks, similarities = targets[entries], ranks[entries], similarities[entries]
+
+        # Only the `neighbor_size` most similar rated movies of each movie
+        if neighbor_size < index.k:
+            order = np.lexsort((ranks, targets))
+            starts = np.flatnonzero(np.r_[True, targets[order][1:] != targets[order][:-1]])
+            rank_among_rated = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+            kept = order[rank_among_rated < neighbor_size]
+            owners, targets, similarities = owners[kept], targets[kept], similarities[kept]
+
+        numerator = np.bincount(targets, weights=similarities * deviations[owners], minlength=len(index.movie_ids))
+        denominator = np.bincount(targets, weights=np.abs(similarities), minlength=len(index.movie_ids))
+
+        # Weighted mean of the deviations, pulled towards the baseline when the rated neighbors are only weakly
+        # similar (total similarity below 1): otherwise a single shrunk neighbor would predict its own rating
+        return baseline + numerator / np.maximum(denominator, 1)
+
+
+    def predictions_from_neighbors(self, user: int, movies: list[int], neighbors: list[tuple[int, float]] = None,
+                                   neighbor_size: int = None) -> np.ndarray:
+        """
+        Predicts the ratings of several movies for a user.
+
+        Args:
+            user (int): ID of the user.
+            movies (list[int]): IDs of the movies.
+            neighbors (list[tuple[int, float]], optional): Ignored, see the class documentation.
+            neighbor_size (int, optional): Number of rated movies of each prediction. Defaults to the `neighbor_size` attribute.
+
+        Returns:
+            np.ndarray: Predicted ratings of the movies, the user's mean rating for movies unknown to the index.
+        """
+        if neighbor_size is None:
+            neighbor_size = self.neighbor_size
+
+        predictions = self._all_predictions(user, neighbor_size)
+        positions = self.item_index.movie_positions(movies)
+
+        return np.where(positions >= 0, predictions[positions], self.dataset.get_user_mean_rating(user))
+
+
+    def prediction_from_neighbors(self, user: int, movie: int, neighbors: list[tuple[int, float]] = None) -> float:
+        """
+        Predicts the rating of a movie for a user, see predictions_from_neighbors.
+        """
+        return float(self.predictions_from_neighbors(user, [movie], neighbors)[0])
+
+
+    def predictions_for_users(self, users: list[int], movies: list[int],
+                              neighbors_by_user: dict[int, list[tuple[int, float]]] = None) -> np.ndarray:
+        """
+        Predicts the ratings of several movies for several users (e.g. the members of a group).
+
+        Returns:
+            np.ndarray: Matrix of shape (len(users), len(movies)) with the predicted ratings.
+        """
+        predictions = np.empty((len(users), len(movies)))
+        for row, user in enumerate(users):
+            predictions[row] = self.predictions_from_neighbors(user, movies)
+
+        return predictions
+
+
+    def recommendations_from_neighbors(self, user: int, neighbors: list[tuple[int, float]] = None, n: int = None,
+                                       exclude_movies: set[int] = set(), neighbor_size: int = None) -> list[tuple[int, float]]:
+        """
+        Ranks the movies not rated by a user by their predicted rating (ties in ascending movie ID order).
+
+        Args:
+            user (int): ID of the user.
+            neighbors (list[tuple[int, float]], optional): Ignored, see the class documentation.
+            n (int, optional): Only return the N recommendations with the highest prediction. If None, all of them are returned.
+            exclude_movies (set[int], optional): Movies that must not be recommended.
+            neighbor_size (int, optional): Number of rated movies of each prediction. Defaults to the `neighbor_size` attribute.
+
+        Returns:
+            List[tuple[int, float]]: List of tuples containing movie IDs and their predicted ratings.
+        """
+        # Sorted array of movie IDs, so that ties in the predictions are in ascending movie ID order
+        candidates = self.dataset.get_unrated_movies(user)
+        if len(exclude_movies) > 0:
+            candidates = candidates[~np.isin(candidates, list(exclude_movies))]
+
+        predictions = self.predictions_from_neighbors(user, candidates, neighbor_size=neighbor_size)
+
+        # Predicted ratings in descending order
+        order = top_n_indices(predictions, n)
+        return list(zip(candidates[order].tolist(), predictions[order].tolist()))
+
+
+    @traced('item.recommendations')
+    def get_all_recommendations_for_user(self, user: int, similarity_function=None, neighbor_size: int = None,
+                                         exclude_movies: set[int] = set(), n: int = None) -> list[tuple[int, float]]:
+        """
+        Get all movie recommendations for a user, as UserRecommendation.get_all_recommendations_for_user.
+
+        Args:
+            user (int): ID of the user.
+            similarity_function (function, optional): Ignored, the similarities are the ones of the item index.
+            neighbor_size (int, optional): Number of rated movies of each prediction. Defaults to the `neighbor_size` attribute.
+            exclude_movies (set[int], optional): Movies that must not be recommended.
+            n (int, optional): Only return the N recommendations with the highest prediction. If None, all of them are returned.
+
+        Returns:
+            List[tuple[int, float]]: List of tuples containing movie IDs and their predicted ratings.
+        """
+        return self.recommendations_from_neighbors(user, None, n, exclude_movies, neighbor_size)
+
+
+    def top_n_recommendations(self, user: int, similarity_function=None, n: int = 10,
+                              neighbor_size: int = None, exclude_movies: set[int] = set()) -> list[tuple[int, float]]:
+        """
+        Generates top N movie recommendations for a given user, excluding movies already rated by the user.
+
+        Args:
+            user (int): ID of the user.
+            similarity_function (function, optional): Ignored, the similarities are the ones of the item index.
+            n (int, optional): Number of recommendations to generate. Defaults to 10.
+            neighbor_size (int, optional): Number of rated movies of each prediction. Defaults to the `neighbor_size` attribute.
+            exclude_movies (set[int], optional): Movies that must not be recommended.
+
+        Returns:
+            List[tuple[int, float]]: List of tuples containing movie IDs and their predicted ratings.
+        """
+        return self.get_all_recommendations_for_user(user, similarity_function, neighbor_size, exclude_movies, n)[:n]
@@ -0,0 +1,250 @@
+import json
+import os
+import numpy as np
+from rating_matrix import RatingMatrix
+
+
+class LSHIndex:
+    """
+    Locality-sensitive hashing index of the users of a dataset, to retrieve the candidate neighbors of a user
+    without scanning every user. The candidates are then re-ranked exactly by UserRecommendation.
+
+    Cosine based metrics hash the rating vectors (mean-centered for adjusted cosine and the PCC based metrics)
+    with random projections: each table keeps the sign of `num_bits` random projections, so users pointing in a
+    similar direction share a bucket. Jaccard hashes the sets of rated movies with MinHash, each table being a band
+    of `num_bits` MinHash values. A user's candidates are the users sharing a bucket with it in any table.
+
+    Recall and latency are tuned at query time with `tables` (how many of the tables are probed) and, for random
+    projections, `probes` (how many more buckets of each table are probed, flipping the least certain bits first).
+
+    Retrieving candidates only pays off when they are a small part of the users: UserRecommendation falls back to the
+    exact scan above MAX_CANDIDATE_FRACTION of them, as happens with the default random projections below about
+    10,000 users (buckets of BUCKET_SIZE users are then a large part of them).
+    """
+
+    # metric -> hashing scheme
+    METRICS = {'cosine': 'projection', 'acosine': 'centered', 'pcc': 'centered', 'wpcc': 'centered',
+               'pcc_jaccard': 'centered', 'acosine_jaccard': 'centered', 'jaccard': 'minhash'}
+
+    # Average number of users per bucket of the default number of random projection bits
+    BUCKET_SIZE = 256
+
+    # Default number of tables of random projections and of MinHash bands
+    NUM_TABLES = {'projection': 8, 'centered': 8, 'minhash': 64}
+
+    # Fraction of the users above which re-ranking the candidates costs more than scanning every user
+    MAX_CANDIDATE_FRACTION = 0.25
+
+    def __init__(self, metric: str, user_ids: np.ndarray, movie_ids: np.ndarray, hashes: np.ndarray,
+                 codes: np.ndarray, num_bits: int, tables: int = None, probes: int = 0) -> None:
+        """
+        Args:
+            metric (str): Similarity metric the index was built for.
+            user_ids (np.ndarray): Sorted IDs of the indexed users.
+            movie_ids (np.ndarray): Sorted IDs of the movies the hash functions are defined on.
+            hashes (np.ndarray): Random projections (movies x tables * bits) or MinHash permutations (tables * bits x movies).
+            codes (np.ndarray): (tables x users) bucket of each user in each table.
+            num_bits (int): Bits (or MinHash values) of each table.
+            tables (int, optional): Tables probed by default, all of them if None.
+            probes (int, optional): Extra buckets probed by default in each table. Defaults to 0.
+        """
+        self.metric = metric
+        self.scheme = LSHIndex.METRICS[metric]
+        self.user_ids = np.asarray(user_ids)
+        self.movie_ids = np.asarray(movie_ids)
+        self.hashes = hashes
+        self.codes = codes
+        self.num_bits = num_bits
+
+        if self.scheme == 'minhash' and probes > 0:
+            raise ValueError('MinHash indexes have no multi-probe, tune their recall with the number of tables')
+
+        self.tables = tables if tables is not None else self.num_tables
+        self.probes = probes
+
+        # Users of each table sorted by bucket, so that a bucket is a range found with a binary search
+        self._orders = np.argsort(codes, axis=1, kind='stable')
+        self._sorted_codes = np.take_along_axis(codes, self._orders, axis=1)
+
+        self._user_to_index: dict[int, int] = {int(user): index for index, user in enumerate(self.user_ids)}
+
+
+    @property
+    def num_tables(self) -> int:
+        return self.codes.shape[0]
+
+
+    @classmethod
+    def build(cls, matrix: RatingMatrix, metric: str = 'pcc', num_tables: int = None, num_bits: int = None,
+              seed: int = 0, threshold: float = 0.15) -> 'LSHIndex':
+        """
+        Hashes every user of a rating matrix.
+
+        Args:
+            matrix (RatingMatrix): Rating matrix of the dataset.
+            metric (str, optional): Similarity metric, one of METRICS. Defaults to 'pcc'.
+            num_tables (int, optional): Number of hash tables, more tables find more neighbors.
+                Defaults to NUM_TABLES of the hashing scheme of the metric.
+            num_bits (int, optional): Bits of each table, more bits make smaller buckets. Defaults to buckets of about
+                BUCKET_SIZE users with random projections, and to the MinHash values per band of `threshold`.
+            seed (int, optional): Seed of the hash functions. Defaults to 0.
+            threshold (float, optional): MinHash only, Jaccard similarity from which two users likely share a band
+                (about (1 / num_tables) ** (1 / num_bits)). Defaults to 0.15, the order of the Jaccard similarity of
+                the top-20 neighbors on MovieLens.
+
+        Returns:
+            LSHIndex: The index.
+        """
+        if metric not in LSHIndex.METRICS:
+            raise ValueError(f"Metric '{metric}' can't be hashed, expected one of {tuple(LSHIndex.METRICS)}")
+
+        if num_tables is None:
+            num_tables = LSHIndex.NUM_TABLES[LSHIndex.METRICS[metric]]
+
+        if num_bits is None and LSHIndex.METRICS[metric] == 'minhash':
+            if not 0 < threshold < 1:
+                raise ValueError('The Jaccard threshold must be between 0 and 1')
+            num_bits = max(1, round(np.log(num_tables) / np.log(1 / threshold)))
+        elif num_bits is None:
+            num_bits = max(1, int(np.log2(max(matrix.shape[0], 1) / LSHIndex.BUCKET_SIZE)))
+        if not 0 < num_bits < 64:
+            raise ValueError('The number of bits must be between 1 and 63')
+
+        rng = np.random.default_rng(seed)
+        num_movies = len(matrix.movie_ids)
+        rows = matrix.row_indices()
+
+        if LSHIndex.METRICS[metric] == 'minhash':
+            hashes = rng.permuted(np.tile(np.arange(num_movies, dtype=np.uint32), (num_tables * num_bits, 1)), axis=1)
+            values = np.stack([LSHIndex._min_per_row(matrix.indptr, permutation[matrix.indices]) for permutation in hashes])
+        else:
+            hashes = rng.standard_normal((num_movies, num_tables * num_bits)).astype(np.float32)
+            ratings = LSHIndex._vector_values(metric, matrix.data, matrix.user_means[rows])
+            values = np.stack([np.bincount(rows, weights=ratings * hashes[matrix.indices, column], minlength=matrix.shape[0])
+                               for column in range(hashes.shape[1])])
+
+        codes = np.stack([LSHIndex._codes(cls.METRICS[metric], values[table * num_bits:(table + 1) * num_bits])
+                          for table in range(num_tables)])
+
+        return cls(metric, matrix.user_ids.copy(), matrix.movie_ids.copy(), hashes, codes, num_bits)
+
+
+    @staticmethod
+    def _vector_values(metric: str, ratings: np.ndarray, means: np.ndarray) -> np.ndarray:
+        ratings = ratings.astype(np.float64)
+        return ratings if LSHIndex.METRICS[metric] == 'projection' else ratings - means
+
+
+    @staticmethod
+    def _min_per_row(indptr: np.ndarray, values: np.ndarray) -> np.ndarray:
+        # Minimum of the values of each CSR row, users without ratings get the maximum value
+        result = np.full(len(indptr) - 1, np.iinfo(np.uint32).max, dtype=np.uint32)
+        non_empty = np.flatnonzero(np.diff(indptr) > 0)
+        if len(non_empty) > 0:
+            result[non_empty] = np.minimum.reduceat(values, indptr[non_empty])
+        return result
+
+
+    @staticmethod
+    def _codes(scheme: str, values: np.ndarray) -> np.ndarray:
+        # Bucket of each column of a (bits x users) block of hash values
+        if scheme == 'minhash':
+            # Mix the MinHash values of the band into one 64 bit key (wrapping multiplications)
+            code = np.zeros(values.shape[1:], dtype=np.uint64)
+            for value in values:
+                code = code * np.uint64(0x9E3779B97F4A7C15) + value.astype(np.uint64)
+            return code
+
+        weights = np.left_shift(np.uint64(1), np.arange(values.shape[0], dtype=np.uint64))
+        return ((values > 0).astype(np.uint64) * weights.reshape((-1,) + (1,) * (values.ndim - 1))).sum(axis=0)
+
+
+    def has_user(self, user: int) -> bool:
+        return user in self._user_to_index
+
+
+    def candidates(self, movie_ids: np.ndarray, ratings: np.ndarray, user_mean: float, tables: int = None,
+                   probes: int = None) -> np.ndarray:
+        """
+        Retrieves the candidate neighbors of a rating vector, e.g. the current ratings of a user.
+
+        Args:
+            movie_ids (np.ndarray): Movies rated by the user, movies unknown to the index are ignored.
+            ratings (np.ndarray): Corresponding ratings.
+            user_mean (float): Mean rating of the user.
+            tables (int, optional): Number of tables probed. Defaults to the `tables` attribute.
+            probes (int, optional): Extra buckets probed in each table, random projections only.
+                Defaults to the `probes` attribute.
+
+        Returns:
+            np.ndarray: Sorted IDs of the candidate users (the user itself included, if indexed).
+
+        Raises:
+            ValueError: If probes are requested from a MinHash index.
+        """
+        tables = min(tables if tables is not None else self.tables, self.num_tables)
+        probes = probes if probes is not None else self.probes
+        if self.scheme == 'minhash' and probes > 0:
+            raise ValueError('MinHash indexes have no multi-probe, tune their recall with the number of tables')
+        probes = min(probes, self.num_bits)
+
+        positions = np.searchsorted(self.movie_ids, movie_ids)
+        known = positions < len(self.movie_ids)
+        known[known] = self.movie_ids[positions[known]] == np.asarray(movie_ids)[known]
+        positions = positions[known]
+
+        if self.scheme == 'minhash':
+            values = self.hashes[:tables * self.num_bits, positions].min(axis=1) if len(positions) > 0 \
+                else np.full(tables * self.num_bits, np.iinfo(np.uint32).max, dtype=np.uint32)
+            values = values.reshape(tables, self.num_bits)
+            buckets = [[code] for code in LSHIndex._codes(self.scheme, values.T)]
+        else:
+            vector = LSHIndex._vector_values(self.metric, np.asarray(ratings)[known], user_mean)
+            values = (vector @ self.hashes[positions, :tables * self.num_bits]).reshape(tables, self.num_bits)
+            codes = LSHIndex._codes(self.scheme, values.T)
+
+            # Multi-probe: flip one bit at a time, starting from the projections closest to the hyperplane
+            flips = np.argsort(np.abs(values), axis=1)[:, :probes].astype(np.uint64)
+            buckets = [[code] + [code ^ (np.uint64(1) << bit) for bit in table_flips]
+                       for code, table_flips in zip(codes, flips)]
+
+        found = []
+        for table, table_buckets in enumerate(buckets):
+            sorted_codes = self._sorted_codes[table]
+            for code in table_buckets:
+                start, end = np.searchsorted(sorted_codes, code, 'left'), np.searchsorted(sorted_codes, code, 'right')
+                found.append(self._orders[table, start:end])
+
+        if len(found) == 0:
+            return np.empty(0, dtype=self.user_ids.dtype)
+
+        return self.user_ids[np.unique(np.concatenate(found))]
+
+
+    def save(self, path: str) -> None:
+        """
+        Saves the index into a folder, one .npy file per array plus a metadata file.
+        """
+        os.makedirs(path, exist_ok=True)
+
+        np.save(os.path.join(path, 'user_ids.npy'), self.user_ids)
+        np.save(os.path.join(path, 'movie_ids.npy'), self.movie_ids)
+        np.save(os.path.join(path, 'hashes.npy'), self.hashes)
+        np.save(os.path.join(path, 'codes.npy'), self.codes)
+
+        with open(os.path.join(path, 'metadata.json'), 'w') as file:
+            json.dump({'metric': self.metric, 'num_bits': self.num_bits, 'tables': self.tables, 'probes': self.probes}, file)
+
+
+    @classmethod
+    def load(cls, path: str) -> 'LSHIndex':
+        """
+        Loads an index saved with `save`.
+        """
+        with open(os.path.join(path, 'metadata.json')) as file:
+            metadata = json.load(file)
+
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy')) for name in ('user_ids', 'movie_ids', 'hashes', 'codes')}
+
+        return cls(metadata['metric'], arrays['user_ids'], arrays['movie_ids'], arrays['hashes'], arrays['codes'],
+                   metadata['num_bits'], metadata['tables'], metadata['probes'])
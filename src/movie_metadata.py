@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+
+class MovieMetadata:
+    """
+    Array based index of the movie metadata (title, genres and average rating).
+
+    Movies are addressed by row, with a movieId -> row dictionary, so that lookups don't go through pandas.
+    Genres are integer coded (CSR like `genre_indptr`/`genre_codes` arrays) and also available as a multi-hot
+    (movies x genres) matrix.
+    """
+
+    def __init__(self, movies_df: pd.DataFrame, genres: list[str], avg_ratings: pd.Series = None) -> None:
+        """
+        Args:
+            movies_df (pd.DataFrame): Movies dataframe with `movieId`, `title` and `genres` (list of names) columns.
+            genres (list[str]): Names of the genres, the position of a genre is its code.
+            avg_ratings (pd.Series, optional): Average rating indexed by movie ID, movies without ratings get NaN.
+        """
+        self.movie_ids = movies_df['movieId'].to_numpy()
+        self.titles = movies_df['title'].to_numpy(dtype=object)
+        self.genres = list(genres)
+
+        self._movie_to_row: dict[int, int] = {int(movie): row for row, movie in enumerate(self.movie_ids)}
+
+        # Integer coded genres: the genres of the movie at row r are genre_codes[genre_indptr[r]:genre_indptr[r + 1]]
+        genre_to_code = {genre: code for code, genre in enumerate(self.genres)}
+        movie_genres = movies_df['genres'].tolist()
+        lengths = np.fromiter((len(names) for names in movie_genres), dtype=np.int64, count=len(movie_genres))
+
+        self.genre_indptr = np.zeros(len(movie_genres) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.genre_indptr[1:])
+        self.genre_codes = np.fromiter((genre_to_code[genre] for names in movie_genres for genre in names),
+                                       dtype=np.int16, count=int(lengths.sum()))
+
+        self.genre_matrix = np.zeros((len(movie_genres), len(self.genres)), dtype=bool)
+        self.genre_matrix[np.repeat(np.arange(len(movie_genres)), lengths), self.genre_codes] = True
+
+        if avg_ratings is None:
+            self.avg_ratings = np.full(len(self.movie_ids), np.nan)
+        else:
+            self.avg_ratings = avg_ratings.reindex(self.movie_ids).to_numpy(dtype=float)
+
+
+    def rows(self, movie_ids) -> np.ndarray:
+        """
+        Maps movie IDs to rows, raises KeyError for unknown movies.
+        """
+        return np.fromiter((self._movie_to_row[movie] for movie in movie_ids), dtype=np.int64)
+
+
+    def get_title(self, movie_id: int) -> str:
+        return self.titles[self._movie_to_row[movie_id]]
+
+
+    def get_genres(self, movie_id: int) -> list[str]:
+        row = self._movie_to_row[movie_id]
+        codes = self.genre_codes[self.genre_indptr[row]:self.genre_indptr[row + 1]]
+        return [self.genres[code] for code in codes]
+
+
+    def get_titles(self, movie_ids) -> list[str]:
+        """
+        Retrieves the titles of several movies.
+
+        Args:
+            movie_ids: IDs of the movies.
+
+        Returns:
+            list[str]: Titles, in the same order of `movie_ids`.
+        """
+        return self.titles[self.rows(movie_ids)].tolist()
+
+
+    def get_genres_list(self, movie_ids) -> list[list[str]]:
+        """
+        Retrieves the genres of several movies.
+
+        Args:
+            movie_ids: IDs of the movies.
+
+        Returns:
+            list[list[str]]: Genre names of each movie, in the same order of `movie_ids`.
+        """
+        return [self.get_genres(movie) for movie in movie_ids]
+
+
+    def get_genre_matrix(self, movie_ids) -> np.ndarray:
+        """
+        Retrieves the multi-hot genre rows of several movies.
+
+        Args:
+            movie_ids: IDs of the movies.
+
+        Returns:
+            np.ndarray: Boolean matrix of shape (len(movie_ids), number of genres).
+        """
+        return self.genre_matrix[self.rows(movie_ids)]
+
+
+    def get_avg_ratings(self, movie_ids) -> np.ndarray:
+        """
+        Retrieves the average rating of several movies (NaN for movies nobody rated).
+
+        Args:
+            movie_ids: IDs of the movies.
+
+        Returns:
+            np.ndarray: Average ratings, in the same order of `movie_ids`.
+        """
+        return self.avg_ratings[self.rows(movie_ids)]
+
+
+    def describe(self, recommendations: list[tuple[int, float]], score_column: str = 'prediction') -> pd.DataFrame:
+        """
+        Builds a table with the metadata of a list of recommendations, e.g. the output of top_n_recommendations.
+
+        Args:
+            recommendations (list[tuple[int, float]]): List of tuples containing movie IDs and their scores.
+            score_column (str, optional): Name of the score column. Defaults to 'prediction'.
+
+        Returns:
+            pd.DataFrame: One row per recommendation with movieId, title, genres, avg_rating and score.
+        """
+        movie_ids = [movie for movie, _ in recommendations]
+        rows = self.rows(movie_ids)
+
+        return pd.DataFrame({
+            'movieId': movie_ids,
+            'title': self.titles[rows],
+            'genres': self.get_genres_list(movie_ids),
+            'avg_rating': self.avg_ratings[rows],
+            score_column: [score for _, score in recommendations],
+        })
@@ -0,0 +1,142 @@
+import json
+import os
+import numpy as np
+from similarity_engine import SimilarityEngine
+from ranking import top_n_indices
+
+
+class NeighborIndex:
+    """
+    Precomputed top-K neighbors of every user of a dataset for one similarity metric.
+
+    The table is stored as two (users x K) arrays, with the neighbors of each user sorted by similarity in
+    descending order (ties in ascending user ID order, like `UserRecommendation.similarity_for_all_users`).
+    It can be saved to a folder of .npy files and loaded back memory-mapped.
+
+    The index is a snapshot of the ratings it was built on, identified by their `fingerprint` (see
+    Dataset.get_fingerprint): new ratings can change the neighbors of any user, so UserRecommendation only serves
+    it to a dataset with the same ratings, in this process or in another one after a save and load.
+    """
+
+    def __init__(self, metric: str, user_ids: np.ndarray, neighbors: np.ndarray, similarities: np.ndarray,
+                 fingerprint: str = None) -> None:
+        self.metric = metric
+        self.user_ids = np.asarray(user_ids)
+        self.fingerprint = fingerprint
+
+        # neighbors[u] are the user indices of the top-K neighbors of the user at index u
+        self.neighbors = neighbors
+        self.similarities = similarities
+
+        self._user_to_index: dict[int, int] = {int(user): index for index, user in enumerate(self.user_ids)}
+
+
+    @property
+    def k(self) -> int:
+        return self.neighbors.shape[1]
+
+
+    @classmethod
+    def build(cls, engine: SimilarityEngine, metric: str = 'pcc', k: int = 50, block_size: int = 64) -> 'NeighborIndex':
+        """
+        Builds the neighbor table computing the similarities of blocks of users against all users.
+
+        Args:
+            engine (SimilarityEngine): Similarity engine of the dataset.
+            metric (str, optional): Name of the similarity metric. Defaults to 'pcc'.
+            k (int, optional): Number of neighbors to keep for each user. Defaults to 50.
+            block_size (int, optional): Number of users whose similarities are computed together. Defaults to 64.
+
+        Returns:
+            NeighborIndex: The neighbor index.
+        """
+        user_ids = engine.matrix.user_ids
+        num_users = len(user_ids)
+        k = max(0, min(k, num_users - 1))
+
+        neighbors = np.empty((num_users, k), dtype=np.int32)
+        similarities = np.empty((num_users, k), dtype=np.float64)
+
+        for start in range(0, num_users, block_size):
+            block = np.arange(start, min(start + block_size, num_users))
+            block_similarities = engine.block_similarities(user_ids[block], metric)
+
+            # A user is never a neighbor of itself
+            block_similarities[np.arange(len(block)), block] = -np.inf
+
+            for row, user_index in enumerate(block):
+                order = top_n_indices(block_similarities[row], k)
+                neighbors[user_index] = order
+                similarities[user_index] = block_similarities[row, order]
+
+        return cls(metric, user_ids, neighbors, similarities, engine.dataset.get_fingerprint())
+
+
+    def save(self, path: str) -> None:
+        """
+        Saves the index into a folder, one .npy file per array plus a metadata file.
+
+        Args:
+            path (str): Path of the folder, created if it doesn't exist.
+        """
+        os.makedirs(path, exist_ok=True)
+
+        np.save(os.path.join(path, 'user_ids.npy'), self.user_ids)
+        np.save(os.path.join(path, 'neighbors.npy'), self.neighbors)
+        np.save(os.path.join(path, 'similarities.npy'), self.similarities)
+
+        with open(os.path.join(path, 'metadata.json'), 'w') as file:
+            json.dump({'metric': self.metric, 'k': self.k, 'users': len(self.user_ids),
+                       'fingerprint': self.fingerprint}, file)
+
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'NeighborIndex':
+        """
+        Loads an index saved with `save`.
+
+        Args:
+            path (str): Path of the folder.
+            mmap (bool, optional): Memory-map the neighbor table instead of reading it. Defaults to True.
+
+        Returns:
+            NeighborIndex: The neighbor index.
+        """
+        mmap_mode = 'r' if mmap else None
+
+        with open(os.path.join(path, 'metadata.json')) as file:
+            metadata = json.load(file)
+
+        user_ids = np.load(os.path.join(path, 'user_ids.npy'))
+        neighbors = np.load(os.path.join(path, 'neighbors.npy'), mmap_mode=mmap_mode)
+        similarities = np.load(os.path.join(path, 'similarities.npy'), mmap_mode=mmap_mode)
+
+        return cls(metadata['metric'], user_ids, neighbors, similarities, metadata.get('fingerprint'))
+
+
+    def is_compatible(self, user_ids: np.ndarray) -> bool:
+        """
+        Checks if the index was built over the same users (in the same index order).
+        """
+        return np.array_equal(self.user_ids, user_ids)
+
+
+    def has_user(self, user: int) -> bool:
+        return user in self._user_to_index
+
+
+    def top_n(self, user: int, n: int = 10) -> list[tuple[int, float]]:
+        """
+        Retrieves the top N neighbors of a user, N must not be greater than K.
+
+        Args:
+            user (int): ID of the user.
+            n (int, optional): Number of neighbors. Defaults to 10.
+
+        Returns:
+            list[tuple[int, float]]: List of tuples containing the neighbor IDs and their similarity scores.
+        """
+        index = self._user_to_index[user]
+        neighbors = self.user_ids[self.neighbors[index, :n]]
+
+        return list(zip(neighbors.tolist(), self.similarities[index, :n].tolist()))
@@ -0,0 +1,56 @@
+import heapq
+import operator
+from typing import Iterable, TypeVar
+import numpy as np
+
+T = TypeVar('T')
+
+
+def top_n_indices(scores: np.ndarray, n: int = None) -> np.ndarray:
+    """
+    Selects the positions of the N highest scores without sorting the whole array.
+
+    The result is the same of a stable sort in descending order truncated to N elements:
+    scores are in descending order and equal scores keep their ascending position order.
+
+    Args:
+        scores (np.ndarray): One dimensional array of scores.
+        n (int, optional): Number of positions to select. If None, all the positions are ranked.
+
+    Returns:
+        np.ndarray: Positions of the top N scores.
+    """
+    scores = np.asarray(scores)
+
+    if n is None or n >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    negated = -scores
+
+    # The N-th highest score, every score at least as high is a candidate (ties included)
+    threshold = np.partition(negated, n - 1)[n - 1]
+    candidates = np.flatnonzero(negated <= threshold)
+
+    return candidates[np.argsort(negated[candidates], kind='stable')][:n]
+
+
+def top_n_items(items: Iterable[tuple[T, float]], n: int = None) -> list[tuple[T, float]]:
+    """
+    Selects the N (key, score) tuples with the highest score from any iterable, keeping at most N of them in a heap.
+
+    The result is the same of sorting the tuples by score in descending order and slicing the first N,
+    equal scores keep the order in which they were produced.
+
+    Args:
+        items (Iterable[tuple[T, float]]): (key, score) tuples.
+        n (int, optional): Number of tuples to select. If None, all the tuples are ranked.
+
+    Returns:
+        list[tuple[T, float]]: Top N tuples in descending order of score.
+    """
+    if n is None:
+        return sorted(items, key=operator.itemgetter(1), reverse=True)
+
+    return heapq.nlargest(n, items, key=operator.itemgetter(1))
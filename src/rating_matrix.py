@@ -0,0 +1,455 @@
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+class RatingMatrix:
+    """
+    Sparse user x movie rating matrix.
+
+    Ratings are stored in CSR layout (one row per user, sorted movie indices per row) using plain
+    NumPy arrays, with a CSC view built lazily on first use. Users and movies are mapped to dense
+    integer indices, so that downstream code can work with arrays instead of nested dictionaries.
+    """
+
+    def __init__(self, user_ids: np.ndarray, movie_ids: np.ndarray, indptr: np.ndarray,
+                 indices: np.ndarray, data: np.ndarray, user_means: np.ndarray = None, index_maps: bool = True) -> None:
+        """
+        Args:
+            user_ids (np.ndarray): Sorted user IDs, the position of a user is its index.
+            movie_ids (np.ndarray): Sorted movie IDs, the position of a movie is its index.
+            indptr (np.ndarray): CSR row pointers.
+            indices (np.ndarray): CSR movie indices.
+            data (np.ndarray): CSR ratings.
+            user_means (np.ndarray, optional): Mean rating of each user, computed if None.
+            index_maps (bool, optional): Build id -> index dictionaries. Without them IDs are looked up with a
+                binary search, so that the matrix doesn't allocate per-process Python objects. Defaults to True.
+        """
+        # index -> id
+        self.user_ids = np.asarray(user_ids)
+        self.movie_ids = np.asarray(movie_ids)
+
+        # CSR arrays: the ratings of the user at index u are data[indptr[u]:indptr[u + 1]]
+        # and the corresponding movie indices are indices[indptr[u]:indptr[u + 1]]
+        self.indptr = np.asarray(indptr)
+        self.indices = np.asarray(indices)
+        self.data = np.asarray(data)
+
+        # id -> index
+        self._user_to_index: dict[int, int] = None
+        self._movie_to_index: dict[int, int] = None
+        if index_maps:
+            self._user_to_index = {int(user): index for index, user in enumerate(self.user_ids)}
+            self._movie_to_index = {int(movie): index for index, movie in enumerate(self.movie_ids)}
+
+        if user_means is None:
+            user_means = self._compute_user_means()
+        self.user_means = np.asarray(user_means, dtype=np.float64)
+
+        self._csc: tuple[np.ndarray, np.ndarray, np.ndarray] = None
+        self._rated_movie_ids: np.ndarray = None
+
+
+    @classmethod
+    def from_ratings_df(cls, ratings_df: pd.DataFrame, movie_ids=None) -> 'RatingMatrix':
+        """
+        Builds the matrix from a ratings dataframe with `userId`, `movieId` and `rating` columns.
+
+        Args:
+            ratings_df (pd.DataFrame): Ratings dataframe.
+            movie_ids (optional): Additional movie IDs to index (e.g. the whole catalog), even if nobody rated them.
+
+        Returns:
+            RatingMatrix: The rating matrix.
+        """
+        rating_users = ratings_df['userId'].to_numpy()
+        rating_movies = ratings_df['movieId'].to_numpy()
+        ratings = ratings_df['rating'].to_numpy(dtype=np.float32)
+
+        user_ids, user_idx = np.unique(rating_users, return_inverse=True)
+
+        if movie_ids is not None:
+            movie_ids = np.union1d(np.asarray(movie_ids), rating_movies)
+        else:
+            movie_ids = np.unique(rating_movies)
+        movie_idx = np.searchsorted(movie_ids, rating_movies)
+
+        # Sort by (user, movie), the sort is stable so duplicated ratings keep their original order
+        order = np.lexsort((movie_idx, user_idx))
+        user_idx = user_idx[order]
+        movie_idx = movie_idx[order]
+        ratings = ratings[order]
+
+        # Keep only the last rating when a user rated the same movie more than once
+        keep = np.ones(len(order), dtype=bool)
+        keep[:-1] = (user_idx[1:] != user_idx[:-1]) | (movie_idx[1:] != movie_idx[:-1])
+        user_idx, movie_idx, ratings = user_idx[keep], movie_idx[keep], ratings[keep]
+
+        indptr = np.zeros(len(user_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(user_idx, minlength=len(user_ids)), out=indptr[1:])
+
+        return cls(user_ids, movie_ids, indptr, movie_idx.astype(np.int32), ratings)
+
+
+    def update(self, user_ids: np.ndarray, movie_ids: np.ndarray, ratings: np.ndarray) -> np.ndarray:
+        """
+        Adds or replaces ratings in place, without rebuilding the matrix from a dataframe: the new entries are
+        merged into the sorted CSR arrays and only the means of the users whose ratings changed are recomputed.
+        Unknown users and movies are added to the index (which shifts the following indices), the CSC view is dropped.
+
+        Args:
+            user_ids (np.ndarray): User of each rating.
+            movie_ids (np.ndarray): Movie of each rating, every (user, movie) pair must appear only once.
+            ratings (np.ndarray): The ratings.
+
+        Returns:
+            np.ndarray: The previous rating of each pair, NaN for the pairs that had no rating.
+        """
+        user_ids = np.asarray(user_ids, dtype=self.user_ids.dtype)
+        movie_ids = np.asarray(movie_ids, dtype=self.movie_ids.dtype)
+        ratings = np.asarray(ratings, dtype=self.data.dtype)
+
+        counts = self.row_counts()
+        indices = self.indices
+        user_means = self.user_means
+
+        # Extend the index with the unknown users and movies, remapping the stored ones
+        all_user_ids = np.union1d(self.user_ids, user_ids)
+        if len(all_user_ids) != len(self.user_ids):
+            old_users = np.searchsorted(all_user_ids, self.user_ids)
+            counts = np.zeros(len(all_user_ids), dtype=np.int64)
+            counts[old_users] = self.row_counts()
+            user_means = np.zeros(len(all_user_ids))
+            user_means[old_users] = self.user_means
+
+        all_movie_ids = np.union1d(self.movie_ids, movie_ids)
+        if len(all_movie_ids) != len(self.movie_ids):
+            indices = np.searchsorted(all_movie_ids, self.movie_ids).astype(self.indices.dtype)[indices]
+
+        # The CSR entries are sorted by (user, movie), i.e. by user index * movies + movie index
+        num_movies = len(all_movie_ids)
+        keys = np.repeat(np.arange(len(all_user_ids), dtype=np.int64), counts) * num_movies + indices
+
+        new_users = np.searchsorted(all_user_ids, user_ids)
+        new_movies = np.searchsorted(all_movie_ids, movie_ids)
+        new_keys = new_users.astype(np.int64) * num_movies + new_movies
+
+        order = np.argsort(new_keys, kind='stable')
+        new_keys, new_users, new_movies, new_ratings = new_keys[order], new_users[order], new_movies[order], ratings[order]
+
+        positions = np.searchsorted(keys, new_keys)
+        exists = positions < len(keys)
+        exists[exists] = keys[positions[exists]] == new_keys[exists]
+
+        previous = np.full(len(new_keys), np.nan)
+        previous[exists] = self.data[positions[exists]]
+
+        data = self.data.copy()
+        data[positions[exists]] = new_ratings[exists]
+
+        inserted = ~exists
+        self.indices = np.insert(indices, positions[inserted], new_movies[inserted]).astype(self.indices.dtype)
+        self.data = np.insert(data, positions[inserted], new_ratings[inserted])
+
+        counts = counts + np.bincount(new_users[inserted], minlength=len(all_user_ids))
+        self.indptr = np.zeros(len(all_user_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+
+        if self._user_to_index is not None:
+            if len(all_user_ids) != len(self.user_ids):
+                self._user_to_index = {int(user): index for index, user in enumerate(all_user_ids)}
+            if len(all_movie_ids) != len(self.movie_ids):
+                self._movie_to_index = {int(movie): index for index, movie in enumerate(all_movie_ids)}
+        self.user_ids, self.movie_ids = all_user_ids, all_movie_ids
+
+        # Recompute the means of the changed users only
+        changed = np.unique(new_users[inserted | (previous != new_ratings)])
+        user_means = user_means.copy() if user_means is self.user_means else user_means
+        owners, positions = RatingMatrix._gather(self.indptr, changed)
+        user_means[changed] = np.bincount(owners, weights=self.data[positions], minlength=len(changed)) / counts[changed]
+        self.user_means = user_means
+
+        self._csc = None
+        self._rated_movie_ids = None
+
+        # Back to the order of the arguments
+        result = np.empty(len(previous))
+        result[order] = previous
+        return result
+
+
+    def _compute_user_means(self) -> np.ndarray:
+        counts = np.diff(self.indptr)
+        sums = np.bincount(self.row_indices(), weights=self.data, minlength=len(self.user_ids))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, sums / counts, 0.0)
+
+
+    def movie_means(self) -> np.ndarray:
+        """
+        Computes the average rating of every movie, indexed by movie index (NaN for movies without ratings).
+        """
+        counts = np.bincount(self.indices, minlength=len(self.movie_ids))
+        sums = np.bincount(self.indices, weights=self.data, minlength=len(self.movie_ids))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.user_ids), len(self.movie_ids)
+
+
+    @property
+    def nnz(self) -> int:
+        return len(self.data)
+
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory used by the matrix arrays (the id -> index dictionaries are not included).
+        """
+        arrays = [self.user_ids, self.movie_ids, self.indptr, self.indices, self.data, self.user_means]
+        if self._csc is not None:
+            arrays.extend(self._csc)
+        if self._rated_movie_ids is not None:
+            arrays.append(self._rated_movie_ids)
+        return sum(array.nbytes for array in arrays)
+
+
+    def row_counts(self) -> np.ndarray:
+        """
+        Retrieves the number of ratings of every user, indexed by user index.
+        """
+        return np.diff(self.indptr)
+
+
+    def row_indices(self) -> np.ndarray:
+        """
+        Retrieves the user index of every stored rating (the COO row array of the matrix).
+        """
+        return np.repeat(np.arange(len(self.user_ids), dtype=np.int32), np.diff(self.indptr))
+
+
+    @property
+    def csc(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Column oriented view of the matrix, built on first access.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: (indptr, user indices, ratings), where the ratings of the
+                movie at index m are at positions indptr[m]:indptr[m + 1], sorted by user index.
+        """
+        if self._csc is None:
+            order = np.argsort(self.indices, kind='stable')
+            counts = np.bincount(self.indices, minlength=len(self.movie_ids))
+
+            indptr = np.zeros(len(self.movie_ids) + 1, dtype=np.int64)
+            np.cumsum(counts, out=indptr[1:])
+
+            self._csc = (indptr, self.row_indices()[order], self.data[order])
+
+        return self._csc
+
+
+    @property
+    def rated_movie_ids(self) -> np.ndarray:
+        """
+        Movie ID of every stored rating (the CSR indices mapped to IDs), built on first access.
+        """
+        if self._rated_movie_ids is None:
+            self._rated_movie_ids = self.movie_ids[self.indices]
+            self._rated_movie_ids.flags.writeable = False
+
+        return self._rated_movie_ids
+
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the ratings stored in the matrix, equal for two matrices with the same ratings however (and in
+        whichever process) they were built. Movies without ratings don't change it.
+
+        Returns:
+            str: Hexadecimal digest.
+        """
+        # Fixed dtypes, so that the hash doesn't depend on how the arrays were built
+        digest = hashlib.blake2b(digest_size=16)
+        for array in (self.user_ids, self.indptr, self.rated_movie_ids):
+            digest.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+        digest.update(np.ascontiguousarray(self.data, dtype=np.float64).tobytes())
+
+        return digest.hexdigest()
+
+
+    @staticmethod
+    def _search(ids: np.ndarray, id: int) -> int:
+        # Binary search of an ID in a sorted array, -1 if it is not there
+        index = int(np.searchsorted(ids, id))
+        return index if index < len(ids) and ids[index] == id else -1
+
+
+    def _lookup_user(self, user_id: int) -> int:
+        if self._user_to_index is not None:
+            return self._user_to_index.get(user_id, -1)
+        return RatingMatrix._search(self.user_ids, user_id)
+
+
+    def _lookup_movie(self, movie_id: int) -> int:
+        if self._movie_to_index is not None:
+            return self._movie_to_index.get(movie_id, -1)
+        return RatingMatrix._search(self.movie_ids, movie_id)
+
+
+    def has_user(self, user_id: int) -> bool:
+        return self._lookup_user(user_id) >= 0
+
+
+    def has_movie(self, movie_id: int) -> bool:
+        return self._lookup_movie(movie_id) >= 0
+
+
+    def user_index(self, user_id: int) -> int:
+        """
+        Retrieves the dense index of a user, raises KeyError if the user is unknown.
+        """
+        index = self._lookup_user(user_id)
+        if index < 0:
+            raise KeyError(user_id)
+        return index
+
+
+    def movie_index(self, movie_id: int) -> int:
+        """
+        Retrieves the dense index of a movie, raises KeyError if the movie is unknown.
+        """
+        index = self._lookup_movie(movie_id)
+        if index < 0:
+            raise KeyError(movie_id)
+        return index
+
+
+    def user_indices(self, user_ids) -> np.ndarray:
+        """
+        Maps user IDs to dense indices, unknown users are mapped to -1.
+        """
+        return RatingMatrix._search_all(self.user_ids, user_ids)
+
+
+    def movie_indices(self, movie_ids) -> np.ndarray:
+        """
+        Maps movie IDs to dense indices, unknown movies are mapped to -1.
+        """
+        return RatingMatrix._search_all(self.movie_ids, movie_ids)
+
+
+    @staticmethod
+    def _search_all(ids: np.ndarray, searched) -> np.ndarray:
+        searched = np.asarray(searched)
+        if len(searched) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        # ids is sorted, so the index is found with a binary search
+        indices = np.searchsorted(ids, searched)
+        found = indices < len(ids)
+        found[found] = ids[indices[found]] == searched[found]
+
+        return np.where(found, indices, -1)
+
+
+    def get_row(self, user_index: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Retrieves the ratings of the user at the given index.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Sorted movie indices and the corresponding ratings.
+        """
+        start, end = self.indptr[user_index], self.indptr[user_index + 1]
+        return self.indices[start:end], self.data[start:end]
+
+
+    @staticmethod
+    def _gather(indptr: np.ndarray, selected: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Positions of the entries of the selected rows (or columns), and the position in `selected` they belong to
+        starts = indptr[selected]
+        lengths = indptr[selected + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+
+        owners = np.repeat(np.arange(len(selected)), lengths)
+        positions = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+        return owners, positions
+
+
+    def gather_rows(self, user_indices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Retrieves all the ratings of several users at once.
+
+        Args:
+            user_indices (np.ndarray): Indices of the users.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: For every rating, the position of its user in `user_indices`,
+                the movie index and the rating.
+        """
+        owners, positions = RatingMatrix._gather(self.indptr, np.asarray(user_indices, dtype=np.int64))
+        return owners, self.indices[positions], self.data[positions]
+
+
+    def gather_columns(self, movie_indices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Retrieves all the ratings of several movies at once.
+
+        Args:
+            movie_indices (np.ndarray): Indices of the movies.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: For every rating, the position of its movie in `movie_indices`,
+                the user index and the rating.
+        """
+        col_indptr, col_users, col_data = self.csc
+        owners, positions = RatingMatrix._gather(col_indptr, np.asarray(movie_indices, dtype=np.int64))
+        return owners, col_users[positions], col_data[positions]
+
+
+    def _find(self, user_id: int, movie_id: int) -> int:
+        # Position of the rating in the data array, or -1 if the user didn't rate the movie
+        movie_index = self._lookup_movie(movie_id)
+        if movie_index < 0:
+            return -1
+
+        user_index = self.user_index(user_id)
+        start, end = self.indptr[user_index], self.indptr[user_index + 1]
+        position = start + np.searchsorted(self.indices[start:end], movie_index)
+
+        if position < end and self.indices[position] == movie_index:
+            return position
+        return -1
+
+
+    def has_rating(self, user_id: int, movie_id: int) -> bool:
+        return self._find(user_id, movie_id) >= 0
+
+
+    def get_rating(self, user_id: int, movie_id: int) -> float:
+        """
+        Retrieves the rating given by a user for a movie, raises KeyError if there is no such rating.
+        """
+        position = self._find(user_id, movie_id)
+        if position < 0:
+            raise KeyError((user_id, movie_id))
+        return float(self.data[position])
+
+
+    def get_user_mean(self, user_id: int) -> float:
+        return float(self.user_means[self.user_index(user_id)])
+
+
+    def get_rated_movie_ids(self, user_id: int) -> np.ndarray:
+        """
+        Retrieves the sorted IDs of the movies rated by a user.
+        """
+        user_index = self.user_index(user_id)
+        return self.rated_movie_ids[self.indptr[user_index]:self.indptr[user_index + 1]]
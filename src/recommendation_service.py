@@ -0,0 +1,408 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Iterable
+import numpy as np
+from group_recommendation import GroupRecommendation
+from instrumentation import metrics
+
+
+class _Request:
+    """
+    A computation shared by the concurrent callers of the same request.
+    """
+
+    def __init__(self, key: tuple, future: asyncio.Future) -> None:
+        self.key = key
+        self.future = future
+        self.waiters = 1
+
+
+class RecommendationService:
+    """
+    asyncio front end of a GroupRecommendation (and of its UserRecommendation), e.g. behind a web server.
+
+    The computations run in a pool of worker threads (the vectorized similarity and prediction passes spend most of
+    their time in NumPy, which releases the GIL), so the event loop is never blocked. Concurrent identical requests
+    (same user or group and same parameters) are coalesced into one computation, and the single user requests
+    received within `batch_window` seconds are served together, their neighbors found in one similarity pass
+    (see UserRecommendation.top_n_similar_users_batch).
+
+    Each request can have a timeout, and a request whose callers all timed out or were cancelled is dropped if it
+    didn't start yet. The results are the ones of the synchronous API:
+
+        async with RecommendationService(group_recommendation) as service:
+            recommendations = await service.recommend_user(user, n=10)
+            group_rec, satisfactions, disagreements = await service.recommend_group({1, 2, 3})
+    """
+
+    def __init__(self, group_recommendation: GroupRecommendation, max_workers: int = 4, batch_window: float = 0.005,
+                 max_batch_size: int = 64, timeout: float = None, executor: Executor = None) -> None:
+        """
+        Args:
+            group_recommendation (GroupRecommendation): Recommender serving the requests.
+            max_workers (int, optional): Number of worker threads, unless an executor is given. Defaults to 4.
+            batch_window (float, optional): Seconds single user requests wait for others to be batched with.
+                Defaults to 0.005.
+            max_batch_size (int, optional): Maximum number of users of a batch. Defaults to 64.
+            timeout (float, optional): Default timeout of the requests in seconds, None for no timeout.
+            executor (Executor, optional): Executor running the computations, not shut down by close.
+                Defaults to a ThreadPoolExecutor of `max_workers` threads.
+        """
+        self.group_recommendation = group_recommendation
+        self.user_recommendation = group_recommendation.user_recommendation
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+
+        self._owns_executor = executor is None
+        self._executor = executor if executor is not None else ThreadPoolExecutor(max_workers, thread_name_prefix='recommendation')
+
+        # request key -> request being computed
+        self._in_flight: dict[tuple, _Request] = {}
+
+        self._queue: asyncio.Queue = None
+        self._batcher: asyncio.Task = None
+        self._batches: set[asyncio.Task] = set()
+        self.closed = False
+
+
+    async def start(self) -> None:
+        """
+        Starts the batching of the user requests, called by the first request if needed.
+        """
+        if self.closed:
+            raise RuntimeError('The service is closed')
+
+        if self._batcher is None:
+            self._queue = asyncio.Queue()
+            self._batcher = asyncio.create_task(self._batch_user_requests())
+
+
+    async def close(self) -> None:
+        """
+        Cancels the pending requests, waits for the running computations and shuts down the worker threads.
+        """
+        if self.closed:
+            return
+        self.closed = True
+
+        if self._batcher is not None:
+            self._batcher.cancel()
+            await asyncio.gather(self._batcher, return_exceptions=True)
+            while not self._queue.empty():
+                self._queue.get_nowait().future.cancel()
+
+        await asyncio.gather(*self._batches, return_exceptions=True)
+        for request in list(self._in_flight.values()):
+            request.future.cancel()
+
+        if self._owns_executor:
+            await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+
+
+    async def __aenter__(self) -> 'RecommendationService':
+        await self.start()
+        return self
+
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+    async def recommend_user(self, user: int, n: int = 10, neighbor_size: int = 50, similarity_function: Callable = None,
+                             timeout: float = None) -> list[tuple[int, float]]:
+        """
+        Top N recommendations of a user, as UserRecommendation.top_n_recommendations.
+
+        Args:
+            user (int): ID of the user.
+            n (int, optional): Number of recommendations. Defaults to 10.
+            neighbor_size (int, optional): Number of neighbors. Defaults to 50.
+            similarity_function (function, optional): sim_* method of the UserRecommendation. Defaults to sim_pcc.
+            timeout (float, optional): Timeout in seconds. Defaults to the timeout of the service.
+
+        Raises:
+            asyncio.TimeoutError: If the recommendations are not ready within the timeout.
+        """
+        if similarity_function is None:
+            similarity_function = self.user_recommendation.sim_pcc
+
+        await self.start()
+
+        key = ('user', user, n, neighbor_size, similarity_function)
+        return await self._submit(key, self._queue.put_nowait, timeout)
+
+
+    async def recommend_group(self, group: Iterable[int], aggreg_method: Callable = None,
+                              timeout: float = None) -> tuple[list[tuple[int, float]], list[tuple[int, float]], list[tuple[int, float]]]:
+        """
+        Recommendations, satisfactions and disagreements of a group,
+        as GroupRecommendation.get_recommendations_satisfactions_and_disagreements_for_group.
+
+        Args:
+            group (Iterable[int]): IDs of the members.
+            aggreg_method (function, optional): Aggregation method of the GroupRecommendation.
+                Defaults to weighted_average_aggregation_from_users_recommendations.
+            timeout (float, optional): Timeout in seconds. Defaults to the timeout of the service.
+
+        Raises:
+            asyncio.TimeoutError: If the recommendations are not ready within the timeout.
+        """
+        if aggreg_method is None:
+            aggreg_method = self.group_recommendation.weighted_average_aggregation_from_users_recommendations
+
+        await self.start()
+
+        group = frozenset(group)
+        key = ('group', group, aggreg_method)
+
+        def run(request: _Request) -> None:
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor, self.group_recommendation.get_recommendations_satisfactions_and_disagreements_for_group,
+                set(group), aggreg_method)
+            RecommendationService._chain(future, request.future)
+
+        return await self._submit(key, run, timeout)
+
+
+    @staticmethod
+    def _chain(source: asyncio.Future, target: asyncio.Future) -> None:
+        # Cancelling the target cancels the computation if it didn't start yet
+        def copy_result(source: asyncio.Future) -> None:
+            if target.done():
+                return
+            if source.cancelled():
+                target.cancel()
+            elif source.exception() is not None:
+                target.set_exception(source.exception())
+            else:
+                target.set_result(source.result())
+
+        source.add_done_callback(copy_result)
+        target.add_done_callback(lambda target: source.cancel() if target.cancelled() else None)
+
+
+    async def _submit(self, key: tuple, run: Callable[[_Request], None], timeout: float) -> object:
+        if self.closed:
+            raise RuntimeError('The service is closed')
+
+        request = self._in_flight.get(key)
+        if request is not None:
+            request.waiters += 1
+            metrics.count('service.coalesced')
+        else:
+            request = _Request(key, asyncio.get_running_loop().create_future())
+            self._in_flight[key] = request
+            request.future.add_done_callback(lambda _: self._in_flight.pop(key, None) if self._in_flight.get(key) is request else None)
+            run(request)
+
+        try:
+            # The shield keeps the computation alive for the other callers
+            return await asyncio.wait_for(asyncio.shield(request.future), timeout if timeout is not None else self.timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            request.waiters -= 1
+            if request.waiters == 0:
+                request.future.cancel()
+            raise
+
+
+    async def _batch_user_requests(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+
+            # Wait for more requests, unless the batch is already full
+            if self.batch_window > 0 and self._queue.qsize() < self.max_batch_size - 1:
+                await asyncio.sleep(self.batch_window)
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            # Requests cancelled while waiting are not computed
+            batch = [request for request in batch if not request.future.done()]
+            if len(batch) == 0:
+                continue
+
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+
+    async def _run_batch(self, batch: list[_Request]) -> None:
+        metrics.count('service.batches')
+        metrics.count('service.batched_users', len(batch))
+
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self._executor, self._recommend_users, [request.key for request in batch])
+        except asyncio.CancelledError:
+            for request in batch:
+                request.future.cancel()
+            raise
+        except Exception as error:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(error)
+            return
+
+        for request in batch:
+            if request.future.done():
+                continue
+
+            result = results[request.key]
+            if isinstance(result, Exception):
+                request.future.set_exception(result)
+            else:
+                request.future.set_result(result)
+
+
+    def _recommend_users(self, keys: list[tuple]) -> dict[tuple, object]:
+        """
+        Computes the recommendations of a batch of user requests, in a worker thread.
+
+        Returns:
+            dict[tuple, object]: request key -> recommendations, or the exception raised computing them.
+        """
+        user_recommendation = self.user_recommendation
+        results = {}
+
+        # One similarity pass for the users sharing the similarity function and the number of neighbors
+        passes: dict[tuple, list[tuple]] = {}
+        for key in keys:
+            _, _, _, neighbor_size, similarity_function = key
+            passes.setdefault((similarity_function, neighbor_size), []).append(key)
+
+        for (similarity_function, neighbor_size), pass_keys in passes.items():
+            users = [user for _, user, _, _, _ in pass_keys]
+            try:
+                neighbors = user_recommendation.top_n_similar_users_batch(users, similarity_function, neighbor_size)
+            except Exception:
+                # e.g. an unknown user: the failure is reported only to its own requests
+                neighbors = {}
+                for user in users:
+                    try:
+                        neighbors[user] = user_recommendation.top_n_similar_users(user, similarity_function, neighbor_size)
+                    except Exception as error:
+                        neighbors[user] = error
+
+            for key in pass_keys:
+                _, user, n, _, _ = key
+                if isinstance(neighbors[user], Exception):
+                    results[key] = neighbors[user]
+                    continue
+
+                try:
+                    results[key] = user_recommendation.recommendations_from_neighbors(user, neighbors[user], n)
+                except Exception as error:
+                    results[key] = error
+
+        return results
+
+
+class InProcessClient:
+    """
+    Blocking client of a RecommendationService running in an event loop of a background thread,
+    to use the service from synchronous code (e.g. a notebook) and to load test it locally.
+
+        with InProcessClient(RecommendationService(group_recommendation)) as client:
+            client.recommend_user(1)
+            client.load_test(users=range(1, 101), concurrency=32)
+    """
+
+    def __init__(self, service: RecommendationService) -> None:
+        self.service = service
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='recommendation-service', daemon=True)
+        self._thread.start()
+
+        self._run(service.start())
+
+
+    def _run(self, coroutine) -> object:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+
+    def recommend_user(self, user: int, **kwargs) -> list[tuple[int, float]]:
+        """
+        See RecommendationService.recommend_user.
+        """
+        return self._run(self.service.recommend_user(user, **kwargs))
+
+
+    def recommend_group(self, group: Iterable[int], **kwargs) -> tuple:
+        """
+        See RecommendationService.recommend_group.
+        """
+        return self._run(self.service.recommend_group(group, **kwargs))
+
+
+    def load_test(self, users: Iterable[int] = (), groups: Iterable[Iterable[int]] = (), concurrency: int = 32,
+                  timeout: float = None) -> dict:
+        """
+        Sends the requests of the users and of the groups, at most `concurrency` at a time, and measures their latency.
+
+        Returns:
+            dict: Number of requests, errors and timeouts, seconds, throughput (requests per second)
+                and p50, p95 and p99 latencies in seconds.
+        """
+        requests = [(self.service.recommend_user, user) for user in users] \
+            + [(self.service.recommend_group, group) for group in groups]
+
+        return self._run(self._load_test(requests, concurrency, timeout))
+
+
+    async def _load_test(self, requests: list[tuple[Callable, object]], concurrency: int, timeout: float) -> dict:
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        errors = 0
+        timeouts = 0
+
+        async def send(method: Callable, argument: object) -> None:
+            nonlocal errors, timeouts
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await method(argument, timeout=timeout)
+                except asyncio.TimeoutError:
+                    timeouts += 1
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send(method, argument) for method, argument in requests))
+        seconds = time.perf_counter() - start
+
+        latencies = np.array(latencies) if len(latencies) > 0 else np.zeros(1)
+        return {
+            'requests': len(requests),
+            'errors': errors,
+            'timeouts': timeouts,
+            'seconds': seconds,
+            'throughput': len(requests) / seconds if seconds > 0 else 0.0,
+            'latency_p50': float(np.percentile(latencies, 50)),
+            'latency_p95': float(np.percentile(latencies, 95)),
+            'latency_p99': float(np.percentile(latencies, 99)),
+        }
+
+
+    def close(self) -> None:
+        """
+        Closes the service and stops the event loop.
+        """
+        if self._loop.is_closed():
+            return
+
+        self._run(self.service.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+    def __enter__(self) -> 'InProcessClient':
+        return self
+
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
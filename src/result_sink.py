@@ -0,0 +1,336 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import Iterable, Iterator
+import numpy as np
+
+
+class ResultSink(ABC):
+    """
+    Writes ranked recommendation results incrementally, holding at most `buffer_size` records in memory.
+
+    A record is a key, the user ID or the group of user IDs the results are for, and one or more named
+    lists of (ID, value) tuples in rank order, e.g.:
+
+        sink.write(user, recommendations=user_rec.top_n_recommendations(user))
+        sink.write(group, recommendations=group_rec, satisfactions=satisfactions, disagreements=disagreements)
+
+    Use JsonlResultSink or NpzResultSink (or `open_sink`), as context managers or closing them explicitly,
+    and ResultReader to read the results back.
+    """
+
+    def __init__(self, buffer_size: int = 1000) -> None:
+        """
+        Args:
+            buffer_size (int, optional): Number of records buffered before they are written. Defaults to 1000.
+        """
+        if buffer_size < 1:
+            raise ValueError('The buffer size must be positive')
+
+        self.buffer_size = buffer_size
+        self.records_written = 0
+        self.closed = False
+
+        # (key, fields) of the records not written yet
+        self._buffer: list[tuple[tuple[int, ...], dict[str, list[tuple[int, float]]]]] = []
+
+
+    def write(self, key: int | Iterable[int], **fields: list[tuple[int, float]]) -> None:
+        """
+        Adds a record, writing the buffered records when the buffer is full.
+
+        Args:
+            key (int | Iterable[int]): User ID or group of user IDs (groups are stored sorted).
+            **fields (list[tuple[int, float]]): Named lists of (ID, value) tuples, e.g. recommendations=[(movieId, rating)].
+
+        Raises:
+            ValueError: If the sink is closed or the record has no fields.
+        """
+        if self.closed:
+            raise ValueError('The sink is closed')
+        if len(fields) == 0:
+            raise ValueError('A record needs at least one field')
+
+        key = (int(key),) if np.isscalar(key) else tuple(sorted(int(user) for user in key))
+        self._buffer.append((key, fields))
+
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+
+    def write_sequential(self, group: Iterable[int], sequential_recommendations: dict[int, list[tuple[int, float]]],
+                         satisfactions: dict[int, list[tuple[int, float]]]) -> None:
+        """
+        Adds the results of SequentialRecommendation.get_sequential_recommendations_for_group,
+        one record per iteration (consecutive, in iteration order) with the recommendations and the satisfactions.
+        """
+        for iteration in sorted(sequential_recommendations):
+            self.write(group, recommendations=sequential_recommendations[iteration], satisfactions=satisfactions[iteration])
+
+
+    def flush(self) -> None:
+        """
+        Writes the buffered records.
+        """
+        if len(self._buffer) == 0:
+            return
+
+        self._write_records(self._buffer)
+        self.records_written += len(self._buffer)
+        self._buffer = []
+
+
+    @abstractmethod
+    def _write_records(self, records: list[tuple[tuple[int, ...], dict]]) -> None:
+        pass
+
+
+    def close(self) -> None:
+        """
+        Writes the buffered records and closes the sink.
+        """
+        if self.closed:
+            return
+
+        self.flush()
+        self._close()
+        self.closed = True
+
+
+    def _close(self) -> None:
+        pass
+
+
+    def __enter__(self) -> 'ResultSink':
+        return self
+
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class JsonlResultSink(ResultSink):
+    """
+    Writes the records to a JSON Lines file, one object per record: {"key": [...], "<field>": [[id, value], ...]}.
+    """
+
+    def __init__(self, path: str, buffer_size: int = 1000) -> None:
+        """
+        Args:
+            path (str): Path of the file, overwritten if it exists.
+            buffer_size (int, optional): Number of records buffered before they are written. Defaults to 1000.
+        """
+        super().__init__(buffer_size)
+        self.path = path
+        self._file = open(path, 'w')
+
+
+    def _write_records(self, records: list[tuple[tuple[int, ...], dict]]) -> None:
+        lines = []
+        for key, fields in records:
+            record = {'key': list(key)}
+            for name, items in fields.items():
+                record[name] = [[int(item_id), float(value)] for item_id, value in items]
+            lines.append(json.dumps(record))
+
+        self._file.write('\n'.join(lines) + '\n')
+        self._file.flush()
+
+
+    def _close(self) -> None:
+        self._file.close()
+
+
+class NpzResultSink(ResultSink):
+    """
+    Writes the records to a folder of columnar .npz chunks, one per `buffer_size` records, plus a manifest.
+
+    Each chunk stores the keys as `key_indptr` and `keys` arrays and each field as `<field>_indptr`,
+    `<field>_ids` and `<field>_values` arrays, so the lists of record i are the slices [indptr[i]:indptr[i + 1]].
+    If some records of a chunk don't have a field, its `<field>_present` boolean array flags the ones that do.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, path: str, buffer_size: int = 10_000, compressed: bool = False) -> None:
+        """
+        Args:
+            path (str): Path of the folder, created if it doesn't exist. A previous run in the folder is overwritten.
+            buffer_size (int, optional): Number of records of each chunk. Defaults to 10000.
+            compressed (bool, optional): Compress the chunks. Defaults to False.
+        """
+        super().__init__(buffer_size)
+        self.path = path
+        self.compressed = compressed
+
+        self.chunks: list[dict] = []
+        self.fields: list[str] = []
+
+        # Drop the manifest and the chunks of a previous run, that the new chunks would only partly overwrite
+        os.makedirs(path, exist_ok=True)
+        for file_name in os.listdir(path):
+            if file_name == NpzResultSink.MANIFEST or (file_name.startswith('part-') and file_name.endswith('.npz')):
+                os.remove(os.path.join(path, file_name))
+
+
+    @staticmethod
+    def _column(lists: list[list]) -> tuple[np.ndarray, list]:
+        indptr = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum([len(items) for items in lists], out=indptr[1:])
+        return indptr, [item for items in lists for item in items]
+
+
+    def _write_records(self, records: list[tuple[tuple[int, ...], dict]]) -> None:
+        names = list(dict.fromkeys(name for _, fields in records for name in fields))
+        for name in names:
+            if name not in self.fields:
+                self.fields.append(name)
+
+        key_indptr, keys = NpzResultSink._column([key for key, _ in records])
+        arrays = {'key_indptr': key_indptr, 'keys': np.array(keys, dtype=np.int64)}
+
+        for name in names:
+            indptr, items = NpzResultSink._column([fields.get(name, ()) for _, fields in records])
+            arrays[f'{name}_indptr'] = indptr
+            arrays[f'{name}_ids'] = np.array([item_id for item_id, _ in items], dtype=np.int64)
+            arrays[f'{name}_values'] = np.array([value for _, value in items], dtype=float)
+
+            # Records without the field are flagged only in chunks mixing different kinds of records
+            present = np.array([name in fields for _, fields in records], dtype=bool)
+            if not present.all():
+                arrays[f'{name}_present'] = present
+
+        file_name = f'part-{len(self.chunks):05d}.npz'
+        save = np.savez_compressed if self.compressed else np.savez
+        with open(os.path.join(self.path, file_name), 'wb') as file:
+            save(file, **arrays)
+
+        self.chunks.append({'file': file_name, 'records': len(records), 'fields': names})
+
+
+    def _close(self) -> None:
+        with open(os.path.join(self.path, NpzResultSink.MANIFEST), 'w') as file:
+            json.dump({'records': self.records_written, 'fields': self.fields, 'chunks': self.chunks}, file)
+
+
+def open_sink(path: str, buffer_size: int = None) -> ResultSink:
+    """
+    Opens a sink by the extension of the path: a .jsonl file, otherwise a folder of .npz chunks.
+    """
+    kwargs = {} if buffer_size is None else {'buffer_size': buffer_size}
+
+    if path.endswith('.jsonl'):
+        return JsonlResultSink(path, **kwargs)
+
+    return NpzResultSink(path, **kwargs)
+
+
+def export_top_n_recommendations(user_recommendation, sink: ResultSink, users: Iterable[int] = None,
+                                 n: int = 10, neighbor_size: int = 50) -> int:
+    """
+    Writes the top N recommendations of many users (by default the whole user base) to a sink, one record per user.
+
+    Returns:
+        int: Number of users written.
+    """
+    if users is None:
+        users = user_recommendation.dataset.get_user_ids()
+
+    written = 0
+    for user in users:
+        sink.write(user, recommendations=user_recommendation.top_n_recommendations(user, n=n, neighbor_size=neighbor_size))
+        written += 1
+
+    return written
+
+
+class ResultReader:
+    """
+    Reads back lazily the results written by a JsonlResultSink (a file) or an NpzResultSink (a folder):
+    only one line or one chunk at a time is held in memory.
+
+        for key, fields in ResultReader(path):
+            fields['recommendations']  # list[tuple[int, float]]
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Raises:
+            ValueError: If the folder has no manifest, e.g. its NpzResultSink was not closed.
+        """
+        self.path = path
+        self.format = 'npz' if os.path.isdir(path) else 'jsonl'
+        self.manifest = None
+
+        if self.format == 'npz':
+            manifest = os.path.join(path, NpzResultSink.MANIFEST)
+            if not os.path.exists(manifest):
+                raise ValueError(f'{path} has no manifest, the sink was not closed')
+
+            with open(manifest) as file:
+                self.manifest = json.load(file)
+
+
+    def __len__(self) -> int:
+        if self.manifest is not None:
+            return self.manifest['records']
+
+        with open(self.path) as file:
+            return sum(1 for line in file if line.strip())
+
+
+    def __iter__(self) -> Iterator[tuple[tuple[int, ...], dict[str, list[tuple[int, float]]]]]:
+        """
+        Yields:
+            tuple[tuple[int, ...], dict]: The key of each record and its fields, in the order they were written.
+        """
+        if self.format == 'jsonl':
+            yield from self._iter_jsonl()
+            return
+
+        for arrays in self.chunks():
+            yield from ResultReader._chunk_records(arrays)
+
+
+    def _iter_jsonl(self) -> Iterator[tuple[tuple[int, ...], dict]]:
+        with open(self.path) as file:
+            for line in file:
+                if not line.strip():
+                    continue
+
+                record = json.loads(line)
+                key = tuple(record.pop('key'))
+                yield key, {name: [(item_id, value) for item_id, value in items] for name, items in record.items()}
+
+
+    def chunks(self) -> Iterator[dict[str, np.ndarray]]:
+        """
+        Yields the columnar arrays of each chunk of an NpzResultSink folder, see NpzResultSink.
+        """
+        if self.format != 'npz':
+            raise ValueError('Only NpzResultSink folders have chunks')
+
+        for chunk in self.manifest['chunks']:
+            with np.load(os.path.join(self.path, chunk['file'])) as arrays:
+                yield {name: arrays[name] for name in arrays.files}
+
+
+    @staticmethod
+    def _chunk_records(arrays: dict[str, np.ndarray]) -> Iterator[tuple[tuple[int, ...], dict]]:
+        names = [name[:-len('_indptr')] for name in arrays if name.endswith('_indptr') and name != 'key_indptr']
+
+        key_indptr, keys = arrays['key_indptr'], arrays['keys'].tolist()
+        columns = {name: (arrays[f'{name}_indptr'], arrays[f'{name}_ids'].tolist(), arrays[f'{name}_values'].tolist(),
+                          arrays.get(f'{name}_present'))
+                   for name in names}
+
+        for record in range(len(key_indptr) - 1):
+            fields = {}
+            for name, (indptr, ids, values, present) in columns.items():
+                if present is not None and not present[record]:
+                    continue
+
+                start, end = indptr[record], indptr[record + 1]
+                fields[name] = list(zip(ids[start:end], values[start:end]))
+
+            yield tuple(keys[key_indptr[record]:key_indptr[record + 1]]), fields
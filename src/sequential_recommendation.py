@@ -1,12 +1,16 @@
 from collections import defaultdict
 from group_recommendation import GroupRecommendation
-import operator
+import numpy as np
+from ranking import top_n_indices
+from instrumentation import traced
+import group_aggregation
 
 class SequentialRecommendation:
     def __init__(self, group_recommendation: GroupRecommendation):
         self.group_recommendation = group_recommendation
 
 
+    @traced('sequential.request')
     def get_sequential_recommendations_for_group(self, user_group: set[int], iterations: int = 5) -> dict[int, list[tuple[int, float]]]:
         """
         Get sequential recommendations of certain length for a group of users.
@@ -18,8 +22,11 @@ class SequentialRecommendation:
         Returns:
             list[tuple[int, float]]: list of tuples containing sequential ID and the recommendetions for the group.
         """
+        if self.group_recommendation.user_recommendation.vectorized:
+            return self._incremental_sequential_recommendations(user_group, iterations)
+
         # We don't want to recommend movies from previous iterations
-        already_recommended = []
+        already_recommended: set[int] = set()
 
         # sequential_recommendations: iteration -> list[(movieId, rating)]
         sequential_recommendations: dict[int, list[tuple[int, float]]] = defaultdict(list[tuple[int, float]])
@@ -39,40 +46,105 @@ class SequentialRecommendation:
 
             satisfactions[i] = self.calculate_satisfactions(user_group, users_rec, group_rec, aggreg_rec)
 
-            already_recommended.extend(movie for movie, _ in group_rec)
+            already_recommended.update(movie for movie, _ in group_rec)
             sequential_recommendations[i] = group_rec
         
         return sequential_recommendations, satisfactions
+
+
+    def _incremental_sequential_recommendations(self, user_group: set[int], iterations: int, n: int = 10,
+                                                neighbor_size: int = 50) -> dict[int, list[tuple[int, float]]]:
+        # Same as the loop of get_sequential_recommendations_for_group, but the neighbors and the ratings of the members
+        # for the whole catalog are computed once: each iteration only masks out the movies recommended so far
+        users = list(user_group)
+        movie_ids = self.group_recommendation.user_recommendation.dataset.get_movie_ids()
+
+        # (members x catalog) ratings, actual where a member rated the movie and predicted otherwise
+        ratings, rated = self.group_recommendation.users_ratings(users, movie_ids, neighbor_size)
+
+        # Movies not recommended to the group yet
+        available = np.ones(len(movie_ids), dtype=bool)
+
+        sequential_recommendations: dict[int, list[tuple[int, float]]] = defaultdict(list[tuple[int, float]])
+        satisfactions: dict[int, list[tuple[int, float]]] = defaultdict(list[tuple[int, float]])
+
+        for i in range(iterations):
+            # Top N of each member among the movies they didn't rate, as users_top_recommendations
+            users_top = []
+            for row in range(len(users)):
+                candidates = np.flatnonzero(available & ~rated[row])
+                users_top.append(candidates[top_n_indices(ratings[row, candidates], n)])
+
+            group_rec, satisfactions[i] = self.aggregate_round(users, movie_ids, ratings, users_top,
+                                                               satisfactions[i-1] if i > 0 else None, n)
+
+            available[np.searchsorted(movie_ids, [movie for movie, _ in group_rec])] = False
+            sequential_recommendations[i] = group_rec
+
+        return sequential_recommendations, satisfactions
+
+
+    @traced('sequential.round')
+    def aggregate_round(self, users: list[int], movie_ids: np.ndarray, ratings: np.ndarray, users_top: list[np.ndarray],
+                        satisfactions: list[tuple[int, float]] = None, n: int = 10) -> tuple[list[tuple[int, float]], list[tuple[int, float]]]:
+        """
+        Aggregates one round of sequential recommendations from the (members x movies) ratings of the group.
+
+        The candidates are the movies in the top N of any member, the first round ranks them with the weighted
+        average aggregation and the following ones with the satisfaction based aggregation.
+
+        Args:
+            users (list[int]): IDs of the members, in the order of the rows of `ratings`.
+            movie_ids (np.ndarray): Sorted IDs of the movies of the columns of `ratings`.
+            ratings (np.ndarray): (members x movies) ratings, actual where a member rated the movie and predicted otherwise.
+            users_top (list[np.ndarray]): Columns of the top N recommendations of each member, in rank order.
+            satisfactions (list[tuple[int, float]], optional): Satisfaction of each member with the previous round,
+                None for the first round.
+            n (int, optional): Number of recommendations. Defaults to 10.
+
+        Returns:
+            tuple[list[tuple[int, float]], list[tuple[int, float]]]: The group recommendations and the satisfaction of each member.
+        """
+        # Candidate movies in the same order of aggregate_users_recommendations
+        movies: set[int] = set()
+        for top in users_top:
+            for movie in movie_ids[top].tolist():
+                movies.add(movie)
+        movies = list(movies)
+
+        candidate_ratings = ratings[:, np.searchsorted(movie_ids, movies)]
+
+        if satisfactions is None:
+            scores = group_aggregation.weighted_average(candidate_ratings)
+        else:
+            scores = group_aggregation.satisfaction_weighted(candidate_ratings, [sat for _, sat in satisfactions])
+
+        group_rec = group_aggregation.rank(movies, scores, n)
+
+        selected = top_n_indices(scores, n)
+        users_top_ratings = np.array([ratings[row, top].sum() for row, top in enumerate(users_top)])
+        user_sats = group_aggregation.satisfactions(candidate_ratings, selected, users_top_ratings)
+
+        return group_rec, list(zip(users, user_sats.tolist()))
     
 
+    @traced('sequential.satisfactions')
     def calculate_satisfactions(self, group: set[int], users_rec: dict[int, list[tuple[int, float]]], group_rec: list[tuple[int, float]], 
                                 aggreg_rec: dict[int, list[float]]):
-        satisfactions: list[tuple[int, float]] = []
-        
-        group_movies = set(map(operator.itemgetter(0), group_rec))
-        
-        for index, user in enumerate(group):
-            group_val = sum(aggreg_rec[movie][index] for movie in group_movies)
-            user_val = sum(rating for _, rating in users_rec[user])
-            user_sat = group_val / user_val
-
-            satisfactions.append((user, user_sat))
-
-        return satisfactions
+        return self.group_recommendation.calculate_satisfactions(group, users_rec, group_rec, aggreg_rec)
 
 
+    @traced('sequential.aggregation')
     def aggregation_from_users_recommendations_and_satisfaction(self, aggreg_rec: dict[int, list[float]],
                                                                 satisfactions: list[tuple[int, float]], n: int = 10) -> list[tuple[int, float]]:
-            aggregated_ratings = defaultdict(float)
-            satisfaction_weights = [sat for _, sat in satisfactions]
+        if len(aggreg_rec) == 0:
+            return []
 
-            # Weighted aggregation of recommendations based on user satisfaction
-            for movie_id, ratings in aggreg_rec.items():
-                for user_id, rating in enumerate(ratings):
-                    aggregated_ratings[movie_id] += rating * (1 - satisfaction_weights[user_id])
+        movies, ratings = group_aggregation.to_matrix(aggreg_rec)
 
-            # Sort recommendations by aggregated weighted rating
-            sorted_recommendations = sorted(aggregated_ratings.items(), key=lambda x: x[1], reverse=True)
+        # Weighted aggregation of recommendations based on user satisfaction
+        scores = group_aggregation.satisfaction_weighted(ratings, [sat for _, sat in satisfactions])
 
-            return sorted_recommendations[:n]
+        # Select recommendations by aggregated weighted rating
+        return group_aggregation.rank(movies, scores, n)
     
\ No newline at end of file
@@ -0,0 +1,163 @@
+import json
+import os
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from dataset import Dataset
+from rating_matrix import RatingMatrix
+
+
+class SharedDataset:
+    """
+    Publishes the rating matrix of a dataset (CSR and CSC arrays, index maps and user means) in
+    `multiprocessing.shared_memory` segments or in memory-mapped .npy files, so that worker processes can
+    attach to read-only, zero-copy views of it instead of each building their own copy.
+
+    The owner process creates the SharedDataset and passes its `descriptor` (a small picklable dict) to the
+    workers, which call `SharedDataset.attach(descriptor)` to get a Dataset usable by UserRecommendation.
+    The attached matrix looks IDs up with binary searches, so workers don't build per-process dictionaries.
+
+    Shared memory workers should be started by the owner process (e.g. a multiprocessing pool), so that they share
+    its resource tracker and the segments are unlinked only when the owner closes the SharedDataset.
+    """
+
+    def __init__(self, dataset: Dataset, path: str = None) -> None:
+        """
+        Args:
+            dataset (Dataset): Dataset to share.
+            path (str, optional): Folder where the arrays are written as .npy files to be memory-mapped.
+                If None, the arrays are copied into shared memory segments.
+        """
+        self._segments: list[shared_memory.SharedMemory] = []
+
+        arrays = SharedDataset._matrix_arrays(dataset.rating_matrix)
+
+        if path is None:
+            locations = {name: self._to_shared_memory(array) for name, array in arrays.items()}
+        else:
+            locations = SharedDataset._to_files(arrays, path)
+
+        self.descriptor = {
+            'kind': 'shm' if path is None else 'mmap',
+            'arrays': locations,
+            # The catalog is small compared to the ratings, workers get their own copy
+            'movies': dataset.movies_df[['movieId', 'title', 'genres']].to_dict('list'),
+        }
+
+        if path is not None:
+            with open(os.path.join(path, 'descriptor.json'), 'w') as file:
+                json.dump(self.descriptor, file)
+
+
+    @staticmethod
+    def _matrix_arrays(matrix: RatingMatrix) -> dict[str, np.ndarray]:
+        csc_indptr, csc_users, csc_data = matrix.csc
+
+        return {'user_ids': matrix.user_ids, 'movie_ids': matrix.movie_ids, 'indptr': matrix.indptr,
+                'indices': matrix.indices, 'data': matrix.data, 'user_means': matrix.user_means,
+                'csc_indptr': csc_indptr, 'csc_users': csc_users, 'csc_data': csc_data,
+                'rated_movie_ids': matrix.rated_movie_ids}
+
+
+    def _to_shared_memory(self, array: np.ndarray) -> dict:
+        # Zero sized segments are not allowed
+        segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self._segments.append(segment)
+
+        np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+
+        return {'name': segment.name, 'shape': array.shape, 'dtype': array.dtype.str}
+
+
+    @staticmethod
+    def _to_files(arrays: dict[str, np.ndarray], path: str) -> dict:
+        os.makedirs(path, exist_ok=True)
+
+        locations = {}
+        for name, array in arrays.items():
+            file_path = os.path.join(path, f'{name}.npy')
+            np.save(file_path, array)
+            locations[name] = {'path': file_path}
+
+        return locations
+
+
+    @staticmethod
+    def attach(descriptor: dict) -> Dataset:
+        """
+        Attaches to a shared dataset from a worker process.
+
+        Args:
+            descriptor (dict): The `descriptor` of the SharedDataset created by the owner process.
+
+        Returns:
+            Dataset: A 'sparse' dataset without ratings_df, backed by read-only views of the shared arrays.
+        """
+        segments = []
+        arrays = {}
+
+        for name, location in descriptor['arrays'].items():
+            if descriptor['kind'] == 'shm':
+                segment = SharedDataset._open_segment(location['name'])
+                segments.append(segment)
+                array = np.ndarray(tuple(location['shape']), dtype=np.dtype(location['dtype']), buffer=segment.buf)
+            else:
+                array = np.load(location['path'], mmap_mode='r')
+
+            array.flags.writeable = False
+            arrays[name] = array
+
+        matrix = RatingMatrix(arrays['user_ids'], arrays['movie_ids'], arrays['indptr'], arrays['indices'],
+                              arrays['data'], arrays['user_means'], index_maps=False)
+        matrix._csc = (arrays['csc_indptr'], arrays['csc_users'], arrays['csc_data'])
+        matrix._rated_movie_ids = arrays['rated_movie_ids']
+
+        # The views are valid as long as the segments are open, so they live with the matrix
+        matrix._segments = segments
+
+        movies_df = pd.DataFrame(descriptor['movies'])
+
+        return Dataset(None, 'sparse', movies_df=movies_df, rating_matrix=matrix, lazy_datetime=True)
+
+
+    @staticmethod
+    def _open_segment(name: str) -> shared_memory.SharedMemory:
+        # Only the owner unlinks the segment, since Python 3.13 the worker can opt out of the tracking
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            return shared_memory.SharedMemory(name=name)
+
+
+    @staticmethod
+    def open(path: str) -> Dataset:
+        """
+        Attaches to a dataset previously shared through memory-mapped files in a folder.
+
+        Args:
+            path (str): Folder passed to the SharedDataset constructor.
+
+        Returns:
+            Dataset: A 'sparse' dataset backed by read-only memory-mapped arrays.
+        """
+        with open(os.path.join(path, 'descriptor.json')) as file:
+            return SharedDataset.attach(json.load(file))
+
+
+    def close(self) -> None:
+        """
+        Releases the shared memory segments. Workers must not use their views after this.
+        """
+        for segment in self._segments:
+            segment.close()
+            segment.unlink()
+
+        self._segments = []
+
+
+    def __enter__(self) -> 'SharedDataset':
+        return self
+
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -0,0 +1,185 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import dataset
+from instrumentation import metrics
+
+
+class SimilarityCache:
+    """
+    Bounded LRU cache for user similarities.
+
+    It stores single (user1, user2) similarities and whole similarity rows (one user against all the users,
+    indexed by user index) computed for a dataset. When the dataset changes (its `version` is bumped) the entries
+    of the users whose ratings changed are dropped, or every entry when the changes are not known.
+    The memory bound is approximate: rows count their array size, pairs a fixed amount.
+    """
+
+    # Metrics whose value doesn't depend on the order of the two users.
+    # sim_pcc divides by the deviation of the first user only and wpcc weights with the ratings
+    # of the second user, so the PCC based metrics are cached per ordered pair.
+    SYMMETRIC_METRICS = {'cosine', 'acosine', 'jaccard', 'manhattan', 'euclidean', 'chebyshev', 'acosine_jaccard'}
+
+    # Approximate size of a cached pair: key tuple, float and LRU bookkeeping
+    PAIR_ENTRY_SIZE = 200
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries: OrderedDict[tuple, object] = OrderedDict()
+        self._dataset_stamp: tuple[int, int] = None
+
+        # The cache can be shared by threads (e.g. the workers of RecommendationService)
+        self._lock = threading.RLock()
+
+
+    @staticmethod
+    def pair_key(metric, user1: int, user2: int) -> tuple:
+        """
+        Key of the similarity between two users, symmetric metrics share the same key for both orders.
+        """
+        if metric in SimilarityCache.SYMMETRIC_METRICS and user2 < user1:
+            user1, user2 = user2, user1
+        return ('pair', metric, user1, user2)
+
+
+    @staticmethod
+    def row_key(metric, user: int) -> tuple:
+        """
+        Key of the similarities between a user and all the users.
+        """
+        return ('row', metric, user)
+
+
+    def validate(self, dataset: dataset.Dataset) -> None:
+        """
+        Invalidates the cache if it was filled from another dataset or the dataset changed since then.
+
+        Args:
+            dataset (dataset.Dataset): Dataset the similarities are going to be computed on.
+        """
+        stamp = (id(dataset), dataset.version)
+
+        with self._lock:
+            if stamp == self._dataset_stamp:
+                return
+
+            changed_users = None
+            if self._dataset_stamp is not None and self._dataset_stamp[0] == id(dataset):
+                changed_users = dataset.changed_users_since(self._dataset_stamp[1])
+
+            if changed_users is None:
+                self.invalidate()
+            else:
+                self.invalidate_users(changed_users)
+            self._dataset_stamp = stamp
+
+
+    def invalidate(self) -> None:
+        """
+        Drops every cached similarity.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+    def invalidate_users(self, users) -> None:
+        """
+        Drops the similarities involving some users, e.g. the ones whose ratings changed.
+        Rows are always dropped, since they hold the similarities with every user and are indexed by user index.
+        """
+        users = set(np.asarray(users).tolist())
+
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] == 'row' or key[2] in users or key[3] in users:
+                    self.nbytes -= self._size(self._entries.pop(key))
+
+
+    def get(self, key: tuple):
+        """
+        Retrieves a cached value and marks it as the most recently used.
+
+        Returns:
+            The cached value, or None if the key is not in the cache.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+
+        metrics.count('similarity_cache.misses' if value is None else 'similarity_cache.hits')
+        return value
+
+
+    def put(self, key: tuple, value) -> None:
+        """
+        Stores a value, evicting the least recently used entries when the memory bound is exceeded.
+        """
+        size = self._size(value)
+
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._size(self._entries.pop(key))
+
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = value
+            self.nbytes += size
+
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= self._size(evicted)
+                self.evictions += 1
+
+
+    def get_pair(self, metric, user1: int, user2: int) -> float:
+        return self.get(SimilarityCache.pair_key(metric, user1, user2))
+
+
+    def put_pair(self, metric, user1: int, user2: int, similarity: float) -> None:
+        self.put(SimilarityCache.pair_key(metric, user1, user2), similarity)
+
+
+    def get_row(self, metric, user: int) -> np.ndarray:
+        return self.get(SimilarityCache.row_key(metric, user))
+
+
+    def put_row(self, metric, user: int, similarities: np.ndarray) -> None:
+        # Rows are shared with the callers, so they are stored read-only
+        similarities.flags.writeable = False
+        self.put(SimilarityCache.row_key(metric, user), similarities)
+
+
+    def stats(self) -> dict[str, int]:
+        """
+        Retrieves the cache counters.
+
+        Returns:
+            dict[str, int]: Number of hits, misses, evictions, entries and used bytes.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self.nbytes}
+
+
+    @staticmethod
+    def _size(value) -> int:
+        if isinstance(value, np.ndarray):
+            return value.nbytes + SimilarityCache.PAIR_ENTRY_SIZE
+        return SimilarityCache.PAIR_ENTRY_SIZE
+
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,212 @@
+import numpy as np
+import dataset
+from instrumentation import metrics, traced
+
+
+class SimilarityEngine:
+    """
+    Computes user similarities in batch on top of the sparse rating matrix of a dataset.
+
+    Every metric mirrors the corresponding scalar `UserRecommendation.sim_*` function, but instead of
+    iterating over the common movies of a single pair of users, the ratings of the common movies of a query
+    user and all the other users are gathered from the CSC view of the matrix and reduced per user.
+    """
+
+    METRICS = ('cosine', 'acosine', 'pcc', 'jaccard', 'manhattan', 'euclidean', 'chebyshev',
+               'wpcc', 'pcc_jaccard', 'acosine_jaccard')
+
+    def __init__(self, dataset: dataset.Dataset) -> None:
+        self.dataset = dataset
+
+
+    @property
+    def matrix(self):
+        return self.dataset.rating_matrix
+
+
+    def similarities(self, user: int, metric: str = 'pcc') -> np.ndarray:
+        """
+        Computes the similarity between a user and every user of the dataset (the user itself included).
+
+        Args:
+            user (int): ID of the user.
+            metric (str, optional): Name of the similarity metric. Defaults to 'pcc'.
+
+        Returns:
+            np.ndarray: Similarities indexed by user index (see `RatingMatrix.user_ids`).
+        """
+        return self.block_similarities([user], metric)[0]
+
+
+    def block_similarities(self, users: list[int], metric: str = 'pcc') -> np.ndarray:
+        """
+        Computes the similarity between each user of a block and every user of the dataset.
+
+        Args:
+            users (list[int]): IDs of the users in the block.
+            metric (str, optional): Name of the similarity metric. Defaults to 'pcc'.
+
+        Returns:
+            np.ndarray: Matrix of shape (len(users), number of users) with the similarities.
+        """
+        if metric not in SimilarityEngine.METRICS:
+            raise ValueError(f"Unknown similarity metric '{metric}', expected one of {SimilarityEngine.METRICS}")
+
+        query_indices = np.fromiter((self.matrix.user_index(user) for user in users), dtype=np.int64)
+
+        if len(query_indices) == 0:
+            return np.zeros((0, self.matrix.shape[0]))
+
+        return self._block_similarities(query_indices, metric)
+
+
+    def candidate_similarities(self, user: int, candidates: list[int], metric: str = 'pcc') -> np.ndarray:
+        """
+        Computes the similarity between a user and some other users only (e.g. the candidates of an LSHIndex),
+        reading the ratings of the candidates instead of the ratings of every user who rated the same movies.
+
+        Args:
+            user (int): ID of the user.
+            candidates (list[int]): IDs of the other users.
+            metric (str, optional): Name of the similarity metric. Defaults to 'pcc'.
+
+        Returns:
+            np.ndarray: Similarities in the order of `candidates`.
+        """
+        if metric not in SimilarityEngine.METRICS:
+            raise ValueError(f"Unknown similarity metric '{metric}', expected one of {SimilarityEngine.METRICS}")
+
+        other_indices = self.matrix.user_indices(candidates)
+        if (other_indices < 0).any():
+            raise KeyError(np.asarray(candidates)[other_indices < 0][0])
+        query_indices = np.array([self.matrix.user_index(user)], dtype=np.int64)
+
+        return self._block_similarities(query_indices, metric, other_indices)[0]
+
+
+    @traced('engine.block_similarities')
+    def _block_similarities(self, query_indices: np.ndarray, metric: str, other_indices: np.ndarray = None) -> np.ndarray:
+        # Similarities of the query users with all the users, or with the users at other_indices only
+        if other_indices is None:
+            other_indices = np.arange(self.matrix.shape[0])
+            keys, query_ratings, other_ratings = self._common_ratings(query_indices)
+        else:
+            keys, query_ratings, other_ratings = self._candidate_common_ratings(query_indices, other_indices)
+
+        num_users = len(other_indices)
+        shape = (len(query_indices), num_users)
+        metrics.count('similarity.pairs', shape[0] * shape[1])
+
+        # Number of common movies for each (query user, other user) pair
+        counts = self._reduce(keys, None, shape)
+        has_common = counts > 0
+
+        if metric == 'cosine':
+            similarity = self._cosine(keys, query_ratings, other_ratings, shape)
+        elif metric in ('acosine', 'acosine_jaccard'):
+            user_means = self.matrix.user_means
+            query_means = user_means[query_indices][keys // num_users]
+            other_means = user_means[other_indices][keys % num_users]
+            similarity = self._cosine(keys, query_ratings - query_means, other_ratings - other_means, shape)
+        elif metric in ('pcc', 'wpcc', 'pcc_jaccard'):
+            similarity = self._pcc(keys, query_ratings, other_ratings, counts, shape)
+        elif metric == 'jaccard':
+            similarity = np.ones(shape)
+        elif metric == 'manhattan':
+            distance = self._reduce(keys, np.abs(query_ratings - other_ratings), shape)
+            similarity = 1 / (1 + distance)
+        elif metric == 'euclidean':
+            distance = np.sqrt(self._reduce(keys, (query_ratings - other_ratings) ** 2, shape))
+            similarity = 1 / (1 + distance)
+        else:
+            max_difference = np.zeros(shape[0] * shape[1])
+            np.maximum.at(max_difference, keys, np.abs(query_ratings - other_ratings))
+            similarity = 1 / (1 + max_difference.reshape(shape))
+
+        # Users without common movies have 0 similarity
+        similarity = np.where(has_common, similarity, 0.0)
+
+        if metric in ('jaccard', 'pcc_jaccard', 'acosine_jaccard'):
+            rated = self.matrix.row_counts()
+            union = rated[query_indices][:, np.newaxis] + rated[other_indices][np.newaxis, :] - counts
+            similarity = similarity * np.divide(counts, union, out=np.zeros(shape), where=union > 0)
+        elif metric == 'wpcc':
+            rated = self.matrix.row_counts()[other_indices][np.newaxis, :]
+            similarity = similarity * np.divide(counts, rated, out=np.zeros(shape), where=rated > 0)
+
+        return similarity
+
+
+    def _common_ratings(self, query_indices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Gathers, for every movie rated by the query users, the ratings of all the users who rated it.
+        # Returns the flattened (query position, other user) key and the two ratings of each common movie.
+        matrix = self.matrix
+
+        block, movies, ratings = matrix.gather_rows(query_indices)
+        owners, other_users, other_ratings = matrix.gather_columns(movies)
+
+        keys = block[owners] * matrix.shape[0] + other_users
+        query_ratings = ratings[owners].astype(np.float64)
+        other_ratings = other_ratings.astype(np.float64)
+
+        return keys, query_ratings, other_ratings
+
+
+    def _candidate_common_ratings(self, query_indices: np.ndarray,
+                                  other_indices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Same of _common_ratings, with the other users restricted to other_indices (keys use their position)
+        matrix = self.matrix
+        owners, movies, ratings = matrix.gather_rows(other_indices)
+
+        keys, query_ratings, other_ratings = [], [], []
+        for position, query_index in enumerate(query_indices.tolist()):
+            query_movies, query_row = matrix.get_row(query_index)
+            row = np.full(matrix.shape[1], np.nan)
+            row[query_movies] = query_row
+
+            common = row[movies]
+            found = ~np.isnan(common)
+            keys.append(position * len(other_indices) + owners[found])
+            query_ratings.append(common[found])
+            other_ratings.append(ratings[found].astype(np.float64))
+
+        return np.concatenate(keys), np.concatenate(query_ratings), np.concatenate(other_ratings)
+
+
+    @staticmethod
+    def _reduce(keys: np.ndarray, values: np.ndarray, shape: tuple[int, int]) -> np.ndarray:
+        return np.bincount(keys, weights=values, minlength=shape[0] * shape[1]).reshape(shape)
+
+
+    def _cosine(self, keys: np.ndarray, query_ratings: np.ndarray, other_ratings: np.ndarray,
+                shape: tuple[int, int]) -> np.ndarray:
+        numerator = self._reduce(keys, query_ratings * other_ratings, shape)
+        denominator_user1 = np.sqrt(self._reduce(keys, query_ratings ** 2, shape))
+        denominator_user2 = np.sqrt(self._reduce(keys, other_ratings ** 2, shape))
+
+        denominator = denominator_user1 * denominator_user2
+        return np.divide(numerator, denominator, out=np.zeros(shape), where=(denominator_user1 != 0) & (denominator_user2 != 0))
+
+
+    def _pcc(self, keys: np.ndarray, query_ratings: np.ndarray, other_ratings: np.ndarray,
+             counts: np.ndarray, shape: tuple[int, int]) -> np.ndarray:
+        safe_counts = np.maximum(counts, 1)
+
+        # Mean ratings of both users over their common movies
+        mean_rating_user1 = (self._reduce(keys, query_ratings, shape) / safe_counts).ravel()
+        mean_rating_user2 = (self._reduce(keys, other_ratings, shape) / safe_counts).ravel()
+
+        centered_user1 = query_ratings - mean_rating_user1[keys]
+        centered_user2 = other_ratings - mean_rating_user2[keys]
+
+        numerator = self._reduce(keys, centered_user1 * centered_user2, shape)
+        denominator_user1 = self._reduce(keys, centered_user1 ** 2, shape)
+        denominator_user2 = self._reduce(keys, centered_user2 ** 2, shape)
+
+        valid = (denominator_user1 != 0) & (denominator_user2 != 0)
+
+        # Same operator order of UserRecommendation.sim_pcc
+        with np.errstate(invalid='ignore', divide='ignore'):
+            correlation = numerator / np.sqrt(denominator_user1) * np.sqrt(denominator_user2)
+
+        return np.where(valid, correlation, 0.0)
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+
+class SyntheticDataset:
+    """
+    Generates MovieLens-like ratings and movies dataframes of any size, for benchmarks and scaling tests.
+
+    Users have a log-normal activity (at least `min_ratings` ratings each), movie popularity follows a Zipf
+    law and ratings come from user and movie biases plus a low rank taste component, rounded to half stars.
+    The same seed always generates the same dataset.
+    """
+
+    # (users, movies, ratings) of the MovieLens releases
+    SCALES = {
+        'small': (610, 9_742, 100_836),
+        'medium': (6_040, 3_706, 1_000_209),
+        'large': (69_878, 10_677, 10_000_054),
+        'xlarge': (162_541, 59_047, 25_000_095),
+    }
+
+    GENRES = ['Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime', 'Documentary', 'Drama', 'Fantasy',
+              'Film-Noir', 'Horror', 'IMAX', 'Musical', 'Mystery', 'Romance', 'Sci-Fi', 'Thriller', 'War', 'Western']
+
+    def __init__(self, num_users: int, num_movies: int, num_ratings: int, seed: int = 0, min_ratings: int = 20) -> None:
+        """
+        Args:
+            num_users (int): Number of users.
+            num_movies (int): Number of movies in the catalog.
+            num_ratings (int): Target number of ratings, the generated ones can be slightly fewer.
+            seed (int, optional): Seed of the generator. Defaults to 0.
+            min_ratings (int, optional): Minimum number of ratings per user. Defaults to 20 (as in MovieLens).
+        """
+        self.num_users = num_users
+        self.num_movies = num_movies
+        self.num_ratings = num_ratings
+        self.seed = seed
+        self.min_ratings = min(min_ratings, num_movies)
+
+
+    @classmethod
+    def from_scale(cls, scale: str, seed: int = 0) -> 'SyntheticDataset':
+        """
+        Generator with the size of a MovieLens release: 'small' (100K), 'medium' (1M), 'large' (10M) or 'xlarge' (25M).
+        """
+        if scale not in cls.SCALES:
+            raise ValueError(f"Unknown scale '{scale}', expected one of {tuple(cls.SCALES)}")
+
+        return cls(*cls.SCALES[scale], seed=seed)
+
+
+    def generate(self) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Generates the dataset.
+
+        Returns:
+            tuple[pd.DataFrame, pd.DataFrame]: Ratings (userId, movieId, rating, timestamp) and movies (movieId, title,
+                genres as lists of names) dataframes, in the format of Dataset.read_movies.
+        """
+        rng = np.random.default_rng(self.seed)
+
+        users, movies = self._sample_pairs(rng)
+        ratings = self._sample_ratings(rng, users, movies)
+        timestamps = rng.integers(946_684_800, 1_537_799_250, size=len(users), dtype=np.int64)
+
+        ratings_df = pd.DataFrame({'userId': (users + 1).astype(np.int32), 'movieId': (movies + 1).astype(np.int32),
+                                   'rating': ratings, 'timestamp': timestamps})
+
+        return ratings_df, self._movies_df(rng)
+
+
+    def _sample_pairs(self, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+        # Number of ratings of each user, a heavy tailed activity on top of the minimum
+        activity = rng.lognormal(0, 1.2, size=self.num_users)
+        extra = max(self.num_ratings - self.min_ratings * self.num_users, 0)
+        targets = self.min_ratings + rng.multinomial(extra, activity / activity.sum())
+        targets = np.minimum(targets, self.num_movies)
+
+        # Popularity of each movie, the most popular ones get random IDs
+        popularity = 1 / np.arange(1, self.num_movies + 1) ** 0.9
+        popularity = rng.permutation(popularity / popularity.sum())
+
+        # Sample with replacement and drop the duplicates, then top up the users that are still missing ratings
+        keys = np.empty(0, dtype=np.int64)
+        missing = targets.copy()
+
+        for _ in range(50):
+            if missing.sum() == 0:
+                break
+
+            users = np.repeat(np.arange(self.num_users, dtype=np.int64), missing)
+            movies = rng.choice(self.num_movies, size=len(users), p=popularity)
+            keys = np.unique(np.concatenate((keys, users * self.num_movies + movies)))
+
+            counts = np.bincount(keys // self.num_movies, minlength=self.num_users)
+            missing = np.maximum(targets - counts, 0)
+
+        # Users that got more ratings than their target because of the top up rounds keep them
+        return keys // self.num_movies, keys % self.num_movies
+
+
+    def _sample_ratings(self, rng: np.random.Generator, users: np.ndarray, movies: np.ndarray) -> np.ndarray:
+        factors = 8
+        user_bias = rng.normal(0, 0.4, size=self.num_users)
+        movie_bias = rng.normal(0, 0.5, size=self.num_movies)
+        user_taste = rng.normal(0, 0.35, size=(self.num_users, factors))
+        movie_taste = rng.normal(0, 0.35, size=(self.num_movies, factors))
+
+        # The taste component is computed in chunks to bound the memory of the (ratings x factors) products
+        taste = np.empty(len(users))
+        for start in range(0, len(users), 1 << 20):
+            end = start + (1 << 20)
+            taste[start:end] = np.einsum('ij,ij->i', user_taste[users[start:end]], movie_taste[movies[start:end]])
+
+        ratings = 3.5 + user_bias[users] + movie_bias[movies] + taste + rng.normal(0, 0.7, size=len(users))
+
+        return np.clip(np.round(ratings * 2) / 2, 0.5, 5.0).astype(np.float32)
+
+
+    def _movies_df(self, rng: np.random.Generator) -> pd.DataFrame:
+        years = rng.integers(1920, 2019, size=self.num_movies)
+        num_genres = rng.integers(1, 4, size=self.num_movies)
+        genre_codes = [rng.choice(len(SyntheticDataset.GENRES), size=count, replace=False) for count in num_genres]
+
+        return pd.DataFrame({
+            'movieId': np.arange(1, self.num_movies + 1, dtype=np.int32),
+            'title': [f'Movie {movie} ({year})' for movie, year in zip(range(1, self.num_movies + 1), years)],
+            'genres': [[SyntheticDataset.GENRES[code] for code in sorted(codes)] for codes in genre_codes],
+        })
@@ -2,14 +2,90 @@ import dataset
 import math 
 from typing import Callable
 import numpy as np
+from similarity_engine import SimilarityEngine
+from neighbor_index import NeighborIndex
+from lsh_index import LSHIndex
+from candidate_generation import CandidateGenerator
+from similarity_cache import SimilarityCache
+from ranking import top_n_indices, top_n_items
+from instrumentation import metrics, traced
 
 # UserBasedCollaborativeFiltering
 class UserRecommendation:    
+
+    # Similarity functions that the SimilarityEngine can compute for all users at once
+    VECTORIZED_SIMILARITIES = {
+        'sim_cosine': 'cosine',
+        'sim_acosine': 'acosine',
+        'sim_pcc': 'pcc',
+        'sim_jaccard': 'jaccard',
+        'sim_manhattan': 'manhattan',
+        'sim_euclidean': 'euclidean',
+        'sim_chebyshev': 'chebyshev',
+        'sim_wpcc_jaccard': 'pcc_jaccard',
+        'sim_acosine_jaccard': 'acosine_jaccard',
+    }
     
-    def __init__(self, dataset: dataset.Dataset) -> None:
+    def __init__(self, dataset: dataset.Dataset, vectorized: bool = True, similarity_cache: SimilarityCache = None,
+                 candidate_generator: CandidateGenerator = None) -> None:
         self.dataset = dataset
+        self.vectorized = vectorized
+        self.similarity_engine = SimilarityEngine(dataset)
+
+        # Optional cache of the computed similarities, it can be shared between objects
+        self.similarity_cache = similarity_cache
+
+        # metric -> precomputed top-K neighbors
+        self.neighbor_indexes: dict[str, NeighborIndex] = {}
+        # metric -> LSH index of the approximate neighbor retrieval
+        self.approximate_indexes: dict[str, LSHIndex] = {}
+
+        # Movies scored for the top N recommendations, by default the ones rated by the neighbors
+        self.candidate_generator = candidate_generator if candidate_generator is not None else CandidateGenerator(dataset)
+
+
+    def configuration(self) -> dict:
+        """
+        Settings of this recommender besides its dataset, to build an equivalent one on a copy of the dataset
+        (e.g. in the worker processes of BatchRecommendation, see from_configuration).
+        Stale neighbor indexes, built on other ratings than the current ones, are left out.
+
+        Returns:
+            dict: Picklable settings, the indexes included.
+        """
+        fingerprint = self.dataset.get_fingerprint()
+
+        return {
+            'vectorized': self.vectorized,
+            'similarity_cache_bytes': self.similarity_cache.max_bytes if self.similarity_cache is not None else None,
+            'candidate_generator': {'popular': self.candidate_generator.popular,
+                                    'genre_candidates': self.candidate_generator.genre_candidates,
+                                    'top_genres': self.candidate_generator.top_genres},
+            'neighbor_indexes': [index for index in self.neighbor_indexes.values() if index.fingerprint == fingerprint],
+            'approximate_indexes': list(self.approximate_indexes.values()),
+        }
+
+
+    @classmethod
+    def from_configuration(cls, dataset: dataset.Dataset, configuration: dict) -> 'UserRecommendation':
+        """
+        Builds a recommender with the settings of another one (see configuration), given a copy of its dataset
+        with the ratings it had when the settings were taken. The similarity cache starts empty, with the same memory bound.
+        """
+        cache_bytes = configuration['similarity_cache_bytes']
+        user_recommendation = cls(dataset, configuration['vectorized'],
+                                  SimilarityCache(cache_bytes) if cache_bytes is not None else None,
+                                  CandidateGenerator(dataset, **configuration['candidate_generator']))
+
+        for neighbor_index in configuration['neighbor_indexes']:
+            user_recommendation.use_neighbor_index(neighbor_index)
+        for approximate_index in configuration['approximate_indexes']:
+            user_recommendation.use_approximate_index(approximate_index)
+
+        return user_recommendation
 
 
+    @traced('similarity.cosine')
     def sim_cosine(self, user1: int, user2: int) -> float:
         """
         Computes the Cosine Similarity between two users based on their ratings.
@@ -42,6 +118,7 @@ class UserRecommendation:
         return similarity
     
 
+    @traced('similarity.acosine')
     def sim_acosine(self, user1: int, user2: int) -> float:
         """
         Computes the Adjusted Cosine Similarity between two users based on their ratings.
@@ -79,6 +156,7 @@ class UserRecommendation:
     
 
 
+    @traced('similarity.pcc')
     def sim_pcc(self, user1: int, user2: int) -> float:
         """
         Computes the Pearson Correlation Coefficient between two users based on their ratings.
@@ -117,6 +195,7 @@ class UserRecommendation:
         return correlation_coefficient
     
 
+    @traced('similarity.manhattan')
     def sim_manhattan(self, user1: int, user2: int) -> float:
         """
         Computes the Manhattan Distance similarity between two users based on their ratings.
@@ -141,6 +220,7 @@ class UserRecommendation:
         return similarity
 
 
+    @traced('similarity.euclidean')
     def sim_euclidean(self, user1: int, user2: int) -> float:
         """
         Computes the Euclidean Distance similarity between two users based on their ratings.
@@ -165,6 +245,7 @@ class UserRecommendation:
         return similarity
     
 
+    @traced('similarity.chebyshev')
     def sim_chebyshev(self, user1: int, user2: int) -> float:
         """
         Computes the similarity between two users based on the Chebyshev distance.
@@ -192,9 +273,10 @@ class UserRecommendation:
         return similarity
     
     
+    @traced('similarity.wpcc')
     def sim_wpcc(self, user1: int, user2: int, weight: Callable[[int, int], float]) -> float:
-        number_of_common_movies = len(self.dataset.get_common_movies(user1, user2))
-        number_of_movies_rated_by_user2 = len(self.dataset.get_movies_rated_by_user(user2))
+        number_of_common_movies = self.dataset.count_common_movies(user1, user2)
+        number_of_movies_rated_by_user2 = self.dataset.count_rated_movies(user2)
         
         weight = number_of_common_movies / number_of_movies_rated_by_user2 if number_of_movies_rated_by_user2 != 0 else 0
         
@@ -202,6 +284,7 @@ class UserRecommendation:
     
     
     
+    @traced('similarity.jaccard')
     def sim_jaccard(self, user1: int, user2: int):
         """
         Computes the Jaccard similarity coefficient between two users based on the movies they have rated.
@@ -213,14 +296,18 @@ class UserRecommendation:
         Returns:
             float: Jaccard similarity coefficient between the two users.
         """
-        common_movies = self.dataset.get_common_movies(user1, user2)
-        movies_rated_by_user1 = self.dataset.get_movies_rated_by_user(user1)
-        movies_rated_by_user2 = self.dataset.get_movies_rated_by_user(user2)
+        number_of_common_movies = self.dataset.count_common_movies(user1, user2)
+        number_of_movies_rated_by_user1 = self.dataset.count_rated_movies(user1)
+        number_of_movies_rated_by_user2 = self.dataset.count_rated_movies(user2)
+
+        # |A ∪ B| = |A| + |B| - |A ∩ B|
+        union = number_of_movies_rated_by_user1 + number_of_movies_rated_by_user2 - number_of_common_movies
         
-        return len(common_movies) / len(movies_rated_by_user1 | movies_rated_by_user2)
+        return number_of_common_movies / union
 
 
     
+    @traced('similarity.wpcc_jaccard')
     def sim_wpcc_jaccard(self, user1: int, user2: int):
         """
         Computes Pearson correlation coefficient (PCC) weighted with the Jaccard similarity coefficient between two users.
@@ -235,6 +322,7 @@ class UserRecommendation:
         return self.sim_pcc(user1, user2) * self.sim_jaccard(user1, user2)
     
     
+    @traced('similarity.acosine_jaccard')
     def sim_acosine_jaccard(self, user1: int, user2: int):
         """
         Computes Pearson correlation coefficient (PCC) weighted with the Jaccard similarity coefficient between two users.
@@ -249,6 +337,7 @@ class UserRecommendation:
         return self.sim_acosine(user1, user2) * self.sim_jaccard(user1, user2)
 
     
+    @traced('user.prediction')
     def prediction_from_neighbors(self, user: int, movie: int, neighbors: list[tuple[int, float]]) -> float:
         """
         Predicts the rating for a movie by a user based on the ratings of similar users.
@@ -275,8 +364,202 @@ class UserRecommendation:
         return self.dataset.get_user_mean_rating(user) + (numerator / denominator)
     
 
+    def predictions_from_neighbors(self, user: int, movies: list[int], neighbors: list[tuple[int, float]]) -> np.ndarray:
+        """
+        Predicts the ratings of several movies at once for a user, with the same formula of prediction_from_neighbors.
+
+        Args:
+            user (int): ID of the user.
+            movies (list[int]): IDs of the movies.
+            neighbors (list[tuple[int, float]]): List of tuples containing IDs of similar users and their similarity scores.
+
+        Returns:
+            np.ndarray: Predicted ratings, in the same order of `movies`.
+        """
+        return self.predictions_for_users([user], movies, {user: neighbors})[0]
+    
+
+    @traced('user.predictions')
+    def predictions_for_users(self, users: list[int], movies: list[int], 
+                              neighbors_by_user: dict[int, list[tuple[int, float]]]) -> np.ndarray:
+        """
+        Predicts the ratings of several movies for several users (e.g. the members of a group) at once.
+
+        The mean-centered ratings of all the distinct neighbors are laid out in a (neighbors x movies) matrix,
+        so that the predictions of every user are a single matrix product with the similarity weights.
+
+        Args:
+            users (list[int]): IDs of the users.
+            movies (list[int]): IDs of the movies.
+            neighbors_by_user (dict[int, list[tuple[int, float]]]): Neighbors of each user with their similarity scores.
+
+        Returns:
+            np.ndarray: Matrix of shape (len(users), len(movies)) with the predicted ratings.
+        """
+        # Similarity weights of each user for the distinct neighbors
+        neighbor_ids = sorted({other_user for user in users for other_user, _ in neighbors_by_user[user]})
+        neighbor_position = {other_user: position for position, other_user in enumerate(neighbor_ids)}
+
+        weights = np.zeros((len(users), len(neighbor_ids)))
+        for row, user in enumerate(users):
+            for other_user, similarity in neighbors_by_user[user]:
+                weights[row, neighbor_position[other_user]] = similarity
+
+        centered, rated = self._neighbors_centered_ratings(neighbor_ids, movies)
+
+        numerator = weights @ centered
+        denominator = np.abs(weights) @ rated
+
+        means = np.array([self.dataset.get_user_mean_rating(user) for user in users], dtype=float)[:, np.newaxis]
+        deviation = np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator != 0)
+
+        return means + deviation
     
-    def similarity_for_all_users(self, user: int, similarity_function: Callable = None) -> list[tuple[int, float]]:
+
+    @traced('user.predictions_for_neighbor_sizes')
+    def predictions_for_neighbor_sizes(self, user: int, movies: list[int], neighbors: list[tuple[int, float]],
+                                       neighbor_sizes: list[int]) -> np.ndarray:
+        """
+        Predicts the ratings of several movies for a user with several neighbor sizes at once.
+
+        The neighbors of size k are the first k of the ranked `neighbors` list, so the numerator and the denominator
+        of the prediction formula for every size are prefix sums over the same (neighbors x movies) matrix.
+
+        Args:
+            user (int): ID of the user.
+            movies (list[int]): IDs of the movies.
+            neighbors (list[tuple[int, float]]): Similar users and their scores, ranked, at least max(neighbor_sizes) long if possible.
+            neighbor_sizes (list[int]): Neighbor sizes.
+
+        Returns:
+            np.ndarray: Matrix of shape (len(neighbor_sizes), len(movies)) with the predicted ratings.
+        """
+        neighbor_ids = [other_user for other_user, _ in neighbors]
+        similarities = np.array([similarity for _, similarity in neighbors], dtype=float)
+
+        centered, rated = self._neighbors_centered_ratings(neighbor_ids, movies)
+
+        # Row i holds the sums over the first i neighbors, the first row is the empty neighborhood
+        numerator = np.zeros((len(neighbor_ids) + 1, len(movies)))
+        np.cumsum(similarities[:, np.newaxis] * centered, axis=0, out=numerator[1:])
+        denominator = np.zeros((len(neighbor_ids) + 1, len(movies)))
+        np.cumsum(np.abs(similarities)[:, np.newaxis] * rated, axis=0, out=denominator[1:])
+
+        prefixes = np.minimum(np.asarray(neighbor_sizes, dtype=np.int64), len(neighbor_ids))
+        numerator, denominator = numerator[prefixes], denominator[prefixes]
+
+        deviation = np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator != 0)
+
+        return self.dataset.get_user_mean_rating(user) + deviation
+    
+
+    def _neighbors_centered_ratings(self, neighbor_ids: list[int], movies: list[int]) -> tuple[np.ndarray, np.ndarray]:
+        # (neighbors x movies) matrices of the mean-centered ratings and of the rated flags of the neighbors
+        matrix = self.dataset.rating_matrix
+
+        # Column of each candidate movie in the prediction matrix, -1 if it is not a candidate
+        movie_indices = matrix.movie_indices(movies)
+        columns = np.full(matrix.shape[1], -1, dtype=np.int64)
+        columns[movie_indices[movie_indices >= 0]] = np.flatnonzero(movie_indices >= 0)
+
+        neighbor_indices = np.fromiter((matrix.user_index(other_user) for other_user in neighbor_ids),
+                                       dtype=np.int64, count=len(neighbor_ids))
+        owners, rated_movies, ratings = matrix.gather_rows(neighbor_indices)
+        rated_columns = columns[rated_movies]
+        candidate = rated_columns >= 0
+        owners, rated_columns = owners[candidate], rated_columns[candidate]
+
+        centered = np.zeros((len(neighbor_ids), len(movies)))
+        centered[owners, rated_columns] = ratings[candidate] - matrix.user_means[neighbor_indices][owners]
+        rated = np.zeros((len(neighbor_ids), len(movies)))
+        rated[owners, rated_columns] = 1
+
+        return centered, rated
+    
+
+    def get_similarity_function(self, metric: str) -> Callable:
+        """
+        Retrieves the sim_* method of this object for a metric name (e.g. 'pcc', 'acosine_jaccard').
+
+        Args:
+            metric (str): Name of the metric, unknown names default to PCC.
+
+        Returns:
+            function: The similarity function.
+        """
+        for name, vectorized_metric in UserRecommendation.VECTORIZED_SIMILARITIES.items():
+            if vectorized_metric == metric:
+                return getattr(self, name)
+
+        return self.sim_pcc
+    
+
+    def get_similarity_metric(self, similarity_function: Callable) -> str:
+        """
+        Retrieves the name of the SimilarityEngine metric equivalent to a similarity function.
+
+        Args:
+            similarity_function (function): One of the sim_* methods of this object.
+
+        Returns:
+            str: Name of the metric, or None if the function can't be computed by the SimilarityEngine.
+        """
+        if getattr(similarity_function, '__self__', None) is not self:
+            return None
+
+        return UserRecommendation.VECTORIZED_SIMILARITIES.get(similarity_function.__name__)
+    
+
+    
+    def similarity(self, user1: int, user2: int, similarity_function: Callable = None) -> float:
+        """
+        Computes the similarity between two users, going through the similarity cache if there is one.
+
+        Args:
+            user1 (int): ID of the first user.
+            user2 (int): ID of the second user.
+            similarity_function (function, optional): Function to compute similarity between users. 
+                Defaults to sim_pcc.
+
+        Returns:
+            float: Similarity between the two users.
+        """
+        if similarity_function is None:
+            similarity_function = self.sim_pcc
+
+        if self.similarity_cache is None:
+            return similarity_function(user1, user2)
+
+        self.similarity_cache.validate(self.dataset)
+
+        # Custom functions are cached by themselves, they are never considered symmetric
+        metric = self.get_similarity_metric(similarity_function) or similarity_function
+
+        similarity = self.similarity_cache.get_pair(metric, user1, user2)
+        if similarity is None:
+            similarity = similarity_function(user1, user2)
+            self.similarity_cache.put_pair(metric, user1, user2, similarity)
+
+        return similarity
+
+
+    def _similarity_row(self, user: int, metric: str) -> np.ndarray:
+        # Similarities between a user and all the users, indexed by user index
+        if self.similarity_cache is None:
+            return self.similarity_engine.similarities(user, metric)
+
+        self.similarity_cache.validate(self.dataset)
+
+        similarities = self.similarity_cache.get_row(metric, user)
+        if similarities is None:
+            similarities = self.similarity_engine.similarities(user, metric)
+            self.similarity_cache.put_row(metric, user, similarities)
+
+        return similarities
+
+    
+    @traced('user.similarity_scan')
+    def similarity_for_all_users(self, user: int, similarity_function: Callable = None, n: int = None) -> list[tuple[int, float]]:
         """
         Finds the top N similar users to a given user based on a similarity function.
 
@@ -284,28 +567,44 @@ class UserRecommendation:
             user (int): ID of the user.
             similarity_function (function, optional): Function to compute similarity between users. 
                 Defaults to sim_pcc.
-            n (int, optional): Number of similar users to find. Defaults to 10.
+            n (int, optional): Number of similar users to find. If None, all the users are ranked.
 
         Returns:
             List: List of tuples containing similar user IDs and their corresponding similarity scores.
         """
         if similarity_function is None:
             similarity_function = self.sim_pcc
+
+        metric = self.get_similarity_metric(similarity_function) if self.vectorized else None
+
+        if metric is not None:
+            return self._vectorized_similarity_for_all_users(user, metric, n)
         
-        ls: list[tuple[int, float]] = []
-        
-        for other_user in self.dataset.get_users():
-            if user == other_user: continue
+        ls = ((other_user, self.similarity(user, other_user, similarity_function)) 
+              for other_user in self.dataset.get_users() if other_user != user)
+
+        # Select the users by similarity in descending order
+        return top_n_items(ls, n)
+    
+
+    def _vectorized_similarity_for_all_users(self, user: int, metric: str, n: int = None) -> list[tuple[int, float]]:
+        return self._rank_similarity_row(user, self._similarity_row(user, metric), n)
 
-            ls.append((other_user, similarity_function(user, other_user)))
 
-        # Sort the users by similarity in descending order
-        ls.sort(key=lambda x: x[1], reverse=True)    
+    def _rank_similarity_row(self, user: int, similarities: np.ndarray, n: int = None) -> list[tuple[int, float]]:
+        matrix = self.dataset.rating_matrix
 
-        return ls
+        # Exclude the user itself, other users are in ascending ID order like in get_users()
+        others = np.delete(np.arange(len(similarities)), matrix.user_index(user))
+
+        # Select the users by similarity in descending order, ties keep the ascending ID order
+        order = others[top_n_indices(similarities[others], n)]
+
+        return list(zip(matrix.user_ids[order].tolist(), similarities[order].tolist()))
     
     
     
+    @traced('user.neighbors')
     def top_n_similar_users(self, user: int, similarity_function = None, n: int = 10) -> list[tuple[int, float]]:
         """
         Finds the top N similar users to a given user based on the Pearson correlation coefficient.
@@ -316,13 +615,199 @@ class UserRecommendation:
         Returns:
             List: List of tuples containing similar user IDs and their corresponding similarity scores.
         """
-        all_similar_users = self.similarity_for_all_users(user, similarity_function)
-        return all_similar_users[:n]
+        if similarity_function is None:
+            similarity_function = self.sim_pcc
+
+        # Serve the neighbors from the precomputed index when there is one for this similarity
+        neighbor_index = self._current_neighbor_index(self.get_similarity_metric(similarity_function), user, n)
+        if neighbor_index is not None:
+            return neighbor_index.top_n(user, n)
+
+        approximate_index = self.approximate_indexes.get(self.get_similarity_metric(similarity_function))
+        if approximate_index is not None and approximate_index.has_user(user):
+            neighbors = self._approximate_top_n_similar_users(user, similarity_function, approximate_index, n)
+            if neighbors is not None:
+                return neighbors
+            metrics.count('lsh.fallbacks')
+
+        return self.similarity_for_all_users(user, similarity_function, n)
+
+
+    def _current_neighbor_index(self, metric: str, user: int, n: int) -> NeighborIndex:
+        # The neighbor index serving a lookup, if any. An index built on other ratings is stale (e.g. before new
+        # ratings were added, the neighbors of any user may have changed), so the exact scan is used instead.
+        neighbor_index = self.neighbor_indexes.get(metric)
+        if neighbor_index is None or n > neighbor_index.k or not neighbor_index.has_user(user):
+            return None
+
+        if neighbor_index.fingerprint != self.dataset.get_fingerprint():
+            metrics.count('neighbor_index.stale')
+            return None
+
+        return neighbor_index
+
+
+    @traced('user.approximate_neighbors')
+    def _approximate_top_n_similar_users(self, user: int, similarity_function: Callable, approximate_index: LSHIndex,
+                                         n: int) -> list[tuple[int, float]]:
+        matrix = self.dataset.rating_matrix
+        movie_indices, ratings = matrix.get_row(matrix.user_index(user))
+
+        candidates = approximate_index.candidates(matrix.movie_ids[movie_indices], ratings,
+                                                  self.dataset.get_user_mean_rating(user))
+        candidates = candidates[candidates != user]
+
+        # Too few candidates, or too many to be faster than the exact scan: the caller falls back to it
+        if len(candidates) < n or len(candidates) > LSHIndex.MAX_CANDIDATE_FRACTION * matrix.shape[0]:
+            return None
+
+        # Exact re-ranking, candidates are in ascending ID order like in the exact scan
+        candidates = candidates[matrix.user_indices(candidates) >= 0].tolist()
+        metric = self.get_similarity_metric(similarity_function) if self.vectorized else None
+
+        if metric is not None:
+            similarities = self.similarity_engine.candidate_similarities(user, candidates, metric)
+            order = top_n_indices(similarities, n)
+            return [(candidates[position], similarity) for position, similarity in zip(order.tolist(), similarities[order].tolist())]
+
+        return top_n_items(((other_user, self.similarity(user, other_user, similarity_function)) for other_user in candidates), n)
+    
+
+    @traced('user.neighbors_batch')
+    def top_n_similar_users_batch(self, users: list[int], similarity_function: Callable = None,
+                                  n: int = 10) -> dict[int, list[tuple[int, float]]]:
+        """
+        Finds the top N similar users of several users (e.g. concurrent requests), with the same results of
+        top_n_similar_users. The users that would be served by a full scan are computed in a single pass of
+        SimilarityEngine.block_similarities instead of one pass per user.
+
+        Args:
+            users (list[int]): IDs of the users.
+            similarity_function (function, optional): Function to compute similarity between users. Defaults to sim_pcc.
+            n (int, optional): Number of similar users of each user. Defaults to 10.
+
+        Returns:
+            dict[int, list[tuple[int, float]]]: user -> similar user IDs and their similarity scores.
+        """
+        if similarity_function is None:
+            similarity_function = self.sim_pcc
+
+        metric = self.get_similarity_metric(similarity_function) if self.vectorized else None
+        approximate_index = self.approximate_indexes.get(metric)
+
+        if self.similarity_cache is not None:
+            self.similarity_cache.validate(self.dataset)
+
+        neighbors = {}
+        scanned = []
+        for user in dict.fromkeys(users):
+            served_by_index = self._current_neighbor_index(metric, user, n) is not None \
+                or (approximate_index is not None and approximate_index.has_user(user))
+            cached = self.similarity_cache is not None and self.similarity_cache.get_row(metric, user) is not None
+
+            if metric is None or served_by_index or cached:
+                neighbors[user] = self.top_n_similar_users(user, similarity_function, n)
+            else:
+                scanned.append(user)
+
+        if len(scanned) > 0:
+            block = self.similarity_engine.block_similarities(scanned, metric)
+
+            for user, similarities in zip(scanned, block):
+                if self.similarity_cache is not None:
+                    similarities = similarities.copy()
+                    self.similarity_cache.put_row(metric, user, similarities)
+                neighbors[user] = self._rank_similarity_row(user, similarities, n)
+
+        return {user: neighbors[user] for user in users}
+
+
+    def build_neighbor_index(self, similarity_function: Callable = None, k: int = 50) -> NeighborIndex:
+        """
+        Precomputes the top K neighbors of every user for a similarity function and uses them in top_n_similar_users.
+        After new ratings are added to the dataset the index is stale and the neighbors are scanned again,
+        until the index is rebuilt.
+
+        Args:
+            similarity_function (function, optional): One of the sim_* methods of this object. Defaults to sim_pcc.
+            k (int, optional): Number of neighbors to keep for each user. Defaults to 50.
+
+        Returns:
+            NeighborIndex: The neighbor index, that can be saved and loaded back with use_neighbor_index.
+        """
+        if similarity_function is None:
+            similarity_function = self.sim_pcc
+
+        metric = self.get_similarity_metric(similarity_function)
+        if metric is None:
+            raise ValueError(f'{similarity_function} can not be precomputed in a neighbor index')
+
+        neighbor_index = NeighborIndex.build(self.similarity_engine, metric, k)
+        self.neighbor_indexes[metric] = neighbor_index
+
+        return neighbor_index
+    
+
+    def use_neighbor_index(self, neighbor_index: NeighborIndex) -> None:
+        """
+        Serves the neighbor lookups of top_n_similar_users for the metric of the index from it.
+
+        Args:
+            neighbor_index (NeighborIndex): Neighbor index built over the same dataset.
+        """
+        if not neighbor_index.is_compatible(self.dataset.rating_matrix.user_ids):
+            raise ValueError('The neighbor index was built over a different set of users')
+
+        self.neighbor_indexes[neighbor_index.metric] = neighbor_index
     
     
     
+    def build_approximate_index(self, similarity_function: Callable = None, num_tables: int = None, num_bits: int = None,
+                                seed: int = 0, threshold: float = 0.15) -> LSHIndex:
+        """
+        Builds an LSH index for a similarity function, so that top_n_similar_users retrieves candidate neighbors
+        from it and re-ranks only them exactly, instead of scanning every user (see LSHIndex).
+
+        Args:
+            similarity_function (function, optional): One of the sim_* methods of this object. Defaults to sim_pcc.
+            num_tables (int, optional): Number of hash tables. Defaults to 8, 64 MinHash bands for sim_jaccard.
+            num_bits (int, optional): Bits of each table. Defaults to a value depending on the number of users
+                (random projections) or on `threshold` (MinHash), see LSHIndex.build.
+            seed (int, optional): Seed of the hash functions. Defaults to 0.
+            threshold (float, optional): Jaccard similarity the MinHash bands are tuned for. Defaults to 0.15.
+
+        Returns:
+            LSHIndex: The index, whose `tables` and `probes` attributes trade recall for latency.
+
+        The default random projections only narrow down the candidates from about 10,000 users (40 times
+        LSHIndex.BUCKET_SIZE): with fewer users the candidates exceed LSHIndex.MAX_CANDIDATE_FRACTION of them
+        (e.g. 43% of the 6,040 users of the medium benchmark dataset) and the lookups fall back to the exact scan.
+        """
+        if similarity_function is None:
+            similarity_function = self.sim_pcc
+
+        metric = self.get_similarity_metric(similarity_function)
+        if metric not in LSHIndex.METRICS:
+            raise ValueError(f'{similarity_function} can not be served by an approximate index')
+
+        approximate_index = LSHIndex.build(self.dataset.rating_matrix, metric, num_tables, num_bits, seed, threshold)
+        self.approximate_indexes[metric] = approximate_index
+
+        return approximate_index
+
+
+    def use_approximate_index(self, approximate_index: LSHIndex) -> None:
+        """
+        Serves the neighbor lookups of top_n_similar_users for the metric of the index from it (see build_approximate_index).
+        """
+        self.approximate_indexes[approximate_index.metric] = approximate_index
+    
+    
+    
+    @traced('user.recommendations')
     def get_all_recommendations_for_user(self, user: int, similarity_function = None, 
-                                         neighbor_size: int = 50, exclude_movies: set[int] = set()) -> list[tuple[int, float]]:
+                                         neighbor_size: int = 50, exclude_movies: set[int] = set(), 
+                                         n: int = None) -> list[tuple[int, float]]:
         """
         Get all movie recommendations for a user.
 
@@ -330,28 +815,79 @@ class UserRecommendation:
             user (int): ID of the user.
             similarity_function (function, optional): A function to compute similarity between users. If None, defaults to Pearson correlation.
             neighbor_size (int, optional): Number of neighbors to consider for recommendation. Defaults to 50.
+            n (int, optional): Only return the N recommendations with the highest prediction. If None, all of them are returned.
 
         Returns:
             List[tuple[int, float]]: List of tuples containing movie IDs and their predicted ratings.
         """
-        unrated_movies = self.dataset.get_movies_unrated_by_user(user)
+        neighbors = self.top_n_similar_users(user, similarity_function=similarity_function, n=neighbor_size)
 
-        # Predicted ratings for movies
-        predicted_ratings: list[tuple[int, float]] = []
+        return self.recommendations_from_neighbors(user, neighbors, n, exclude_movies)
 
-        neighbors = self.top_n_similar_users(user, similarity_function=similarity_function, n=neighbor_size)
 
-        for movie_id in unrated_movies:
-            if movie_id in exclude_movies:
-                continue
-            # Predict the rating for the movie
-            predicted_rating = self.prediction_from_neighbors(user, movie_id, neighbors)
-            predicted_ratings.append((movie_id, predicted_rating))
+    def recommendations_from_neighbors(self, user: int, neighbors: list[tuple[int, float]], n: int = None,
+                                       exclude_movies: set[int] = set()) -> list[tuple[int, float]]:
+        """
+        Ranks the movies not rated by a user by their predicted rating, given the neighbors of the user.
+
+        With N only the movies of the candidate generator are scored: every other movie would be predicted
+        as the user's mean rating, so the top N is completed with them only when fewer than N candidates
+        are predicted above the mean (ties in ascending movie ID order, as when scoring the whole catalog).
+
+        Args:
+            user (int): ID of the user.
+            neighbors (list[tuple[int, float]]): Neighbors of the user and their similarity scores.
+            n (int, optional): Only return the N recommendations with the highest prediction. If None, all of them are returned.
+            exclude_movies (set[int], optional): Movies that must not be recommended.
+
+        Returns:
+            List[tuple[int, float]]: List of tuples containing movie IDs and their predicted ratings.
+        """
+        if n is None:
+            # Sorted array of movie IDs, so that ties in the predictions are in ascending movie ID order
+            candidates = self.dataset.get_unrated_movies(user)
+            if len(exclude_movies) > 0:
+                candidates = candidates[~np.isin(candidates, list(exclude_movies))]
+        else:
+            candidates = self.candidate_generator.candidates(user, neighbors, exclude_movies)
+
+        if self.vectorized:
+            predictions = self.predictions_from_neighbors(user, candidates, neighbors)
+        else:
+            predictions = np.array([self.prediction_from_neighbors(user, movie_id, neighbors)
+                                    for movie_id in candidates.tolist()], dtype=float)
 
         # Predicted ratings in descending order
-        predicted_ratings.sort(key=lambda x: x[1], reverse=True)
+        order = top_n_indices(predictions, n)
+        ranked = list(zip(candidates[order].tolist(), predictions[order].tolist()))
+
+        mean = self.dataset.get_user_mean_rating(user)
+        if n is None or (len(ranked) == n and ranked[-1][1] > mean):
+            return ranked
+
+        return self._complete_with_mean_fallbacks(user, candidates, predictions, mean, n, exclude_movies)
+
+
+    def _complete_with_mean_fallbacks(self, user: int, candidates: np.ndarray, predictions: np.ndarray, mean: float,
+                                      n: int, exclude_movies: set[int]) -> list[tuple[int, float]]:
+        # Fewer than N candidates are predicted above the mean: the movies that aren't candidates tie with
+        # the candidates predicted as the mean, and come before the candidates predicted below it
+        above = predictions > mean
+        ranked = [(movie, prediction) for movie, prediction in zip(candidates[above].tolist(), predictions[above].tolist())]
+        ranked = top_n_items(ranked, n)
+
+        unrated_movies = self.dataset.get_unrated_movies(user)
+        if len(exclude_movies) > 0:
+            unrated_movies = unrated_movies[~np.isin(unrated_movies, list(exclude_movies))]
+
+        at_mean = np.setdiff1d(unrated_movies, candidates[predictions != mean], assume_unique=True)[:n - len(ranked)]
+        ranked.extend((movie, mean) for movie in at_mean.tolist())
+
+        below = predictions < mean
+        below_ranked = [(movie, prediction) for movie, prediction in zip(candidates[below].tolist(), predictions[below].tolist())]
+        ranked.extend(top_n_items(below_ranked, n - len(ranked)))
 
-        return predicted_ratings
+        return ranked
     
     
     
@@ -369,7 +905,7 @@ class UserRecommendation:
         Returns:
             List[tuple[int, float]]: List of tuples containing movie IDs and their predicted ratings.
         """
-        movies_predicted_ratings = self.get_all_recommendations_for_user(user, similarity_function, neighbor_size, exclude_movies)
+        movies_predicted_ratings = self.get_all_recommendations_for_user(user, similarity_function, neighbor_size, exclude_movies, n)
         
         # uncomment the following lines if you want to normalize the predicted ratings between 0 and 5
         #